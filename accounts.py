@@ -0,0 +1,199 @@
+"""
+Per-account and multi-currency aggregates.
+
+The summary views, archived_summary and tag_aggregates add amounts up as
+they are, whatever their account and currency. That is right, and fastest,
+while every transaction is in the base currency and all accounts are shown
+together. When the dashboard or the summary asks for one account
+(?account=...) or the data holds other currencies, the aggregates come from
+the rows instead: one grouped query returns the sums per day and currency
+(and tag), fx.py converts those columns at once with the rate of each day,
+and pandas rolls the days up into the summary views' periods.
+
+The (account_id, accounting_date) index restricts the per-account
+queries to that account's rows, in date order. Transfers between own
+accounts are left out row by row when ?transfers=exclude is set.
+"""
+from collections import namedtuple
+
+from flask import request
+from sqlalchemy import and_, case, func, select
+
+from aggregates import TagStat
+from archive import transaction_source
+from cache import per_data_version
+from fx import base_currency, currency_codes, fx_rates, normalize_currency
+from models import db, BankAccount, Currency
+from refcache import tag_cache
+from sql_dialect import CALENDAR_COLUMNS, GRANULARITY_COLUMNS, recurrent_ids
+from transfers import PERIOD_FORMATS, transfer_leg_ids
+
+# strftime formats of the summary views' calendar columns
+CALENDAR_FORMATS = {'year': '%Y', 'month': '%m', 'week': '%W', 'day': '%d', 'day_of_week': '%w'}
+
+Account = namedtuple('Account', 'id number name currency count')
+
+# Per-day sums of the transactions of active patterns, next to total_in and total_out
+RECURRENT_COLUMNS = ('recurrent_in', 'recurrent_out')
+
+
+def account_filter(args=None):
+    """Id of the imported account asked for with ?account=<number>, or None for all accounts
+
+    Spaces and case are ignored. An account that was never imported counts as
+    no filter, so the per-data-version memos below only see known accounts.
+    """
+    key = _account_key((args if args is not None else request.args).get('account') or '')
+    if not key:
+        return None
+    for account in account_list():
+        if _account_key(account.number) == key:
+            return account.id
+    return None
+
+
+def _account_key(number):
+    return number.replace(' ', '').upper()
+
+
+@per_data_version
+def account_list():
+    """Every imported account, by account number"""
+    T = transaction_source()
+    rows = db.session.execute(
+        select(BankAccount.id, BankAccount.number, BankAccount.name, func.max(Currency.code), func.count())
+        .select_from(T)
+        .join(BankAccount, BankAccount.id == T.account_id)
+        .outerjoin(Currency, Currency.id == T.currency_id)
+        .group_by(BankAccount.id, BankAccount.number, BankAccount.name)
+        .order_by(BankAccount.number)
+    ).all()
+    return [Account(*row) for row in rows]
+
+
+@per_data_version
+def currencies():
+    """Normalized currency codes present in the transactions"""
+    T = transaction_source()
+    codes = select(Currency.code).select_from(T).outerjoin(Currency, Currency.id == T.currency_id).distinct()
+    return sorted({normalize_currency(currency) for (currency,) in db.session.execute(codes)})
+
+
+def unconverted_currencies():
+    """Currencies of the transactions that have no exchange rate"""
+    return fx_rates().missing(currencies())
+
+
+def use_row_aggregates(account):
+    """Whether aggregates must be summed from the rows rather than read pre-aggregated"""
+    return account is not None or any(currency != base_currency() for currency in currencies())
+
+
+def _sums(account, exclude_transfers, by_tag=False):
+    """DataFrame of income, expenses and count per day and currency (and tag), in the base currency"""
+    import pandas as pd
+
+    T = transaction_source()
+    keys = [T.accounting_date, T.currency_id] + ([T.tag_id] if by_tag else [])
+    statement = select(
+        *keys,
+        func.sum(case((T.amount > 0, T.amount), else_=0)),
+        func.sum(case((T.amount < 0, -T.amount), else_=0)),
+        func.count(),
+    ).group_by(*keys)
+    if not by_tag:
+        # Income and expenses of the active patterns' transactions (see sql_dialect.RECURRENT_IDS)
+        recurrent = recurrent_ids().subquery()
+        member = recurrent.c.transaction_id.is_not(None)
+        statement = statement.add_columns(
+            func.sum(case((and_(member, T.amount > 0), T.amount), else_=0)),
+            func.sum(case((and_(member, T.amount < 0), -T.amount), else_=0)),
+        ).select_from(T).outerjoin(recurrent, recurrent.c.transaction_id == T.id)
+    if account is not None:
+        statement = statement.where(T.account_id == account)
+    if by_tag:
+        statement = statement.where(T.tag_id.is_not(None))
+    if exclude_transfers:
+        statement = statement.where(T.id.not_in(transfer_leg_ids()))
+
+    columns = ['date', 'currency_id'] + (['tag_id'] if by_tag else []) + ['total_in', 'total_out', 'count'] \
+        + ([] if by_tag else list(RECURRENT_COLUMNS))
+    frame = pd.DataFrame(db.session.execute(statement).all(), columns=columns)
+    if frame.empty:
+        return frame
+
+    codes = currency_codes(frame['currency_id'])
+    rates = fx_rates()
+    for column in ('total_in', 'total_out') + (() if by_tag else RECURRENT_COLUMNS):
+        frame[column] = rates.convert(frame[column].to_numpy(), codes, frame['date'].to_numpy())
+    return frame
+
+
+@per_data_version
+def daily_flows(account=None, exclude_transfers=False):
+    """DataFrame of total_in, total_out, count, recurrent_in and recurrent_out per day (oldest first),
+    in the base currency"""
+    columns = ['total_in', 'total_out', 'count', *RECURRENT_COLUMNS]
+    frame = _sums(account, exclude_transfers)
+    if frame.empty:
+        return frame[['date', *columns]].set_index('date')
+    return frame.groupby('date', sort=True)[columns].sum()
+
+
+def converted_daily_totals(account=None, exclude_transfers=False):
+    """[(date, income, expenses)] like archive.daily_totals(), per account and converted"""
+    days = daily_flows(account, exclude_transfers)
+    return list(zip(days.index, days['total_in'].tolist(), days['total_out'].tolist()))
+
+
+def converted_totals(account=None, exclude_transfers=False):
+    """(total income, total expenses) like archive.overall_totals(), per account and converted"""
+    days = daily_flows(account, exclude_transfers)
+    return float(days['total_in'].sum()), float(days['total_out'].sum())
+
+
+def period_summaries(granularity, account=None, exclude_transfers=False):
+    """Rows of the summary view of granularity (newest first), per account and converted"""
+    import pandas as pd
+
+    days = daily_flows(account, exclude_transfers)
+    if days.empty:
+        return []
+
+    index = pd.DatetimeIndex(pd.to_datetime(days.index))
+    keys = index.strftime(PERIOD_FORMATS[granularity])
+    grouped = days.set_axis(keys).groupby(level=0, sort=True).sum()
+    starts = pd.Series(index, index=keys).groupby(level=0, sort=True).min()
+
+    periods = []
+    newest_first = grouped.iloc[::-1]
+    for period, total_in, total_out, count, recurrent_in, recurrent_out in zip(
+            newest_first.index, newest_first['total_in'], newest_first['total_out'], newest_first['count'],
+            newest_first['recurrent_in'], newest_first['recurrent_out']):
+        start = starts[period]
+        row = {'period': period}
+        for column in CALENDAR_COLUMNS:
+            row[column] = start.strftime(CALENDAR_FORMATS[column]) \
+                if column in GRANULARITY_COLUMNS[granularity] else None
+        row.update(total_in=float(total_in), total_out=float(total_out),
+                   balance=float(total_in - total_out), transaction_count=int(count),
+                   recurrent_in=float(recurrent_in), recurrent_out=float(recurrent_out),
+                   discretionary=float(total_out - recurrent_out))
+        periods.append(row)
+    return periods
+
+
+def converted_tag_stats(account=None, exclude_transfers=False):
+    """Same as aggregates.tag_aggregate_stats(), per account and converted"""
+    frame = _sums(account, exclude_transfers, by_tag=True)
+    if frame.empty:
+        return []
+    per_tag = frame.groupby('tag_id', sort=True)[['total_in', 'total_out', 'count']].sum()
+    tags = tag_cache().by_id()
+    return [
+        TagStat(tags[tag_id].name, tags[tag_id].color, float(total_in - total_out), int(count),
+                float(total_in), float(total_out))
+        for tag_id, total_in, total_out, count in zip(per_tag.index.astype(int), per_tag['total_in'],
+                                                     per_tag['total_out'], per_tag['count'])
+        if tag_id in tags
+    ]
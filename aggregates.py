@@ -0,0 +1,124 @@
+"""
+Incrementally maintained per-tag aggregates.
+
+The tag histograms (analyze, summary, chart data API) used to run a grouped
+SUM over every transaction on each page load. tag_aggregates keeps one row
+per tag with its totals instead: every write that changes a transaction's tag
+adjusts the old and new tag by the moved amounts, so reads cost O(tags).
+
+Transactions are never deleted and their amounts never change; archiving
+keeps tags, so it leaves the aggregates untouched. `python migrate_aggregates.py`
+rebuilds the table from scratch.
+"""
+from collections import namedtuple
+
+from sqlalchemy import case, delete, func, insert, select, union_all, update
+
+from cube import retag_cube
+from models import db, TagAggregate, Transaction, ArchivedTransaction
+from refcache import tag_cache
+from transfers import transfer_tag_totals
+
+
+def _delta_columns(amount):
+    """Aggregate columns for a set of rows, in TagAggregate column order"""
+    return (
+        func.sum(amount),
+        func.count(),
+        func.sum(case((amount > 0, amount), else_=0)),
+        func.sum(case((amount < 0, -amount), else_=0)),
+    )
+
+
+def _apply(tag_id, total_amount, transaction_count, total_in, total_out):
+    values = dict(
+        total_amount=TagAggregate.total_amount + total_amount,
+        transaction_count=TagAggregate.transaction_count + transaction_count,
+        total_in=TagAggregate.total_in + total_in,
+        total_out=TagAggregate.total_out + total_out,
+    )
+    updated = db.session.execute(
+        update(TagAggregate).where(TagAggregate.tag_id == tag_id).values(**values)
+    ).rowcount
+    if not updated:
+        db.session.add(TagAggregate(tag_id=tag_id, total_amount=total_amount,
+                                    transaction_count=transaction_count,
+                                    total_in=total_in, total_out=total_out))
+        db.session.flush()
+
+
+def retag(transaction_ids, new_tag_id):
+    """Move the given hot transactions' amounts from their current tags to new_tag_id
+
+    Must run before the tag_id UPDATE, in the same transaction.
+    """
+    if not transaction_ids:
+        return
+    retag_cube(transaction_ids, new_tag_id)
+
+    current = db.session.query(Transaction.tag_id, *_delta_columns(Transaction.amount)).filter(
+        Transaction.id.in_(transaction_ids),
+        # Rows already carrying the new tag don't move (NULL tag counts as different)
+        (Transaction.tag_id != new_tag_id) | Transaction.tag_id.is_(None),
+    ).group_by(Transaction.tag_id).all()
+
+    moved = [0, 0, 0, 0]
+    for tag_id, total_amount, transaction_count, total_in, total_out in current:
+        if tag_id is not None:
+            _apply(tag_id, -total_amount, -transaction_count, -total_in, -total_out)
+        moved = [m + v for m, v in zip(moved, (total_amount, transaction_count, total_in, total_out))]
+
+    if moved[1]:
+        _apply(new_tag_id, *moved)
+
+
+TagStat = namedtuple('TagStat', 'name color total count total_in total_out')
+TagAggregateRow = namedtuple('TagAggregateRow', 'tag_id total_amount transaction_count total_in total_out')
+
+
+def tag_aggregate_stats(exclude_transfers=False):
+    """(name, color, total, count, total_in, total_out) per tag that has transactions
+
+    With exclude_transfers, the tagged legs of transfers between own accounts
+    are taken out of the totals.
+    """
+    rows = db.session.query(
+        TagAggregate.tag_id,
+        TagAggregate.total_amount,
+        TagAggregate.transaction_count,
+        TagAggregate.total_in,
+        TagAggregate.total_out,
+    ).filter(TagAggregate.transaction_count > 0).order_by(TagAggregate.tag_id).all()
+
+    if exclude_transfers:
+        moved = transfer_tag_totals()
+        if moved:
+            rows = [TagAggregateRow(row.tag_id, *(value - delta for value, delta
+                                                  in zip(row[1:], moved.get(row.tag_id, (0, 0, 0, 0)))))
+                    for row in rows]
+            rows = [row for row in rows if row.transaction_count > 0]
+
+    # Names and colors come from the process-local tag cache
+    tags = tag_cache().by_id()
+    if any(row.tag_id not in tags for row in rows):
+        tag_cache().invalidate()
+        tags = tag_cache().by_id()
+
+    return [TagStat(tags[row.tag_id].name, tags[row.tag_id].color, *row[1:])
+            for row in rows if row.tag_id in tags]
+
+
+def rebuild_tag_aggregates():
+    """Recompute tag_aggregates from the hot and archived transactions"""
+    hot = Transaction.__table__
+    cold = ArchivedTransaction.__table__
+    tagged = union_all(
+        select(hot.c.tag_id, hot.c.amount).where(hot.c.tag_id.is_not(None)),
+        select(cold.c.tag_id, cold.c.amount).where(cold.c.tag_id.is_not(None)),
+    ).subquery()
+
+    db.session.execute(delete(TagAggregate))
+    db.session.execute(insert(TagAggregate).from_select(
+        ['tag_id', 'total_amount', 'transaction_count', 'total_in', 'total_out'],
+        select(tagged.c.tag_id, *_delta_columns(tagged.c.amount)).group_by(tagged.c.tag_id),
+    ))
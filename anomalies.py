@@ -0,0 +1,266 @@
+"""
+Spending anomalies: periods that stand out from their own recent history.
+
+Every series (total spending, total income, and spending per tag) is compared
+with a trailing window of its previous periods. The score is the robust
+z-score of Iglewicz and Hoaglin, 0.6745 * (x - median) / MAD, which one large
+month in the window does not drag along the way a mean and standard deviation
+would. When more than half of the window is identical (often zero for a tag
+that is rarely used) the MAD is 0 and the mean absolute deviation stands in.
+The rolling mean over the same window is returned for display.
+
+The daily sums are read with one grouped query over hot and archived rows
+(or from the columnar snapshot when it is current, see snapshot.py),
+bucketed into the same period keys as the summary views, and scored for
+all series and periods at once with NumPy sliding windows. The scores are
+kept per data version, so repeat requests only filter them.
+"""
+from bisect import bisect_right
+from collections import namedtuple
+
+from sqlalchemy import and_, case, func, or_, select
+
+from archive import transaction_source
+from cache import per_data_version
+from models import db
+from refcache import tag_cache
+from snapshot import snapshot_frame
+
+# Same period keys as the summary views (weeks start on Monday)
+PERIOD_FORMATS = {'day': '%Y-%m-%d', 'week': '%Y-W%W', 'month': '%Y-%m'}
+
+# Trailing periods each one is compared with
+WINDOWS = {'day': 28, 'week': 12, 'month': 12}
+
+# |z| from which a period is flagged (Iglewicz and Hoaglin)
+DEFAULT_THRESHOLD = 3.5
+
+# Ignore deviations smaller than this amount, whatever their score
+DEFAULT_MIN_DEVIATION = 10.0
+
+# Series keys besides the per-tag spending ones ('tag:<id>')
+TOTAL_SERIES = ('total_out', 'total_in')
+
+Scores = namedtuple('Scores', 'periods starts ends complete series values mean median z')
+
+
+def _daily_sums():
+    """DataFrame of date, tag_id, out (positive) and in per day and tag"""
+    import pandas as pd
+
+    snapshot = snapshot_frame(('accounting_date', 'amount'), ('tag_id',))
+    if snapshot is not None:
+        amount = snapshot['amount']
+        return (snapshot.assign(out=(-amount).clip(lower=0), **{'in': amount.clip(lower=0)})
+                .groupby(['accounting_date', 'tag_id'], dropna=False)[['out', 'in']].sum()
+                .reset_index().rename(columns={'accounting_date': 'date'}))
+
+    T = transaction_source()
+    rows = db.session.execute(
+        select(
+            T.accounting_date,
+            T.tag_id,
+            func.sum(case((T.amount < 0, -T.amount), else_=0)),
+            func.sum(case((T.amount > 0, T.amount), else_=0)),
+        ).group_by(T.accounting_date, T.tag_id)
+    ).all()
+    return pd.DataFrame(rows, columns=['date', 'tag_id', 'out', 'in'])
+
+
+def _daily_frame():
+    """Days x series DataFrame of amounts, every calendar day present"""
+    import pandas as pd
+
+    frame = _daily_sums()
+    if frame.empty:
+        return None
+
+    frame['date'] = pd.to_datetime(frame['date'])
+    days = pd.date_range(frame['date'].min(), frame['date'].max(), freq='D')
+
+    totals = frame.groupby('date')[['out', 'in']].sum()
+    daily = pd.DataFrame({'total_out': totals['out'], 'total_in': totals['in']})
+    tagged = frame[frame['tag_id'].notna()]
+    if not tagged.empty:
+        per_tag = tagged.pivot_table(index='date', columns='tag_id', values='out', aggfunc='sum')
+        per_tag.columns = [f'tag:{int(tag_id)}' for tag_id in per_tag.columns]
+        daily = daily.join(per_tag)
+    return daily.reindex(days).fillna(0.0)
+
+
+def _rolling_scores(values, window):
+    """(mean, median, z) of each row against the `window` rows before it
+
+    values is a periods x series array; rows without a full window get NaN.
+    """
+    import numpy as np
+    from numpy.lib.stride_tricks import sliding_window_view
+
+    mean = np.full(values.shape, np.nan)
+    median = np.full(values.shape, np.nan)
+    z = np.full(values.shape, np.nan)
+    if len(values) <= window:
+        return mean, median, z
+
+    # windows[i] holds rows i .. i+window-1 and is the history of row i+window
+    windows = sliding_window_view(values, window, axis=0)[:-1]
+    current = values[window:]
+    window_median = np.median(windows, axis=-1)
+    deviations = np.abs(windows - window_median[..., None])
+    mad = np.median(deviations, axis=-1)
+    mean_ad = deviations.mean(axis=-1)
+
+    difference = current - window_median
+    with np.errstate(divide='ignore', invalid='ignore'):
+        score = np.where(mad > 0, 0.6745 * difference / mad,
+                         np.where(mean_ad > 0, difference / (1.2533 * mean_ad), 0.0))
+
+    mean[window:] = windows.mean(axis=-1)
+    median[window:] = window_median
+    z[window:] = score
+    return mean, median, z
+
+
+@per_data_version
+def period_scores(granularity):
+    """Scores of every series over every period of a granularity, or None without data"""
+    daily = _daily_frame()
+    if daily is None:
+        return None
+
+    keys = daily.index.strftime(PERIOD_FORMATS[granularity])
+    grouped = daily.groupby(keys, sort=True).sum()
+    bounds = daily.index.to_series().groupby(keys, sort=True).agg(['min', 'max', 'count'])
+    if granularity == 'week':
+        complete = bounds['count'] == 7
+    elif granularity == 'month':
+        complete = bounds['count'] == bounds['min'].dt.days_in_month
+    else:
+        complete = bounds['count'] == 1
+
+    values = grouped.to_numpy(dtype=float)
+    mean, median, z = _rolling_scores(values, WINDOWS[granularity])
+    return Scores(
+        periods=list(grouped.index),
+        starts=[d.date() for d in bounds['min']],
+        ends=[d.date() for d in bounds['max']],
+        complete=complete.to_numpy(),
+        series=list(grouped.columns),
+        values=values, mean=mean, median=median, z=z,
+    )
+
+
+def find_anomalies(granularity, threshold=DEFAULT_THRESHOLD, direction='both',
+                   min_deviation=DEFAULT_MIN_DEVIATION):
+    """Flagged (period, series) cells, most recent first
+
+    direction is 'high', 'low' or 'both'. Each anomaly is a dict with the
+    period key and bounds, the series ('total_out', 'total_in' or 'tag') and
+    tag, the amount, its rolling mean and median, and the z-score.
+    """
+    import numpy as np
+
+    scores = period_scores(granularity)
+    if scores is None:
+        return []
+
+    z = np.nan_to_num(scores.z)
+    deviation = np.abs(scores.values - np.nan_to_num(scores.median))
+    if direction == 'high':
+        flagged = z >= threshold
+    elif direction == 'low':
+        flagged = z <= -threshold
+    else:
+        flagged = np.abs(z) >= threshold
+    # Weeks cut by the new year and the first and last months of data are
+    # only partly covered and would look low: they are never flagged
+    flagged &= (deviation >= min_deviation) & scores.complete[:, None]
+
+    tags = tag_cache().by_id()
+    anomalies = []
+    for row, column in sorted(zip(*np.nonzero(flagged)), key=lambda cell: (-cell[0], cell[1])):
+        key = scores.series[column]
+        anomaly = {
+            'period': scores.periods[row],
+            'start': scores.starts[row].isoformat(),
+            'end': scores.ends[row].isoformat(),
+            'series': key,
+            'tag_id': None,
+            'tag': None,
+            'color': None,
+            'amount': round(float(scores.values[row, column]), 2),
+            'rolling_mean': round(float(scores.mean[row, column]), 2),
+            'median': round(float(scores.median[row, column]), 2),
+            'z': round(float(scores.z[row, column]), 2),
+            'direction': 'high' if z[row, column] > 0 else 'low',
+        }
+        if key.startswith('tag:'):
+            tag_id = int(key[4:])
+            tag = tags.get(tag_id)
+            anomaly.update(series='tag', tag_id=tag_id,
+                           tag=tag.name if tag else None, color=tag.color if tag else None)
+        anomalies.append(anomaly)
+    return anomalies
+
+
+def attach_transactions(anomalies, per_anomaly=5):
+    """Add the largest transactions behind each anomaly, read with a single query and sorted out in one pass"""
+    from datetime import date
+
+    if not anomalies:
+        return anomalies
+
+    T = transaction_source(min(date.fromisoformat(a['start']) for a in anomalies))
+
+    def criteria(anomaly):
+        clauses = [T.accounting_date >= date.fromisoformat(anomaly['start']),
+                   T.accounting_date <= date.fromisoformat(anomaly['end'])]
+        clauses.append(T.amount > 0 if anomaly['series'] == 'total_in' else T.amount < 0)
+        if anomaly['series'] == 'tag':
+            clauses.append(T.tag_id == anomaly['tag_id'])
+        return and_(*clauses)
+
+    rows = db.session.execute(
+        select(T.id, T.accounting_date, T.amount, T.description, T.tag_id)
+        .where(or_(*(criteria(a) for a in anomalies)))
+        .order_by(func.abs(T.amount).desc())
+    ).all()
+
+    # One pass over the rows, largest first: the periods of a granularity do not
+    # overlap, so a row falls in at most one period (found by bisection) and
+    # belongs to at most its total's and its tag's anomaly there
+    bounds = sorted({(a['start'], a['end']) for a in anomalies})
+    starts = [date.fromisoformat(start) for start, _ in bounds]
+    ends = [date.fromisoformat(end) for _, end in bounds]
+    positions = {period: i for i, period in enumerate(bounds)}
+    cells = {}
+    for anomaly in anomalies:
+        anomaly['transactions'] = []
+        series = (anomaly['series'], anomaly['tag_id'])
+        cells[(positions[(anomaly['start'], anomaly['end'])], series)] = anomaly['transactions']
+    for row in rows:
+        period = bisect_right(starts, row.accounting_date) - 1
+        if period < 0 or row.accounting_date > ends[period]:
+            continue
+        series = [('total_in', None)] if row.amount > 0 else [('total_out', None), ('tag', row.tag_id)]
+        for key in series:
+            matches = cells.get((period, key))
+            if matches is not None and len(matches) < per_anomaly:
+                matches.append({
+                    'id': row.id,
+                    'date': row.accounting_date.isoformat(),
+                    'amount': row.amount,
+                    'description': row.description,
+                })
+    return anomalies
+
+
+def flagged_totals(granularity):
+    """{period: {'total_out': anomaly, 'total_in': anomaly}} for the summary page"""
+    if granularity not in PERIOD_FORMATS:
+        return {}
+    flagged = {}
+    for anomaly in find_anomalies(granularity):
+        if anomaly['series'] in TOTAL_SERIES:
+            flagged.setdefault(anomaly['period'], {})[anomaly['series']] = anomaly
+    return flagged
@@ -1,16 +1,40 @@
 from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-from functools import wraps
+from functools import partial, wraps
 import os
-import pandas as pd
-import plotly
-import plotly.graph_objs as go
-import json
+import click
 from datetime import datetime
-from sqlalchemy import or_, func
+from sqlalchemy import func, insert, or_
 
 from config import Config
-from models import db, User, Transaction, Tag, Pattern
+from models import db, User, Transaction, TransactionText, Pattern, TransferPair
+from accounts import (account_filter, account_list, converted_daily_totals, converted_tag_stats,
+                      converted_totals, period_summaries, unconverted_currencies, use_row_aggregates)
+from db_profile import init_engine_profile
+from db_routing import read_only
+from dimensions import DimensionLookup
+from archive import (archive_before, archive_boundary, daily_totals, is_archived_duplicate,
+                     overall_totals, transaction_source)
+from clustering import cluster_amounts, parse_tolerance
+from cube import AggregateError, aggregate, parse_dimensions, parse_filters, rebuild_cube
+from charts import ENCODINGS, cumulative_chart, tag_totals_chart
+from cache import bump_data_version, cached_response, init_response_cache
+from metrics import init_metrics
+from parallel_queries import init_query_pool, run_concurrently
+from refcache import init_reference_caches, tag_cache, user_cache
+from aggregates import tag_aggregate_stats
+from anomalies import (DEFAULT_THRESHOLD, PERIOD_FORMATS, WINDOWS, attach_transactions, find_anomalies,
+                       flagged_totals)
+from forecast import MAX_MONTHS as MAX_FORECAST_MONTHS, forecast
+from fx import load_rates
+from snapshot import COMPRESSIONS, SnapshotUnavailable, init_snapshot, refresh_labels, snapshot_frame, write_snapshot
+from pipeline import STAGES, IdRange, run_pipeline, summarize
+from transfers import (detect_transfers, exclude_requested, list_transfers, recurrent_transfer_period_totals,
+                       transfer_period_totals, transfer_total, without_transfers)
+from operations import (MAX_BATCH_OPERATIONS, OperationError, deactivate_pattern, run_batch, set_merge_id,
+                        tag_many, tag_one)
+from query_builder import (JSON_COLUMNS, LIST_COLUMNS, SORT_COLUMNS, RowPagination, TransactionFilter,
+                           row_select, row_to_json)
 
 app = Flask(__name__)
 app.config.from_object(Config)
@@ -43,6 +67,12 @@ app.wsgi_app = PrefixMiddleware(app.wsgi_app, prefix="/myfin")
 
 # Initialize extensions
 db.init_app(app)
+init_engine_profile(app, db)
+init_response_cache(app)
+init_reference_caches(app)
+init_metrics(app, db)
+init_query_pool(app)
+init_snapshot(app)
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
@@ -52,7 +82,7 @@ os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
 @login_manager.user_loader
 def load_user(user_id):
-    return db.session.get(User, int(user_id))
+    return user_cache().get(int(user_id))
 
 def admin_required(f):
     @wraps(f)
@@ -65,59 +95,45 @@ def admin_required(f):
 
 # Routes
 @app.route('/')
+@read_only
+@cached_response
 def index():
     if not current_user.is_authenticated:
         return redirect(url_for('login'))
     
-    # Calculate totals
-    total_in = db.session.query(func.sum(Transaction.amount)).filter(Transaction.amount > 0).scalar() or 0
-    total_out = abs(db.session.query(func.sum(Transaction.amount)).filter(Transaction.amount < 0).scalar() or 0)
+    account = account_filter()
+    exclude_transfers = exclude_requested()
+    reads = {'accounts': account_list, 'unconverted': unconverted_currencies}
+    if use_row_aggregates(account):
+        # One account, or several currencies: summed from the rows in the base currency
+        found = run_concurrently(days=partial(converted_daily_totals, account, exclude_transfers), **reads)
+        days = found['days']
+        total_in, total_out = converted_totals(account, exclude_transfers)  # same daily flows, cached
+    else:
+        # Calculate totals (archived years come pre-aggregated)
+        if exclude_transfers:
+            reads.update(moved=transfer_total, days=lambda: without_transfers(daily_totals()))
+        else:
+            reads.update(days=daily_totals)
+        found = run_concurrently(totals=overall_totals, **reads)
+        total_in, total_out = found['totals']
+        days = found['days']
+        if exclude_transfers:
+            total_in, total_out = total_in - found['moved'], total_out - found['moved']
     balance = total_in - total_out
     
-    # Get cumulative data for plot
-    transactions = Transaction.query.order_by(Transaction.accounting_date.asc()).all()
-    
-    if transactions:
-        dates = []
-        cumulative_in = []
-        cumulative_out = []
-        running_in = 0
-        running_out = 0
-        
-        for trans in transactions:
-            dates.append(trans.accounting_date)
-            if trans.amount > 0:
-                running_in += trans.amount
-            else:
-                running_out += abs(trans.amount)
-            cumulative_in.append(running_in)
-            cumulative_out.append(running_out)
-        
-        # Create plotly figure
-        fig = go.Figure()
-        fig.add_trace(go.Scatter(x=dates, y=cumulative_in, mode='lines', name='Cumulative Income', 
-                                 line=dict(color='#10b981', width=2)))
-        fig.add_trace(go.Scatter(x=dates, y=cumulative_out, mode='lines', name='Cumulative Expenses',
-                                 line=dict(color='#ef4444', width=2)))
-        
-        fig.update_layout(
-            title='Cumulative Income vs Expenses Over Time',
-            xaxis_title='Date',
-            yaxis_title='Amount (EUR)',
-            hovermode='x unified',
-            template='plotly_white',
-            height=400
-        )
-        
-        plot_json = json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder)
-    else:
-        plot_json = None
+    # Compact cumulative chart data, the template builds the Plotly traces
+    chart_data = cumulative_chart(days, encoding='delta') if days else None
     
     return render_template('index.html', 
                          total_in=total_in, 
                          total_out=total_out, 
                          balance=balance,
-                         plot_json=plot_json)
+                         chart_data=chart_data,
+                         exclude_transfers=exclude_transfers,
+                         accounts=found['accounts'],
+                         account=account,
+                         unconverted=found['unconverted'])
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -146,110 +162,58 @@ def logout():
     return redirect(url_for('login'))
 
 @app.route('/analyze')
+@read_only
 @login_required
+@cached_response
 def analyze():
     # Get query parameters
-    transaction_type = request.args.get('type', 'all')  # 'in', 'out', 'all'
-    search_text = request.args.get('search', '')
-    start_date = request.args.get('start_date', '')
-    end_date = request.args.get('end_date', '')
+    filters = TransactionFilter.from_args(request.args)
     sort_by = request.args.get('sort_by', 'accounting_date')
     sort_order = request.args.get('sort_order', 'desc')
     page = request.args.get('page', 1, type=int)
     per_page = 50
     
-    # Build query
-    query = Transaction.query
-    
-    # Filter by type
-    if transaction_type == 'in':
-        query = query.filter(Transaction.amount > 0)
-    elif transaction_type == 'out':
-        query = query.filter(Transaction.amount < 0)
-    
-    # Filter by search text
-    if search_text:
-        query = query.filter(
-            or_(
-                Transaction.description.ilike(f'%{search_text}%'),
-                Transaction.details.ilike(f'%{search_text}%'),
-                Transaction.account_name.ilike(f'%{search_text}%'),
-                Transaction.counterparty_account.ilike(f'%{search_text}%')
-            )
-        )
-    
-    # Filter by date range
-    if start_date:
-        try:
-            start_dt = datetime.strptime(start_date, '%Y-%m-%d').date()
-            query = query.filter(Transaction.accounting_date >= start_dt)
-        except ValueError:
-            pass
-    
-    if end_date:
-        try:
-            end_dt = datetime.strptime(end_date, '%Y-%m-%d').date()
-            query = query.filter(Transaction.accounting_date <= end_dt)
-        except ValueError:
-            pass
-    
-    # Apply sorting
-    sort_column = getattr(Transaction, sort_by, Transaction.accounting_date)
+    # Apply sorting (on the selected columns: the counterparty comes from a join)
+    rows = filters.rows(LIST_COLUMNS)
+    sort_column = rows.selected_columns[sort_by if sort_by in SORT_COLUMNS else 'accounting_date']
     if sort_order == 'asc':
-        query = query.order_by(sort_column.asc())
+        sort_column = sort_column.asc()
     else:
-        query = query.order_by(sort_column.desc())
-    
-    # Paginate
-    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+        sort_column = sort_column.desc()
+    
+    # Paginate (rows carry only the table's columns and the tag name), and the
+    # tag histogram data: maintained totals, or a grouped query over the filtered rows
+    found = run_concurrently(
+        pagination=lambda: RowPagination(select=rows.order_by(sort_column),
+                                         session=db.session, page=page, per_page=per_page, error_out=False),
+        tag_stats=filters.tag_totals if filters.active else tag_aggregate_stats,
+    )
+    pagination = found['pagination']
     transactions = pagination.items
     
     # Get all tags for dropdown
-    tags = Tag.query.order_by(Tag.name).all()
-    
-    # Calculate tag statistics for histogram
-    tag_stats = db.session.query(
-        Tag.name,
-        Tag.color,
-        func.sum(Transaction.amount).label('total')
-    ).join(Transaction).group_by(Tag.id).all()
-    
-    # Create histogram
-    if tag_stats:
-        tag_names = [stat.name for stat in tag_stats]
-        tag_totals = [stat.total for stat in tag_stats]
-        tag_colors = [stat.color for stat in tag_stats]
-        
-        fig = go.Figure(data=[
-            go.Bar(x=tag_names, y=tag_totals, marker_color=tag_colors)
-        ])
-        
-        fig.update_layout(
-            title='Transaction Amounts by Tag',
-            xaxis_title='Tag',
-            yaxis_title='Total Amount (EUR)',
-            template='plotly_white',
-            height=300
-        )
-        
-        histogram_json = json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder)
-    else:
-        histogram_json = None
+    tags = tag_cache().all()
+    
+    tag_stats = found['tag_stats']
+    histogram_data = tag_totals_chart(tag_stats) if tag_stats else None
     
     return render_template('analyze.html',
                          transactions=transactions,
                          pagination=pagination,
                          tags=tags,
-                         transaction_type=transaction_type,
-                         search_text=search_text,
-                         start_date=start_date,
-                         end_date=end_date,
+                         transaction_type=filters.transaction_type,
+                         search_text=filters.search_text,
+                         start_date=filters.start_date,
+                         end_date=filters.end_date,
+                         transfers='exclude' if filters.exclude_transfers else None,
                          sort_by=sort_by,
                          sort_order=sort_order,
-                         histogram_json=histogram_json)
+                         histogram_data=histogram_data)
 
 @app.route('/summary')
+@read_only
 @login_required
+@cached_response
 def summary():
     """Summary analysis page with different granularities"""
     from sqlalchemy import text
@@ -257,6 +221,8 @@ def summary():
     import calendar
     
     granularity = request.args.get('granularity', 'month')  # day, week, month, year
+    exclude_transfers = exclude_requested()
+    account = account_filter()
     
     # Map granularity to view name
     view_map = {
@@ -271,87 +237,133 @@ def summary():
     
     view_name = view_map[granularity]
     
-    # Query the view
     try:
-        query = text(f"""
-            SELECT 
-                period,
-                year,
-                {"month," if granularity in ['month', 'day'] else ''}
-                {"week," if granularity == 'week' else ''}
-                {"day, day_of_week," if granularity == 'day' else ''}
-                total_in,
-                total_out,
-                balance,
-                transaction_count
-                {", period_start, period_end" if granularity != 'day' else ''}
-            FROM {view_name}
-            ORDER BY period DESC
-        """)
+        row_aggregates = use_row_aggregates(account)
+
+        def query_periods():
+            if row_aggregates:
+                # One account, or several currencies: summed from the rows in the base currency
+                periods_data = period_summaries(granularity, account, exclude_transfers)
+            else:
+                # Query the view
+                query = text(f"""
+                    SELECT 
+                        period,
+                        year,
+                        {"month," if granularity in ['month', 'day'] else ''}
+                        {"week," if granularity == 'week' else ''}
+                        {"day, day_of_week," if granularity == 'day' else ''}
+                        total_in,
+                        total_out,
+                        balance,
+                        transaction_count,
+                        recurrent_in,
+                        recurrent_out,
+                        discretionary
+                        {", period_start, period_end" if granularity != 'day' else ''}
+                    FROM {view_name}
+                    ORDER BY period DESC
+                """)
         
-        result = db.session.execute(query)
-        periods_data = []
+                result = db.session.execute(query)
+                periods_data = []
         
-        for row in result:
-            # Parse row based on granularity
-            if granularity == 'day':
-                # Columns: period, year, month, day, day_of_week, total_in, total_out, balance, transaction_count
-                period_data = {
-                    'period': row[0],
-                    'year': row[1],
-                    'month': row[2],
-                    'week': None,
-                    'day': row[3],
-                    'day_of_week': row[4],
-                    'total_in': row[5],
-                    'total_out': row[6],
-                    'balance': row[7],
-                    'transaction_count': row[8],
-                }
-            elif granularity == 'week':
-                # Columns: period, year, week, total_in, total_out, balance, transaction_count, period_start, period_end
-                period_data = {
-                    'period': row[0],
-                    'year': row[1],
-                    'month': None,
-                    'week': row[2],
-                    'day': None,
-                    'day_of_week': None,
-                    'total_in': row[3],
-                    'total_out': row[4],
-                    'balance': row[5],
-                    'transaction_count': row[6],
-                }
-            elif granularity == 'month':
-                # Columns: period, year, month, total_in, total_out, balance, transaction_count, period_start, period_end
-                period_data = {
-                    'period': row[0],
-                    'year': row[1],
-                    'month': row[2],
-                    'week': None,
-                    'day': None,
-                    'day_of_week': None,
-                    'total_in': row[3],
-                    'total_out': row[4],
-                    'balance': row[5],
-                    'transaction_count': row[6],
-                }
-            else:  # year
-                # Columns: period, year, total_in, total_out, balance, transaction_count, period_start, period_end
-                period_data = {
-                    'period': row[0],
-                    'year': row[1],
-                    'month': None,
-                    'week': None,
-                    'day': None,
-                    'day_of_week': None,
-                    'total_in': row[2],
-                    'total_out': row[3],
-                    'balance': row[4],
-                    'transaction_count': row[5],
-                }
+                for row in result:
+                    # Parse row based on granularity
+                    if granularity == 'day':
+                        # Columns: period, year, month, day, day_of_week, total_in, total_out, balance, transaction_count
+                        period_data = {
+                            'period': row[0],
+                            'year': row[1],
+                            'month': row[2],
+                            'week': None,
+                            'day': row[3],
+                            'day_of_week': row[4],
+                            'total_in': row[5],
+                            'total_out': row[6],
+                            'balance': row[7],
+                            'transaction_count': row[8],
+                        }
+                    elif granularity == 'week':
+                        # Columns: period, year, week, total_in, total_out, balance, transaction_count, period_start, period_end
+                        period_data = {
+                            'period': row[0],
+                            'year': row[1],
+                            'month': None,
+                            'week': row[2],
+                            'day': None,
+                            'day_of_week': None,
+                            'total_in': row[3],
+                            'total_out': row[4],
+                            'balance': row[5],
+                            'transaction_count': row[6],
+                        }
+                    elif granularity == 'month':
+                        # Columns: period, year, month, total_in, total_out, balance, transaction_count, period_start, period_end
+                        period_data = {
+                            'period': row[0],
+                            'year': row[1],
+                            'month': row[2],
+                            'week': None,
+                            'day': None,
+                            'day_of_week': None,
+                            'total_in': row[3],
+                            'total_out': row[4],
+                            'balance': row[5],
+                            'transaction_count': row[6],
+                        }
+                    else:  # year
+                        # Columns: period, year, total_in, total_out, balance, transaction_count, period_start, period_end
+                        period_data = {
+                            'period': row[0],
+                            'year': row[1],
+                            'month': None,
+                            'week': None,
+                            'day': None,
+                            'day_of_week': None,
+                            'total_in': row[2],
+                            'total_out': row[3],
+                            'balance': row[4],
+                            'transaction_count': row[5],
+                        }
+                    
+                    # Split of the totals by membership of the validated patterns
+                    period_data['recurrent_in'] = row.recurrent_in
+                    period_data['recurrent_out'] = row.recurrent_out
+                    period_data['discretionary'] = row.discretionary
             
-            periods_data.append(period_data)
+                    periods_data.append(period_data)
+        
+                # Take the legs of transfers between own accounts out of each period
+                if exclude_transfers:
+                    moved = transfer_period_totals(granularity)
+                    moved_recurrent = recurrent_transfer_period_totals(granularity)
+                    for period in periods_data:
+                        moved_in, moved_out, legs = moved.get(period['period'], (0, 0, 0))
+                        recurrent_in, recurrent_out = moved_recurrent.get(period['period'], (0, 0))
+                        period['total_in'] -= moved_in
+                        period['total_out'] -= moved_out
+                        period['balance'] = period['total_in'] - period['total_out']
+                        period['transaction_count'] -= legs
+                        period['recurrent_in'] -= recurrent_in
+                        period['recurrent_out'] -= recurrent_out
+                        period['discretionary'] -= moved_out - recurrent_out
+            return periods_data
+
+        if row_aggregates:
+            query_tag_stats = partial(converted_tag_stats, account, exclude_transfers)
+        else:
+            query_tag_stats = partial(tag_aggregate_stats, exclude_transfers)
+        # Periods, tag distribution and the totals that stand out from their trailing
+        # window (day, week and month, all accounts only) are independent reads
+        found = run_concurrently(
+            periods=query_periods,
+            tag_stats=query_tag_stats,
+            flagged=partial(flagged_totals, granularity) if account is None else dict,
+            accounts=account_list,
+            unconverted=unconverted_currencies,
+        )
+        periods_data = found['periods']
         
         # Calculate averages
         if periods_data:
@@ -405,12 +417,7 @@ def summary():
         
         # Get tag distribution for selected granularity
         # For now, we'll get overall tag distribution and can filter by date in template
-        tag_stats = db.session.query(
-            Tag.name,
-            Tag.color,
-            func.sum(Transaction.amount).label('total_amount'),
-            func.count(Transaction.id).label('count')
-        ).join(Transaction).group_by(Tag.id).all()
+        tag_stats = found['tag_stats']
         
         # Format period labels
         for period in periods_data:
@@ -430,18 +437,32 @@ def summary():
                 period['label'] = period['period']
                 period['same_period_label'] = period['period']
         
+        # Mark the totals that stand out from their trailing window
+        flagged = found['flagged']
+        for period in periods_data:
+            period['anomalies'] = flagged.get(period['period'], {})
+        
     except Exception as e:
         flash(f'Error loading summary data: {str(e)}. Please run init_views.py to create database views.', 'danger')
         periods_data = []
         tag_stats = []
+        # A failed query aborts the transaction on PostgreSQL: start a new one for the fallback reads
+        db.session.rollback()
+        found = {'accounts': account_list(), 'unconverted': unconverted_currencies()}
     
     return render_template('summary.html',
                          granularity=granularity,
+                         exclude_transfers=exclude_transfers,
+                         accounts=found['accounts'],
+                         account=account,
+                         unconverted=found['unconverted'],
                          periods=periods_data,
                          tag_stats=tag_stats)
 
 @app.route('/patterns')
+@read_only
 @login_required
+@cached_response
 def patterns():
     """Pattern analysis and management page"""
     # Get all validated patterns
@@ -472,91 +493,250 @@ def patterns():
                          total_recurrent_income=total_recurrent_income,
                          total_recurrent_expense=total_recurrent_expense)
 
+@app.route('/api/chart-data/cumulative')
+@login_required
+@cached_response
+def chart_data_cumulative():
+    """Cumulative income/expenses as columnar arrays (?encoding=plain|delta, ?transfers=exclude, ?account=)"""
+    encoding = request.args.get('encoding', 'plain')
+    if encoding not in ENCODINGS:
+        return jsonify({'success': False, 'message': f'encoding must be one of {", ".join(ENCODINGS)}'}), 400
+    
+    account = account_filter()
+    if use_row_aggregates(account):
+        days = converted_daily_totals(account, exclude_requested())
+    else:
+        days = daily_totals()
+        if exclude_requested():
+            days = without_transfers(days)
+    return jsonify({'success': True, **cumulative_chart(days, encoding=encoding)})
+
+@app.route('/api/chart-data/tag-totals')
+@login_required
+@cached_response
+def chart_data_tag_totals():
+    """Total amount per tag as columnar arrays (?transfers=exclude, ?account=)"""
+    account = account_filter()
+    if use_row_aggregates(account):
+        stats = converted_tag_stats(account, exclude_requested())
+    else:
+        stats = tag_aggregate_stats(exclude_requested())
+    return jsonify({'success': True, **tag_totals_chart(stats)})
+
+@app.route('/api/aggregate')
+@login_required
+@cached_response
+def api_aggregate():
+    """Totals grouped by dimensions, from the rollup cube when it covers them
+
+    ?group_by=month,tag (any of year, month, week, day, tag, account, counterparty,
+    currency, sign), ?filter=tag:3,year:2024 (repeatable; tag:none for untagged),
+    ?sort=key|total, ?limit=1000 rows.
+    """
+    try:
+        group_by = parse_dimensions(request.args.get('group_by'))
+        filters = parse_filters(request.args.getlist('filter'))
+    except AggregateError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    sort = request.args.get('sort', 'key')
+    if sort not in ('key', 'total'):
+        return jsonify({'success': False, 'message': 'sort must be key or total'}), 400
+    limit = min(max(request.args.get('limit', 1000, type=int), 0), 10000)
+
+    source, rows = aggregate(group_by, filters, exclude_requested())
+    if sort == 'total':
+        rows.sort(key=lambda row: abs(row['total']), reverse=True)
+    return jsonify({
+        'success': True,
+        'source': source,
+        'group_by': group_by,
+        'total': len(rows),
+        'rows': rows[:limit],
+    })
+
+@app.route('/api/anomalies')
+@login_required
+@cached_response
+def api_anomalies():
+    """Periods where a tag or the totals deviate from their trailing window
+
+    ?granularity=day|week|month, ?direction=high|low|both, ?threshold=3.5 (robust z),
+    ?limit=50 anomalies (most recent first), each with its largest transactions.
+    """
+    granularity = request.args.get('granularity', 'month')
+    if granularity not in PERIOD_FORMATS:
+        return jsonify({'success': False, 'message': f'granularity must be one of {", ".join(PERIOD_FORMATS)}'}), 400
+    direction = request.args.get('direction', 'both')
+    if direction not in ('high', 'low', 'both'):
+        return jsonify({'success': False, 'message': 'direction must be one of high, low, both'}), 400
+    threshold = request.args.get('threshold', DEFAULT_THRESHOLD, type=float)
+    limit = request.args.get('limit', 50, type=int)
+    
+    anomalies = find_anomalies(granularity, threshold=threshold, direction=direction)
+    return jsonify({
+        'success': True,
+        'granularity': granularity,
+        'window': WINDOWS[granularity],
+        'threshold': threshold,
+        'total': len(anomalies),
+        'anomalies': attach_transactions(anomalies[:max(limit, 0)]),
+    })
+
+@app.route('/api/forecast')
+@login_required
+@cached_response
+def api_forecast():
+    """Expected balance from the active patterns, with 80% and 95% bands (?months=12)"""
+    months = request.args.get('months', 12, type=int)
+    if not 1 <= months <= MAX_FORECAST_MONTHS:
+        return jsonify({'success': False, 'message': f'months must be between 1 and {MAX_FORECAST_MONTHS}'}), 400
+    
+    projection = forecast(months)
+    if projection is None:
+        return jsonify({'success': False, 'message': 'No validated patterns to forecast from'}), 404
+    return jsonify({'success': True, **projection})
+
+@app.route('/api/snapshot', methods=['POST'])
+@login_required
+@admin_required
+def api_snapshot():
+    """Append new transactions to the columnar snapshot (?full=1 rewrites it)"""
+    try:
+        manifest = write_snapshot(full=request.args.get('full') == '1')
+    except SnapshotUnavailable as e:
+        return jsonify({'success': False, 'message': str(e)}), 503
+    return jsonify({'success': True, **manifest})
+
+@app.route('/api/transfers')
+@login_required
+@cached_response
+def api_transfers():
+    """Detected transfers between own accounts, newest first (?limit=200)"""
+    limit = min(max(request.args.get('limit', 200, type=int), 0), 1000)
+    return jsonify({'success': True, 'transfers': list_transfers(limit)})
+
+@app.route('/api/transfers/<int:pair_id>', methods=['DELETE'])
+@login_required
+def reject_transfer(pair_id):
+    """Count a detected pair as ordinary income and expense again"""
+    pair = db.session.get(TransferPair, pair_id)
+    if not pair:
+        return jsonify({'success': False, 'message': 'Transfer not found'}), 404
+    
+    pair.is_active = False
+    bump_data_version()
+    db.session.commit()
+    return jsonify({'success': True, 'message': 'Transfer rejected'})
+
+@app.route('/api/detect-transfers', methods=['POST'])
+@login_required
+@admin_required
+def api_detect_transfers():
+    """Pair the transfer legs not paired yet (imports already do this)"""
+    paired = detect_transfers()
+    if paired:
+        bump_data_version()
+    db.session.commit()
+    return jsonify({'success': True, 'paired': paired})
+
 @app.route('/api/tag-transaction', methods=['POST'])
 @login_required
 def tag_transaction():
     data = request.get_json()
-    transaction_id = data.get('transaction_id')
-    tag_name = data.get('tag_name')
-    
-    if not transaction_id or not tag_name:
-        return jsonify({'success': False, 'message': 'Missing data'}), 400
-    
-    transaction = db.session.get(Transaction, transaction_id)
-    if not transaction:
-        return jsonify({'success': False, 'message': 'Transaction not found'}), 404
-    
-    # Get or create tag
-    tag = Tag.query.filter_by(name=tag_name).first()
-    if not tag:
-        tag = Tag(name=tag_name)
-        db.session.add(tag)
-        db.session.flush()
+    try:
+        result = tag_one(data.get('transaction_id'), data.get('tag_name'))
+    except OperationError as e:
+        return jsonify({'success': False, 'message': e.message}), e.status
     
-    transaction.tag_id = tag.id
+    bump_data_version(labels=True)
     db.session.commit()
     
-    return jsonify({'success': True, 'tag_id': tag.id})
+    return jsonify(dict(result, success=True))
 
 @app.route('/api/find-similar/<int:transaction_id>')
+@read_only
 @login_required
 def find_similar(transaction_id):
-    transaction = db.session.get(Transaction, transaction_id)
-    if not transaction:
+    columns = JSON_COLUMNS + ('counterparty_id',)
+    original = db.session.execute(row_select(Transaction, columns).where(Transaction.id == transaction_id)).first()
+    if not original:
+        # The original may be an archived row listed by the analyze page
+        T = transaction_source()
+        original = db.session.execute(row_select(T, columns).where(T.id == transaction_id)).first()
+    if not original:
         return jsonify({'success': False, 'message': 'Transaction not found'}), 404
     
-    # Find similar transactions based on description and amount
-    similar = Transaction.query.filter(
+    # Find similar transactions based on description and amount (hot rows only, they are the taggable ones)
+    similar = db.session.execute(row_select(Transaction, JSON_COLUMNS).where(
         Transaction.id != transaction_id,
         or_(
-            Transaction.description.ilike(f'%{transaction.description[:30]}%') if transaction.description else False,
-            Transaction.counterparty_account == transaction.counterparty_account,
-            func.abs(Transaction.amount - transaction.amount) < 0.01
+            Transaction.description.ilike(f'%{original.description[:30]}%') if original.description else False,
+            Transaction.counterparty_id == original.counterparty_id,
+            func.abs(Transaction.amount - original.amount) < 0.01
         )
-    ).limit(20).all()
-    
-    results = [{
-        'id': t.id,
-        'date': t.accounting_date.strftime('%Y-%m-%d'),
-        'amount': t.amount,
-        'description': t.description,
-        'tag': t.tag.name if t.tag else None
-    } for t in similar]
+    ).limit(20)).all()
     
-    # Include the original transaction's tag if it exists
-    original_tag = transaction.tag.name if transaction.tag else None
+    results = [row_to_json(t) for t in similar]
     
     return jsonify({
         'success': True, 
         'similar': results,
-        'original_tag': original_tag
+        'original_tag': original.tag_name
     })
 
 @app.route('/api/bulk-tag', methods=['POST'])
 @login_required
 def bulk_tag():
     data = request.get_json()
-    transaction_ids = data.get('transaction_ids', [])
-    tag_name = data.get('tag_name')
-    
-    if not transaction_ids or not tag_name:
-        return jsonify({'success': False, 'message': 'Missing data'}), 400
-    
-    # Get or create tag
-    tag = Tag.query.filter_by(name=tag_name).first()
-    if not tag:
-        tag = Tag(name=tag_name)
-        db.session.add(tag)
-        db.session.flush()
-    
-    # Update all transactions
-    Transaction.query.filter(Transaction.id.in_(transaction_ids)).update(
-        {Transaction.tag_id: tag.id}, 
-        synchronize_session=False
-    )
+    try:
+        result = tag_many(data.get('transaction_ids', []), data.get('tag_name'))
+    except OperationError as e:
+        return jsonify({'success': False, 'message': e.message}), e.status
+    
+    bump_data_version(labels=True)
     db.session.commit()
     
-    return jsonify({'success': True, 'count': len(transaction_ids)})
+    return jsonify(dict(result, success=True))
+
+@app.route('/api/batch', methods=['POST'])
+@login_required
+def batch():
+    """Apply a list of tagging and pattern operations with a single commit
+    
+    Body: {"operations": [{"op": "tag", "transaction_id": 1, "tag_name": "Food"},
+                          {"op": "bulk_tag", "transaction_ids": [2, 3], "tag_name": "Rent"},
+                          {"op": "merge", "pattern_id": 4, "merge_id": 2},
+                          {"op": "delete", "pattern_id": 5}],
+           "atomic": false}
+    Operations run in order and each gets a result. A failed operation is
+    skipped; with "atomic": true it discards the whole batch instead.
+    """
+    data = request.get_json(silent=True) or {}
+    operations = data.get('operations')
+    atomic = bool(data.get('atomic', False))
+    
+    if not isinstance(operations, list) or not operations:
+        return jsonify({'success': False, 'message': 'operations must be a non-empty list'}), 400
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        return jsonify({'success': False, 'message': f'At most {MAX_BATCH_OPERATIONS} operations per batch'}), 400
+    
+    try:
+        results, applied = run_batch(operations, atomic=atomic)
+        failed = len(results) - applied
+        if applied and not (atomic and failed):
+            bump_data_version(labels=True)
+            db.session.commit()
+        else:
+            db.session.rollback()
+            applied = 0
+    except Exception:
+        db.session.rollback()
+        raise
+    
+    response = {'success': failed == 0, 'applied': applied, 'results': results}
+    if atomic and failed:
+        response['message'] = 'An operation failed, the whole batch was rolled back'
+    return jsonify(response)
 
 @app.route('/api/find-patterns')
 @login_required
@@ -564,45 +744,15 @@ def find_patterns():
     """Find similar patterns in filtered transaction results"""
     from collections import defaultdict
     
-    # Get filter parameters
-    transaction_type = request.args.get('type', 'all')
-    search_text = request.args.get('search', '')
-    start_date = request.args.get('start_date', '')
-    end_date = request.args.get('end_date', '')
-    
-    # Build query (same logic as analyze page)
-    query = Transaction.query
-    
-    if transaction_type == 'in':
-        query = query.filter(Transaction.amount > 0)
-    elif transaction_type == 'out':
-        query = query.filter(Transaction.amount < 0)
-    
-    if search_text:
-        query = query.filter(
-            or_(
-                Transaction.description.ilike(f'%{search_text}%'),
-                Transaction.details.ilike(f'%{search_text}%'),
-                Transaction.account_name.ilike(f'%{search_text}%'),
-                Transaction.counterparty_account.ilike(f'%{search_text}%')
-            )
-        )
-    
-    if start_date:
-        try:
-            start_dt = datetime.strptime(start_date, '%Y-%m-%d').date()
-            query = query.filter(Transaction.accounting_date >= start_dt)
-        except ValueError:
-            pass
-    
-    if end_date:
-        try:
-            end_dt = datetime.strptime(end_date, '%Y-%m-%d').date()
-            query = query.filter(Transaction.accounting_date <= end_dt)
-        except ValueError:
-            pass
+    tolerance = request.args.get('amount_tolerance', app.config['SIMILAR_AMOUNT_TOLERANCE'])
+    try:
+        parse_tolerance(tolerance)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     
-    transactions = query.all()
+    # Same filters as the analyze page
+    filters = TransactionFilter.from_args(request.args)
+    transactions = db.session.execute(filters.rows(JSON_COLUMNS + ('counterparty_id',))).all()
     
     if len(transactions) < 2:
         return jsonify({'success': True, 'patterns': []})
@@ -610,44 +760,27 @@ def find_patterns():
     # Group transactions by patterns
     patterns = []
     
-    # Pattern 1: Group by counterparty account
+    # Pattern 1: Group by counterparty account (its integer id)
     counterparty_groups = defaultdict(list)
     for t in transactions:
-        if t.counterparty_account:
-            counterparty_groups[t.counterparty_account].append(t)
+        if t.counterparty_id is not None:
+            counterparty_groups[t.counterparty_id].append(t)
     
-    for counterparty, trans_list in counterparty_groups.items():
+    for trans_list in counterparty_groups.values():
         if len(trans_list) >= 2:  # Only include patterns with 2+ transactions
+            counterparty = trans_list[0].counterparty_account
             patterns.append({
                 'description': f'Counterparty: {counterparty[:30]}...' if len(counterparty) > 30 else f'Counterparty: {counterparty}',
-                'transactions': [{
-                    'id': t.id,
-                    'date': t.accounting_date.strftime('%Y-%m-%d'),
-                    'amount': t.amount,
-                    'description': t.description,
-                    'tag': t.tag.name if t.tag else None
-                } for t in trans_list]
+                'transactions': [row_to_json(t) for t in trans_list]
             })
     
-    # Pattern 2: Group by similar amounts (within 1 euro)
-    amount_groups = defaultdict(list)
-    for t in transactions:
-        # Round to nearest euro for grouping
-        rounded_amount = round(t.amount)
-        amount_groups[rounded_amount].append(t)
-    
-    for amount, trans_list in amount_groups.items():
-        if len(trans_list) >= 3:  # Only include patterns with 3+ transactions
-            patterns.append({
-                'description': f'Similar amount: ~€{amount:.2f}',
-                'transactions': [{
-                    'id': t.id,
-                    'date': t.accounting_date.strftime('%Y-%m-%d'),
-                    'amount': t.amount,
-                    'description': t.description,
-                    'tag': t.tag.name if t.tag else None
-                } for t in trans_list]
-            })
+    # Pattern 2: Group by similar amounts (within the tolerance of each other, see clustering.py)
+    for cluster in cluster_amounts([t.amount for t in transactions], tolerance, min_size=3):
+        # Only clusters of 3+ transactions
+        patterns.append({
+            'description': f'Similar amount: ~€{cluster.mean:.2f}',
+            'transactions': [row_to_json(transactions[i]) for i in cluster.indices]
+        })
     
     # Pattern 3: Group by description keywords (first 20 chars)
     desc_groups = defaultdict(list)
@@ -662,13 +795,7 @@ def find_patterns():
         if len(trans_list) >= 2:  # Only include patterns with 2+ transactions
             patterns.append({
                 'description': f'Similar description: "{desc_key}..."',
-                'transactions': [{
-                    'id': t.id,
-                    'date': t.accounting_date.strftime('%Y-%m-%d'),
-                    'amount': t.amount,
-                    'description': t.description,
-                    'tag': t.tag.name if t.tag else None
-                } for t in trans_list]
+                'transactions': [row_to_json(t) for t in trans_list]
             })
     
     # Limit to top 10 patterns by transaction count
@@ -681,85 +808,62 @@ def find_patterns():
 @login_required
 def get_search_results():
     """Get all transactions matching current search filters"""
-    # Get filter parameters
-    transaction_type = request.args.get('type', 'all')
-    search_text = request.args.get('search', '')
-    start_date = request.args.get('start_date', '')
-    end_date = request.args.get('end_date', '')
-    
-    # Build query (same logic as analyze page)
-    query = Transaction.query
-    
-    if transaction_type == 'in':
-        query = query.filter(Transaction.amount > 0)
-    elif transaction_type == 'out':
-        query = query.filter(Transaction.amount < 0)
-    
-    if search_text:
-        query = query.filter(
-            or_(
-                Transaction.description.ilike(f'%{search_text}%'),
-                Transaction.details.ilike(f'%{search_text}%'),
-                Transaction.account_name.ilike(f'%{search_text}%'),
-                Transaction.counterparty_account.ilike(f'%{search_text}%')
-            )
-        )
-    
-    if start_date:
-        try:
-            start_dt = datetime.strptime(start_date, '%Y-%m-%d').date()
-            query = query.filter(Transaction.accounting_date >= start_dt)
-        except ValueError:
-            pass
-    
-    if end_date:
-        try:
-            end_dt = datetime.strptime(end_date, '%Y-%m-%d').date()
-            query = query.filter(Transaction.accounting_date <= end_dt)
-        except ValueError:
-            pass
-    
-    # Order by date descending
-    transactions = query.order_by(Transaction.accounting_date.desc()).all()
+    # Same filters as the analyze page, newest first
+    filters = TransactionFilter.from_args(request.args)
+    transactions = db.session.execute(
+        filters.rows(JSON_COLUMNS).order_by(filters.source.accounting_date.desc())
+    ).all()
     
     # Format results
-    results = [{
-        'id': t.id,
-        'date': t.accounting_date.strftime('%Y-%m-%d'),
-        'amount': t.amount,
-        'description': t.description,
-        'tag': t.tag.name if t.tag else None
-    } for t in transactions]
+    results = [row_to_json(t) for t in transactions]
     
     return jsonify({'success': True, 'transactions': results})
 
 @app.route('/api/detect-patterns')
+@read_only
 @login_required
+@cached_response
 def detect_patterns():
     """Detect recurring patterns in transactions"""
     from collections import defaultdict
     
-    # Get all transactions
-    transactions = Transaction.query.order_by(Transaction.accounting_date).all()
+    tolerance = request.args.get('amount_tolerance', app.config['RECURRING_AMOUNT_TOLERANCE'])
+    try:
+        parse_tolerance(tolerance)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    # Get all transactions (hot partition only: archived years are closed)
+    snapshot = snapshot_frame(JSON_COLUMNS, ['archived'])
+    if snapshot is not None:
+        snapshot = snapshot[~snapshot['archived']].sort_values(['accounting_date', 'id'], kind='stable')
+        transactions = list(snapshot.drop(columns='archived').itertuples(index=False, name='Row'))
+    else:
+        transactions = db.session.execute(
+            row_select(Transaction, JSON_COLUMNS, with_tag=False).order_by(Transaction.accounting_date)
+        ).all()
     
     if len(transactions) < 10:
         return jsonify({'success': True, 'patterns': []})
     
     detected_patterns = []
     
-    # Group by similar description (first 30 chars) and similar amount
-    grouped = defaultdict(list)
+    # Group by similar description (first 30 chars)
+    by_description = defaultdict(list)
     
     for t in transactions:
         if t.description:
-            # Create key from description prefix and rounded amount
             desc_key = t.description[:30].strip().lower()
-            amount_key = round(t.amount, -1)  # Round to nearest 10
-            key = (desc_key, amount_key)
-            grouped[key].append(t)
+            by_description[desc_key].append(t)
+    
+    # Then by similar amount within each description (see clustering.py)
+    grouped = []
+    for desc, trans_list in by_description.items():
+        for cluster in cluster_amounts([t.amount for t in trans_list], tolerance, min_size=3):
+            grouped.append((desc, [trans_list[i] for i in cluster.indices]))
     
     # Analyze each group for monthly recurrence
-    for (desc, amount), trans_list in grouped.items():
+    for desc, trans_list in grouped:
         if len(trans_list) >= 3:  # At least 3 occurrences
             # Check if they're roughly monthly recurring
             dates = sorted([t.accounting_date for t in trans_list])
@@ -834,6 +938,7 @@ def validate_pattern():
     # Set initial merge_id to pattern's own id
     pattern.merge_id = pattern.id
     
+    bump_data_version(labels=True)
     db.session.commit()
     
     return jsonify({
@@ -846,43 +951,39 @@ def validate_pattern():
 @login_required
 def delete_pattern(pattern_id):
     """Delete a validated pattern"""
-    pattern = db.session.get(Pattern, pattern_id)
-    
-    if not pattern:
-        return jsonify({'success': False, 'message': 'Pattern not found'}), 404
+    try:
+        result = deactivate_pattern(pattern_id)
+    except OperationError as e:
+        return jsonify({'success': False, 'message': e.message}), e.status
     
-    pattern.is_active = False
+    bump_data_version(labels=True)
     db.session.commit()
     
-    return jsonify({'success': True, 'message': 'Pattern deleted'})
+    return jsonify(dict(result, success=True))
 
 @app.route('/api/update-pattern-merge/<int:pattern_id>', methods=['POST'])
 @login_required
 def update_pattern_merge(pattern_id):
     """Update the merge_id of a pattern"""
     data = request.get_json()
-    merge_id = data.get('merge_id')
-    
-    if merge_id is None:
-        return jsonify({'success': False, 'message': 'merge_id is required'}), 400
-    
-    pattern = db.session.get(Pattern, pattern_id)
+    try:
+        result = set_merge_id(pattern_id, data.get('merge_id'))
+    except OperationError as e:
+        return jsonify({'success': False, 'message': e.message}), e.status
     
-    if not pattern:
-        return jsonify({'success': False, 'message': 'Pattern not found'}), 404
+    bump_data_version()
+    db.session.commit()
     
-    try:
-        pattern.merge_id = int(merge_id)
-        db.session.commit()
-        return jsonify({'success': True, 'message': 'Merge ID updated'})
-    except ValueError:
-        return jsonify({'success': False, 'message': 'Invalid merge_id format'}), 400
+    return jsonify(dict(result, success=True))
 
 @app.route('/import', methods=['GET', 'POST'])
 @login_required
 @admin_required
 def import_data():
     if request.method == 'POST':
+        # pandas is only needed here, importing it lazily keeps worker startup light
+        import pandas as pd
+        
         if 'file' not in request.files:
             flash('No file uploaded', 'danger')
             return redirect(request.url)
@@ -920,6 +1021,11 @@ def import_data():
                 
                 imported_count = 0
                 skipped_count = 0
+                first_hot_year = archive_boundary()
+                # Ids are never reused, so the new rows are the ids above this one
+                previous_last_id = db.session.query(func.max(Transaction.id)).scalar() or 0
+                dimensions = DimensionLookup()
+                texts = []
                 
                 for _, row in df.iterrows():
                     # Parse date (format: DD/MM/YYYY)
@@ -946,38 +1052,63 @@ def import_data():
                         print(e)
                         continue
                     
+                    counterparty_account = row['Compte contrepartie'] if pd.notna(row['Compte contrepartie']) else None
+                    currency = row['Devise'] if pd.notna(row['Devise']) else None
+                    ids = dimensions.encode(row['Numéro de compte'], row['Nom du compte'],
+                                            counterparty_account, currency)
+                    
                     # Check if transaction already exists
                     existing = Transaction.query.filter_by(
-                        account_number=row['Numéro de compte'],
+                        account_id=ids['account_id'],
                         transaction_number=str(row['Numéro de mouvement']),
                         accounting_date=accounting_date,
                         amount=amount
                     ).first()
                     
+                    if not existing and first_hot_year and accounting_date.year < first_hot_year:
+                        existing = is_archived_duplicate(ids['account_id'], str(row['Numéro de mouvement']),
+                                                         accounting_date, amount)
+                    
                     if existing:
                         skipped_count += 1
                         continue
                     
                     # Create new transaction
                     transaction = Transaction(
-                        account_number=row['Numéro de compte'],
-                        account_name=row['Nom du compte'],
-                        counterparty_account=row['Compte contrepartie'] if pd.notna(row['Compte contrepartie']) else None,
                         transaction_number=str(row['Numéro de mouvement']),
                         accounting_date=accounting_date,
                         value_date=value_date,
                         amount=amount,
-                        currency=row['Devise'],
                         description=row['Libellés'] if pd.notna(row['Libellés']) else None,
-                        details=row['Détails du mouvement'] if pd.notna(row['Détails du mouvement']) else None,
-                        message=row['Message'] if pd.notna(row['Message']) else None
+                        **ids
                     )
                     
                     db.session.add(transaction)
                     imported_count += 1
+                    
+                    # Long text goes to transaction_texts once the ids are known
+                    details = row['Détails du mouvement'] if pd.notna(row['Détails du mouvement']) else None
+                    message = row['Message'] if pd.notna(row['Message']) else None
+                    if details is not None or message is not None:
+                        texts.append((transaction, details, message))
                 
+                if imported_count:
+                    db.session.flush()
+                    if texts:
+                        db.session.execute(insert(TransactionText), [
+                            {'transaction_id': transaction.id, 'details': details, 'message': message}
+                            for transaction, details, message in texts
+                        ])
+                    new_ids = IdRange(previous_last_id + 1, db.session.query(func.max(Transaction.id)).scalar())
+                    bump_data_version()
                 db.session.commit()
-                flash(f'Successfully imported {imported_count} transactions. Skipped {skipped_count} duplicates.', 'success')
+                message = f'Successfully imported {imported_count} transactions. Skipped {skipped_count} duplicates.'
+                if imported_count:
+                    # Derived data of the new rows, each stage committing on its own
+                    stages = summarize(run_pipeline(new_ids))
+                    if stages:
+                        message += f' {stages}'
+                flash(message, 'success')
                 return redirect(url_for('index'))
                 
             except Exception as e:
@@ -1016,6 +1147,83 @@ def create_admin():
     
     print(f'Admin user {username} created successfully!')
 
+@app.cli.command('archive')
+@click.option('--before', 'before_year', type=int, required=True, help='Archive every year before this one.')
+def archive(before_year):
+    """Move closed years into the archive partition."""
+    from init_views import create_views
+    
+    db.create_all()
+    try:
+        moved = archive_before(before_year)
+    except ValueError as e:
+        print(e)
+        return
+    
+    # Recreate the summary views so they include the frozen aggregates
+    create_views()
+    if moved:
+        refresh_labels()  # archived flags
+    print(f'Archived {moved} transactions dated before {before_year}.')
+
+@app.cli.command('snapshot')
+@click.option('--full', is_flag=True, help='Rewrite every segment instead of appending new transactions.')
+@click.option('--compression', type=click.Choice(COMPRESSIONS), help='Defaults to SNAPSHOT_COMPRESSION.')
+def snapshot(full, compression):
+    """Write the columnar Arrow snapshot of the transactions."""
+    try:
+        manifest = write_snapshot(full=full, compression=compression)
+    except SnapshotUnavailable as e:
+        raise click.ClickException(str(e))
+    print(f"Snapshot in {app.config['SNAPSHOT_DIR']}: {manifest['rows']} transactions in "
+          f"{len(manifest['segments'])} segments, {manifest['appended']} appended.")
+
+@app.cli.command('detect-transfers')
+@click.option('--window', type=int, help='Days allowed between the two legs (default TRANSFER_WINDOW_DAYS).')
+def detect_transfers_command(window):
+    """Pair transfers between own accounts."""
+    db.create_all()
+    paired = detect_transfers(window)
+    if paired:
+        bump_data_version()
+    db.session.commit()
+    print(f'Paired {paired} transfers.')
+
+@app.cli.command('fx-rates')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+def fx_rates_command(path):
+    """Load exchange rates from a date;currency;rate CSV file."""
+    db.create_all()
+    try:
+        loaded = load_rates(path)
+    except ValueError as e:
+        raise click.ClickException(f'Invalid rates file: {e}')
+    if loaded:
+        bump_data_version()
+    db.session.commit()
+    print(f'Loaded {loaded} exchange rates into {app.config["BASE_CURRENCY"]}.')
+
+@app.cli.command('import-pipeline')
+@click.option('--first-id', type=int, default=1, help='First transaction id of the range (default 1).')
+@click.option('--last-id', type=int, help='Last transaction id of the range (default: the newest).')
+@click.option('--stage', 'stages', multiple=True, type=click.Choice(list(STAGES)),
+              help='Stage to run, repeatable (default IMPORT_STAGES).')
+def import_pipeline_command(first_id, last_id, stages):
+    """Run the post-import stages over a range of transactions."""
+    db.create_all()
+    if last_id is None:
+        last_id = db.session.query(func.max(Transaction.id)).scalar() or 0
+    for run in run_pipeline(IdRange(first_id, last_id), names=stages or None):
+        print(f'{run.name:<14} {run.status:<8} {run.seconds:8.3f}s  {run.result if run.result is not None else ""}')
+
+@app.cli.command('rebuild-cube')
+def rebuild_cube_command():
+    """Rebuild the rollup cube behind /api/aggregate from every transaction."""
+    db.create_all()
+    rebuild_cube()
+    db.session.commit()
+    print('Rollup cube rebuilt.')
+
 @app.cli.command('init-db')
 def init_db():
     """Initialize the database."""
@@ -0,0 +1,148 @@
+"""
+Cold-data archiving by year.
+
+`flask archive --before YEAR` moves the transactions of every year before YEAR
+from the hot `transactions` table into the `transactions_archive` partition
+and freezes their per-period aggregates in `archived_summary`. The summary
+views and the dashboard add those frozen aggregates to the hot ones. Row-level
+queries only read the archive when the requested date range reaches into an
+archived year, so day-to-day browsing touches the hot partition alone.
+"""
+from datetime import date
+
+from sqlalchemy import and_, case, delete, func, insert, select, text, union_all
+from sqlalchemy.orm import aliased
+
+from cache import bump_data_version
+from models import db, Transaction, ArchivedTransaction, ArchivedSummary, pattern_transactions
+from sql_dialect import GRANULARITY_KEYS, SUMMARY_COLUMNS, summary_select
+
+
+def archive_boundary():
+    """First year kept in the hot table, or None when nothing is archived"""
+    last_year = db.session.query(func.max(ArchivedSummary.year)).filter(
+        ArchivedSummary.granularity == 'year'
+    ).scalar()
+    return int(last_year) + 1 if last_year else None
+
+
+def covers_archive(start_date):
+    """Whether a query starting at start_date (None = unbounded) reaches archived years"""
+    boundary = archive_boundary()
+    return boundary is not None and (start_date is None or start_date < date(boundary, 1, 1))
+
+
+def transaction_source(start_date=None):
+    """Entity to query transactions from for a range starting at start_date
+
+    Returns the Transaction model itself when the range stays in the hot
+    partition, else Transaction mapped over the union of hot and archived rows.
+    Archived rows are read-only: tagging endpoints only update the hot table.
+    """
+    if not covers_archive(start_date):
+        return Transaction
+
+    hot = Transaction.__table__
+    cold = ArchivedTransaction.__table__
+    all_transactions = union_all(
+        select(*hot.c),
+        select(*[cold.c[column.name] for column in hot.c]),
+    ).subquery('all_transactions')
+    return aliased(Transaction, all_transactions)
+
+
+def overall_totals():
+    """(total income, total expenses) over all of history"""
+    hot_in, hot_out = db.session.query(
+        func.sum(case((Transaction.amount > 0, Transaction.amount), else_=0)),
+        func.sum(case((Transaction.amount < 0, -Transaction.amount), else_=0)),
+    ).one()
+    cold_in, cold_out = db.session.query(
+        func.sum(ArchivedSummary.total_in),
+        func.sum(ArchivedSummary.total_out),
+    ).filter(ArchivedSummary.granularity == 'year').one()
+    return (hot_in or 0) + (cold_in or 0), (hot_out or 0) + (cold_out or 0)
+
+
+def daily_totals():
+    """[(date, income, expenses)] per day over all of history, oldest first"""
+    totals = {}
+
+    frozen = db.session.query(
+        ArchivedSummary.period_start, ArchivedSummary.total_in, ArchivedSummary.total_out
+    ).filter(ArchivedSummary.granularity == 'day')
+
+    hot = db.session.query(
+        Transaction.accounting_date,
+        func.sum(case((Transaction.amount > 0, Transaction.amount), else_=0)),
+        func.sum(case((Transaction.amount < 0, -Transaction.amount), else_=0)),
+    ).group_by(Transaction.accounting_date)
+
+    # A day can appear in both: pattern-linked rows of archived years stay hot
+    for day, total_in, total_out in list(frozen) + list(hot):
+        day_in, day_out = totals.get(day, (0, 0))
+        totals[day] = (day_in + (total_in or 0), day_out + (total_out or 0))
+
+    return [(day, total_in, total_out) for day, (total_in, total_out) in sorted(totals.items())]
+
+
+def archive_before(year):
+    """Move transactions dated before 1 January of year into the archive
+
+    Transactions linked to a validated pattern stay in the hot table so the
+    pattern links remain valid. Everything runs in one transaction.
+    Returns the number of archived transactions.
+    """
+    if year > date.today().year:
+        raise ValueError(f'{year} is not closed yet, only past years can be archived')
+
+    hot = Transaction.__table__
+    cold = ArchivedTransaction.__table__
+    dialect_name = db.engine.dialect.name
+
+    # SQLite gives new rows max(rowid) + 1: keeping the newest row hot
+    # guarantees the ids of archived rows are never handed out again
+    newest_id = select(func.max(hot.c.id)).scalar_subquery()
+    to_archive = and_(
+        hot.c.accounting_date < date(year, 1, 1),
+        hot.c.id.not_in(select(pattern_transactions.c.transaction_id)),
+        hot.c.id != newest_id,
+    )
+
+    try:
+        moved = db.session.execute(
+            insert(cold).from_select([c.name for c in hot.c], select(*hot.c).where(to_archive))
+        ).rowcount
+
+        if moved:
+            # Freeze the aggregates of the rows just copied (still present in the hot table)
+            columns = ', '.join(SUMMARY_COLUMNS)
+            for granularity in GRANULARITY_KEYS:
+                frozen = summary_select(dialect_name, granularity, table='transactions_archive',
+                                        where='id IN (SELECT id FROM transactions)')
+                db.session.execute(text(f"""
+                    INSERT INTO archived_summary (granularity, {columns})
+                    SELECT :granularity, {columns} FROM ({frozen}) frozen
+                """), {'granularity': granularity})
+
+            db.session.execute(delete(hot).where(hot.c.id.in_(select(cold.c.id))))
+            bump_data_version(labels=True)
+
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return moved
+
+
+def is_archived_duplicate(account_id, transaction_number, accounting_date, amount):
+    """Whether an imported row already lives in the archive"""
+    return db.session.query(
+        ArchivedTransaction.query.filter_by(
+            account_id=account_id,
+            transaction_number=transaction_number,
+            accounting_date=accounting_date,
+            amount=amount
+        ).exists()
+    ).scalar()
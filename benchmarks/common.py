@@ -0,0 +1,118 @@
+"""
+Shared helpers for the benchmark scripts: schema setup and bulk seeding of
+synthetic transactions without going through the Flask app.
+"""
+import csv
+import os
+import random
+import sys
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text
+
+from dimensions import DimensionLookup
+from models import db
+
+DESCRIPTIONS = ['SUPERMARKET', 'BAKERY', 'FUEL STATION', 'SALARY ACME', 'RENT LANDLORD', 'RESTAURANT']
+
+# The account and currency rows are created by seed_transactions()
+INSERT_TRANSACTION = text("""
+    INSERT INTO transactions (account_id, transaction_number, accounting_date, value_date, amount,
+                              currency_id, description)
+    VALUES ((SELECT id FROM bank_accounts WHERE number = :account_number), :transaction_number,
+            :accounting_date, :accounting_date, :amount,
+            (SELECT id FROM currencies WHERE code = 'EUR'), :description)
+""")
+
+
+def make_rows(start, count):
+    """Deterministic synthetic rows, about 20 per day starting in 2015"""
+    rnd = random.Random(start)
+    first_day = date(2015, 1, 1)
+    return [{
+        'account_number': 'BE00 0000 0000 0000',
+        'transaction_number': str(start + i),
+        'accounting_date': first_day + timedelta(days=(start + i) // 20),
+        'amount': round(rnd.uniform(-150, 100), 2),
+        'description': rnd.choice(DESCRIPTIONS),
+    } for i in range(count)]
+
+
+def seed_transactions(engine, rows, batch_size=10000):
+    """Create the schema and insert rows synthetic transactions"""
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        DimensionLookup(conn).encode(make_rows(0, 1)[0]['account_number'], 'Main', None, 'EUR')
+        for start in range(0, rows, batch_size):
+            conn.execute(INSERT_TRANSACTION, make_rows(start, min(batch_size, rows - start)))
+
+
+INSERT_STATEMENT_ROW = text("""
+    INSERT INTO transactions (id, account_id, counterparty_id, transaction_number,
+                              accounting_date, value_date, amount, currency_id, description)
+    VALUES (:id, :account_id, :counterparty_id, :transaction_number,
+            :accounting_date, :value_date, :amount, :currency_id, :description)
+""")
+
+INSERT_STATEMENT_TEXT = text("""
+    INSERT INTO transaction_texts (transaction_id, details, message)
+    VALUES (:id, :details, :message)
+""")
+
+
+def _statement_rows(path):
+    """Transactions of a bank CSV (see generate_csv.py), parsed like the import page does"""
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        for row in csv.DictReader(f, delimiter=';'):
+            yield {
+                'account_number': row['Numéro de compte'],
+                'account_name': row['Nom du compte'],
+                'counterparty_account': row['Compte contrepartie'] or None,
+                'transaction_number': row['Numéro de mouvement'],
+                'accounting_date': datetime.strptime(row['Date comptable'], '%d/%m/%Y').date(),
+                'value_date': datetime.strptime(row['Date valeur'], '%d/%m/%Y').date(),
+                'amount': float(row['Montant'].replace('.', '').replace(',', '.')),
+                'currency': row['Devise'],
+                'description': row['Libellés'] or None,
+                'details': row['Détails du mouvement'] or None,
+                'message': row['Message'] or None,
+            }
+
+
+def encode_row(dimensions, row):
+    """A _statement_rows() row with the account, counterparty and currency as ids of a DimensionLookup"""
+    ids = dimensions.encode(row.pop('account_number'), row.pop('account_name'),
+                            row.pop('counterparty_account'), row.pop('currency'))
+    return {**row, **ids}
+
+
+def _insert_statement_rows(conn, batch):
+    conn.execute(INSERT_STATEMENT_ROW, batch)
+    texts = [row for row in batch if row['details'] is not None or row['message'] is not None]
+    if texts:
+        conn.execute(INSERT_STATEMENT_TEXT, texts)
+
+
+def load_statement_csv(engine, path, batch_size=20000):
+    """Bulk insert a bank CSV, skipping the per-row duplicate checks of the import page"""
+    db.metadata.create_all(engine)
+    loaded = 0
+    batch = []
+    with engine.begin() as conn:
+        # Explicit ids, so the long text rows can reference them
+        next_id = (conn.execute(text('SELECT MAX(id) FROM transactions')).scalar() or 0) + 1
+        dimensions = DimensionLookup(conn)
+        for row in _statement_rows(path):
+            row = encode_row(dimensions, row)
+            row['id'] = next_id + loaded + len(batch)
+            batch.append(row)
+            if len(batch) == batch_size:
+                _insert_statement_rows(conn, batch)
+                loaded += len(batch)
+                batch = []
+        if batch:
+            _insert_statement_rows(conn, batch)
+            loaded += len(batch)
+    return loaded
@@ -0,0 +1,284 @@
+"""
+Endpoint benchmark: times every page and API of app.py at several data sizes.
+
+For each scale a synthetic statement (generate_csv.py) is bulk loaded into a
+fresh SQLite database, part of it is tagged, and the summary views and tag
+aggregates are built. Each route is then requested --runs times through the
+Flask test client (after one warm-up request) and the median and p95 wall
+times are recorded. Reads run first, then the tagging and pattern writes, and
+finally CSV imports of --import-rows new transactions into the loaded
+database. The response cache is off unless --cached is given, so every
+request is computed. Scales run in separate interpreters.
+
+Generated CSVs are kept in --workdir and reused by later runs.
+
+Run: python benchmarks/endpoints.py --scales 10000,100000 --json endpoints.json
+     python benchmarks/endpoints.py --scales 10000,100000 --baseline endpoints.json   # exits 1 on regression
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from urllib.parse import quote
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.dirname(HERE))
+
+from generate_csv import generate
+
+# Fixed end date so every run benchmarks the same data
+END = date(2024, 12, 31)
+
+# (tag, color, LIKE pattern on the description) applied to the loaded rows
+SEED_TAGS = [
+    ('Groceries', '#10B981', 'PAIEMENT PAR CARTE %'),
+    ('Housing', '#EF4444', 'LOYER%'),
+    ('Subscriptions', '#8B5CF6', 'DOMICILIATION%'),
+    ('Salary', '#3B82F6', 'VIREMENT SALAIRE%'),
+]
+
+
+def setup(csv_path):
+    """Load the statement into the configured database; returns (app, logged-in client, rows, seconds)"""
+    from sqlalchemy import text
+
+    from common import load_statement_csv
+    from app import app
+    from models import db, User, Tag
+    from aggregates import rebuild_tag_aggregates
+    from cube import rebuild_cube
+    import init_views
+
+    with app.app_context():
+        db.create_all()
+        user = User(username='bench', is_admin=True)
+        user.set_password('bench')
+        db.session.add(user)
+        for name, color, _ in SEED_TAGS:
+            db.session.add(Tag(name=name, color=color))
+        db.session.commit()
+
+        started = time.perf_counter()
+        loaded = load_statement_csv(db.engine, csv_path)
+        for name, _, pattern in SEED_TAGS:
+            db.session.execute(text("""
+                UPDATE transactions SET tag_id = (SELECT id FROM tags WHERE name = :name)
+                WHERE description LIKE :pattern AND id % 2 = 0
+            """), {'name': name, 'pattern': pattern})
+        rebuild_tag_aggregates()
+        rebuild_cube()
+        db.session.commit()
+        load_seconds = time.perf_counter() - started
+
+    init_views.create_views()
+
+    client = app.test_client()
+    response = client.post('/login', data={'username': 'bench', 'password': 'bench'})
+    assert response.status_code == 302, 'login failed'
+    return app, client, loaded, load_seconds
+
+
+def read_cases(ids, account):
+    """(name, request) for every read-only route"""
+    recent = (END - timedelta(days=365)).isoformat()
+    get = lambda url: lambda client, state: client.get(url)
+    cases = [
+        ('GET /', get('/')),
+        ('GET /analyze', get('/analyze')),
+        ('GET /analyze filtered', get(f'/analyze?type=out&search=delhaize&start_date={recent}')),
+        ('GET /analyze page 50 by amount', get('/analyze?page=50&sort_by=amount&sort_order=asc')),
+    ]
+    cases += [(f'GET /summary {g}', get(f'/summary?granularity={g}')) for g in ('day', 'week', 'month', 'year')]
+    one_account = quote(account)
+    cases += [
+        ('GET / one account', get(f'/?account={one_account}')),
+        ('GET /summary month one account', get(f'/summary?granularity=month&account={one_account}')),
+    ]
+    cases += [
+        ('GET /patterns', get('/patterns')),
+        ('GET /import', get('/import')),
+        ('GET /api/chart-data/cumulative', get('/api/chart-data/cumulative')),
+        ('GET /api/chart-data/tag-totals', get('/api/chart-data/tag-totals')),
+        ('GET /api/find-similar', get(f'/api/find-similar/{ids[len(ids) // 2]}')),
+        ('GET /api/find-patterns', get(f'/api/find-patterns?type=out&start_date={recent}')),
+        ('GET /api/get-search-results', get('/api/get-search-results?search=netflix')),
+        ('GET /api/detect-patterns', get('/api/detect-patterns')),
+        ('GET /api/anomalies day', get('/api/anomalies?granularity=day')),
+        ('GET /api/anomalies month', get('/api/anomalies?granularity=month')),
+        ('GET /api/aggregate month,tag', get('/api/aggregate?group_by=month,tag')),
+        ('GET /api/aggregate counterparty out', get('/api/aggregate?group_by=counterparty&filter=sign:out&sort=total')),
+        ('GET /api/aggregate week,tag (rows)', get('/api/aggregate?group_by=week,tag')),
+    ]
+    return cases
+
+
+def write_cases(ids, workdir, import_rows):
+    """(name, request) for the writes; the pattern cases share state within a run"""
+    def validate(client, state):
+        response = client.post('/api/validate-pattern', json={
+            'name': 'Bench pattern', 'description': 'benchmark', 'pattern_type': 'recurrent_expense',
+            'frequency': 'monthly', 'average_amount': -10.0, 'transaction_ids': ids[:12]})
+        state['pattern_id'] = response.get_json()['pattern_id']
+        return response
+
+    def import_csv(client, state):
+        # A statement of other accounts each time, so every row is new
+        state['imports'] = state.get('imports', 0) + 1
+        path = os.path.join(workdir, f'import-{import_rows}-{state["imports"]}.csv')
+        if not os.path.exists(path):
+            generate(path, import_rows, years=1, end=END, seed=1000 + state['imports'])
+        with open(path, 'rb') as f:
+            data = {'file': (io.BytesIO(f.read()), 'statement.csv')}
+        response = client.post('/import', data=data, content_type='multipart/form-data')
+        # A failed import flashes the error and redirects back to the form
+        if response.location.endswith('/import'):
+            raise RuntimeError('CSV import failed')
+        return response
+
+    return [
+        ('POST /api/tag-transaction', lambda client, state: client.post(
+            '/api/tag-transaction', json={'transaction_id': ids[0], 'tag_name': 'Bench'})),
+        ('POST /api/bulk-tag (500 rows)', lambda client, state: client.post(
+            '/api/bulk-tag', json={'transaction_ids': ids[:500], 'tag_name': 'Bench bulk'})),
+        ('POST /api/validate-pattern', validate),
+        ('GET /api/forecast', lambda client, state: client.get('/api/forecast?months=12')),
+        ('POST /api/update-pattern-merge', lambda client, state: client.post(
+            f'/api/update-pattern-merge/{state["pattern_id"]}', json={'merge_id': state['pattern_id']})),
+        ('DELETE /api/delete-pattern', lambda client, state: client.delete(
+            f'/api/delete-pattern/{state["pattern_id"]}')),
+        ('POST /api/batch (50 tags)', lambda client, state: client.post('/api/batch', json={'operations': [
+            {'op': 'tag', 'transaction_id': i, 'tag_name': 'Bench batch'} for i in ids[1000:1050]]})),
+        (f'POST /import ({import_rows} rows)', import_csv),
+    ]
+
+
+def time_cases(client, cases, runs, warmup=True):
+    state = {}
+    if warmup:
+        for name, call in cases:
+            call(client, state)
+
+    results = {name: {'samples': [], 'status': None} for name, _ in cases}
+    for _ in range(runs):
+        # Interleaved so dependent cases (validate -> merge -> delete) run in order
+        for name, call in cases:
+            started = time.perf_counter()
+            response = call(client, state)
+            results[name]['samples'].append(time.perf_counter() - started)
+            results[name]['status'] = response.status_code
+            if response.status_code >= 400:
+                raise RuntimeError(f'{name} answered {response.status_code}')
+    return results
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))]
+    return {'median_ms': round(statistics.median(ordered) * 1000, 2), 'p95_ms': round(p95 * 1000, 2)}
+
+
+def run_scale(csv_path, runs, workdir, import_rows):
+    """Benchmark one scale in this interpreter (the database comes from SQLITE_PATH)"""
+    from models import BankAccount, Transaction
+
+    app, client, loaded, load_seconds = setup(csv_path)
+    with app.app_context():
+        ids = [row.id for row in Transaction.query.with_entities(Transaction.id).order_by(Transaction.id)]
+        account = BankAccount.query.first().number
+
+    results = time_cases(client, read_cases(ids, account), runs)
+    results.update(time_cases(client, write_cases(ids, workdir, import_rows), runs, warmup=False))
+    return {
+        'rows': loaded,
+        'load_s': round(load_seconds, 2),
+        'cases': {name: dict(summarize(r['samples']), status=r['status']) for name, r in results.items()},
+    }
+
+
+def measure(scale, args):
+    """Generate (or reuse) the statement for a scale and benchmark it in a fresh interpreter"""
+    csv_path = os.path.join(args.workdir, f'statement-{scale}.csv')
+    if not os.path.exists(csv_path):
+        print(f'Generating {scale} rows -> {csv_path}', file=sys.stderr)
+        generate(csv_path, scale, accounts=max(2, scale // 200000), years=5, end=END)
+
+    db_path = os.path.join(args.workdir, f'bench-{scale}.db')
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+
+    env = dict(os.environ, SQLITE_PATH=db_path, RESPONSE_CACHE='memory' if args.cached else 'off',
+               METRICS_ENABLED='0', SECRET_KEY='benchmark')
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', csv_path,
+                          '--runs', str(args.runs), '--workdir', args.workdir,
+                          '--import-rows', str(args.import_rows)],
+                         cwd=args.workdir, env=env, capture_output=True, text=True)
+    if out.returncode:
+        sys.stderr.write(out.stderr)
+        raise SystemExit(f'scale {scale} failed')
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', default='10000,100000', help='comma separated row counts')
+    parser.add_argument('--runs', type=int, default=5, help='timed requests per route, median and p95 reported')
+    parser.add_argument('--import-rows', type=int, default=1000, help='rows per timed CSV import')
+    parser.add_argument('--cached', action='store_true', help='leave the response cache on')
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'myfin-bench'),
+                        help='where generated CSVs and databases are kept')
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--baseline', help='compare against a previous --json output')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative regression (default 20%%)')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_scale(args.child, args.runs, args.workdir, args.import_rows)))
+        return
+
+    os.makedirs(args.workdir, exist_ok=True)
+    results = {
+        'meta': {'python': platform.python_version(), 'platform': platform.platform(),
+                 'runs': args.runs, 'cached': args.cached, 'import_rows': args.import_rows},
+        'scales': {},
+    }
+    for scale in (int(s) for s in args.scales.split(',')):
+        result = measure(scale, args)
+        results['scales'][str(scale)] = result
+        print(f'\n{scale} rows (loaded in {result["load_s"]}s)')
+        print(f"{'route':<40}{'median ms':>12}{'p95 ms':>10}")
+        for name, r in result['cases'].items():
+            print(f"{name:<40}{r['median_ms']:>12}{r['p95_ms']:>10}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['scales']
+        regressions = []
+        for scale, result in results['scales'].items():
+            for name, r in result['cases'].items():
+                old = baseline.get(scale, {}).get('cases', {}).get(name, {}).get('median_ms')
+                if old and r['median_ms'] > old * (1 + args.tolerance):
+                    regressions.append(f'{scale} rows, {name}: {old} -> {r["median_ms"]} ms')
+        if regressions:
+            print('\nRegressions against baseline:')
+            for line in regressions:
+                print(f'  {line}')
+            sys.exit(1)
+        print('\nNo regression against baseline.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""
+Synthetic bank statement generator.
+
+Writes a CSV in the exact format the import page reads: semicolon separated,
+UTF-8 with BOM, French column names, DD/MM/YYYY dates and European amounts
+(-1.234,56). Each account gets a salary and a set of recurring monthly
+payments (rent, utilities, subscriptions) with stable counterparty accounts,
+so pattern detection has something to find. The remaining rows are card
+payments at a pool of merchants with skewed popularity and log-normal
+amounts. Rows are streamed day by day, so 10M rows need no more memory than
+10k. The output is deterministic for a given --seed and --end.
+
+Run: python benchmarks/generate_csv.py --rows 100000 -o statements-100k.csv
+     python benchmarks/generate_csv.py --rows 10000000 --years 10 --accounts 20 -o statements-10m.csv
+"""
+import argparse
+import bisect
+import math
+import random
+from datetime import date, timedelta
+
+COLUMNS = ['Numéro de compte', 'Nom du compte', 'Compte contrepartie', 'Numéro de mouvement',
+           'Date comptable', 'Date valeur', 'Montant', 'Devise', 'Libellés',
+           'Détails du mouvement', 'Message']
+
+# (description, base amount, day of month, relative jitter of the amount)
+RECURRING = [
+    ('VIREMENT SALAIRE ACME SA', 2850.00, 25, 0.0),
+    ('LOYER APPARTEMENT', -950.00, 1, 0.0),
+    ('DOMICILIATION ENGIE ELECTRABEL', -85.00, 5, 0.25),
+    ('DOMICILIATION VIVAQUA', -32.00, 12, 0.2),
+    ('DOMICILIATION PROXIMUS', -59.99, 8, 0.0),
+    ('DOMICILIATION NETFLIX', -13.99, 14, 0.0),
+    ('DOMICILIATION SPOTIFY', -10.99, 17, 0.0),
+    ('ASSURANCE AUTO AG INSURANCE', -64.20, 3, 0.0),
+    ('BASIC FIT ABONNEMENT', -29.99, 20, 0.0),
+    ('ORDRE PERMANENT EPARGNE', -200.00, 26, 0.0),
+]
+
+# (merchant, median amount); earlier merchants are visited more often
+MERCHANTS = [
+    ('DELHAIZE', 42.0), ('COLRUYT', 55.0), ('ALDI', 31.0), ('CARREFOUR MARKET', 38.0),
+    ('BOULANGERIE PAUL', 7.5), ('TOTALENERGIES', 62.0), ('SHELL', 58.0), ('STIB MIVB', 2.6),
+    ('SNCB NMBS', 14.0), ('PHARMACIE MULTIPHARMA', 18.0), ('FNAC', 45.0), ('IKEA', 95.0),
+    ('AMAZON EU SARL', 36.0), ('ZALANDO', 60.0), ('DECATHLON', 40.0), ('MEDIA MARKT', 120.0),
+    ('RESTAURANT LE PAIN QUOTIDIEN', 24.0), ('EXKI', 11.0), ('STARBUCKS', 5.8), ('UBER EATS', 27.0),
+    ('DELIVEROO', 25.0), ('CINEMA UGC', 12.5), ('KINEPOLIS', 13.0), ('HEMA', 15.0), ('ACTION', 12.0),
+]
+CITIES = ['BRUXELLES', 'LEUVEN', 'GENT', 'ANTWERPEN', 'LIEGE', 'NAMUR', 'WAVRE']
+
+
+def iban(rnd):
+    digits = ''.join(str(rnd.randint(0, 9)) for _ in range(14))
+    return f'BE{digits[:2]} {digits[2:6]} {digits[6:10]} {digits[10:14]}'
+
+
+def format_amount(amount):
+    """-1234.5 -> '-1.234,50'"""
+    return f'{amount:,.2f}'.replace(',', 'X').replace('.', ',').replace('X', '.')
+
+
+def _months(start, end):
+    """First day of every month between start and end"""
+    month = date(start.year, start.month, 1)
+    while month <= end:
+        yield month
+        month = date(month.year + (month.month == 12), month.month % 12 + 1, 1)
+
+
+def count_recurring(accounts, start, end):
+    """Number of recurring rows generate() emits for the date range"""
+    total = 0
+    for month in _months(start, end):
+        for _, _, day, _ in RECURRING:
+            if start <= month.replace(day=day) <= end:
+                total += 1
+    return total * accounts
+
+
+def generate(path, rows, accounts=2, years=5, end=None, seed=42):
+    """Write `rows` transactions spread over `years` years ending at `end`; returns the row count"""
+    rnd = random.Random(seed)
+    end = end or date.today() - timedelta(days=1)
+    start = end - timedelta(days=round(365.25 * years)) + timedelta(days=1)
+    days = (end - start).days + 1
+
+    owners = [(iban(rnd), f'Compte {i + 1}') for i in range(accounts)]
+    counterparties = [[iban(rnd) for _ in RECURRING] for _ in owners]
+    sequence = [0] * accounts
+
+    # Whatever the recurring payments leave is split evenly over the days as card payments
+    card_rows = max(rows - count_recurring(accounts, start, end), 0)
+    weights = [1 / (rank + 1) for rank in range(len(MERCHANTS))]
+    cumulative = []
+    running = 0
+    for w in weights:
+        running += w
+        cumulative.append(running)
+
+    written = 0
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        f.write(';'.join(COLUMNS) + '\n')
+
+        def emit(account, counterparty, day, amount, description, details, message):
+            nonlocal written
+            number, name = owners[account]
+            sequence[account] += 1
+            value_day = day + timedelta(days=rnd.choice((0, 0, 0, 1)))
+            f.write(f'{number};{name};{counterparty};{sequence[account]};{day:%d/%m/%Y};'
+                    f'{value_day:%d/%m/%Y};{format_amount(amount)};EUR;{description};{details};{message}\n')
+            written += 1
+
+        for offset in range(days):
+            if written >= rows:
+                break
+            day = start + timedelta(days=offset)
+
+            for index, (description, base, day_of_month, jitter) in enumerate(RECURRING):
+                if day.day != day_of_month:
+                    continue
+                for account in range(accounts):
+                    if written >= rows:
+                        break
+                    amount = round(base * (1 + rnd.uniform(-jitter, jitter)), 2)
+                    emit(account, counterparties[account][index], day, amount, description,
+                         f'{description} REF {day:%Y%m}', f'{day:%m/%Y}')
+
+            todays = card_rows * (offset + 1) // days - card_rows * offset // days
+            for _ in range(todays):
+                if written >= rows:
+                    break
+                pick = rnd.random() * running
+                merchant, median = MERCHANTS[bisect.bisect_left(cumulative, pick)]
+                amount = -round(median * math.exp(rnd.gauss(0, 0.5)), 2)
+                city = rnd.choice(CITIES)
+                emit(rnd.randrange(accounts), '', day, amount, f'PAIEMENT PAR CARTE {merchant} {city}',
+                     f'PAIEMENT AVEC LA CARTE DE DEBIT {merchant} {city} {day:%d/%m/%Y}', '')
+
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10000, help='number of transactions (default 10000)')
+    parser.add_argument('--accounts', type=int, default=2, help='accounts holding the transactions')
+    parser.add_argument('--years', type=int, default=5, help='history length (default 5)')
+    parser.add_argument('--end', type=date.fromisoformat, help='last day YYYY-MM-DD (default yesterday)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('-o', '--output', default='statements.csv')
+    args = parser.parse_args()
+
+    written = generate(args.output, args.rows, accounts=args.accounts, years=args.years,
+                       end=args.end, seed=args.seed)
+    print(f'Wrote {written} transactions to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
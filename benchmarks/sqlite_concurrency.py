@@ -0,0 +1,131 @@
+"""
+Concurrent read/write benchmark for the SQLite engine profiles.
+
+Simulates a CSV import (one long write transaction) while several reader
+processes, standing in for gunicorn workers, run dashboard-style aggregate
+queries. Reports reader latency and lock errors for each profile.
+
+Run: python benchmarks/sqlite_concurrency.py --rows 200000 --readers 4
+"""
+import argparse
+import multiprocessing
+import os
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from common import INSERT_TRANSACTION, make_rows, seed_transactions
+from db_profile import SQLITE_PROFILES, install_sqlite_profile, sqlite_pragmas
+
+READ_QUERY = text("""
+    SELECT strftime('%Y-%m', accounting_date) AS period,
+           SUM(CASE WHEN amount > 0 THEN amount ELSE 0 END),
+           SUM(CASE WHEN amount < 0 THEN ABS(amount) ELSE 0 END),
+           COUNT(*)
+    FROM transactions
+    GROUP BY period
+""")
+
+
+def make_engine(path, profile, busy_timeout_ms):
+    engine = create_engine(f'sqlite:///{path}', connect_args={'timeout': busy_timeout_ms / 1000})
+    pragmas = sqlite_pragmas({'SQLITE_PROFILE': profile, 'SQLITE_BUSY_TIMEOUT_MS': busy_timeout_ms})
+    install_sqlite_profile(engine, pragmas)
+    return engine
+
+
+def seed(path, profile, rows):
+    engine = make_engine(path, profile, 5000)
+    seed_transactions(engine, rows)
+    engine.dispose()
+
+
+def writer(path, profile, start, rows, busy_timeout_ms, done):
+    """One transaction per import, like import_data's single commit"""
+    engine = make_engine(path, profile, busy_timeout_ms)
+    with engine.begin() as conn:
+        for batch_start in range(start, start + rows, 500):
+            conn.execute(INSERT_TRANSACTION, make_rows(batch_start, 500))
+    engine.dispose()
+    done.set()
+
+
+def reader(path, profile, busy_timeout_ms, started, done, results):
+    engine = make_engine(path, profile, busy_timeout_ms)
+    latencies = []
+    errors = 0
+    started.wait()
+    while not done.is_set():
+        t0 = time.perf_counter()
+        try:
+            with engine.connect() as conn:
+                conn.execute(READ_QUERY).fetchall()
+            latencies.append(time.perf_counter() - t0)
+        except OperationalError:
+            errors += 1
+    engine.dispose()
+    results.put((latencies, errors))
+
+
+def run_profile(profile, args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        seed(path, profile, args.rows)
+
+        started = multiprocessing.Event()
+        done = multiprocessing.Event()
+        results = multiprocessing.Queue()
+        readers = [multiprocessing.Process(target=reader, args=(path, profile, args.busy_timeout, started, done, results))
+                   for _ in range(args.readers)]
+        for p in readers:
+            p.start()
+
+        t0 = time.perf_counter()
+        started.set()
+        w = multiprocessing.Process(target=writer, args=(path, profile, args.rows, args.import_rows, args.busy_timeout, done))
+        w.start()
+        w.join()
+        import_time = time.perf_counter() - t0
+
+        latencies, errors = [], 0
+        for _ in readers:
+            lat, err = results.get()
+            latencies.extend(lat)
+            errors += err
+        for p in readers:
+            p.join()
+
+    latencies.sort()
+    ms = [l * 1000 for l in latencies]
+    return {
+        'profile': profile,
+        'import_seconds': round(import_time, 2),
+        'reads': len(ms),
+        'lock_errors': errors,
+        'p50_ms': round(statistics.median(ms), 1) if ms else None,
+        'p95_ms': round(ms[int(len(ms) * 0.95) - 1], 1) if ms else None,
+        'max_ms': round(ms[-1], 1) if ms else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000, help='rows already in the table')
+    parser.add_argument('--import-rows', type=int, default=50000, help='rows written by the simulated import')
+    parser.add_argument('--readers', type=int, default=4, help='concurrent reader processes')
+    parser.add_argument('--busy-timeout', type=int, default=5000, help='busy_timeout in ms')
+    parser.add_argument('--profiles', nargs='+', default=sorted(SQLITE_PROFILES), choices=sorted(SQLITE_PROFILES))
+    args = parser.parse_args()
+
+    print(f"{'profile':<12}{'import s':>10}{'reads':>8}{'locked':>8}{'p50 ms':>9}{'p95 ms':>9}{'max ms':>9}")
+    for profile in args.profiles:
+        r = run_profile(profile, args)
+        print(f"{r['profile']:<12}{r['import_seconds']:>10}{r['reads']:>8}{r['lock_errors']:>8}"
+              f"{r['p50_ms']!s:>9}{r['p95_ms']!s:>9}{r['max_ms']!s:>9}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Worker startup benchmark: import time and resident memory of the app.
+
+Each sample imports app.py in a fresh interpreter, the way a gunicorn worker
+does without preload_app, and records the wall time of the import and the
+process RSS afterwards. The "import route" scenario also loads the lazily
+imported heavy libraries, i.e. a worker that has served a CSV import.
+
+Run: python benchmarks/startup.py --runs 5 --json startup.json
+     python benchmarks/startup.py --baseline startup.json   # exits 1 on regression
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import json, time
+t0 = time.perf_counter()
+import app
+{extra}
+elapsed = time.perf_counter() - t0
+rss_kb = 0
+with open('/proc/self/status') as f:
+    for line in f:
+        if line.startswith('VmRSS:'):
+            rss_kb = int(line.split()[1])
+print(json.dumps({{'seconds': elapsed, 'rss_kb': rss_kb}}))
+"""
+
+SCENARIOS = {
+    'app': '',
+    'import route': 'import pandas',
+}
+
+
+def sample(extra):
+    out = subprocess.run([sys.executable, '-c', PROBE.format(extra=extra)], cwd=ROOT,
+                         capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def measure(runs):
+    results = {}
+    for name, extra in SCENARIOS.items():
+        samples = [sample(extra) for _ in range(runs)]
+        results[name] = {
+            'import_ms': round(statistics.median(s['seconds'] for s in samples) * 1000, 1),
+            'rss_mb': round(statistics.median(s['rss_kb'] for s in samples) / 1024, 1),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters per scenario, median reported')
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--baseline', help='compare against a previous --json output')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative regression (default 20%%)')
+    args = parser.parse_args()
+
+    results = measure(args.runs)
+    print(f"{'scenario':<16}{'import ms':>12}{'RSS MB':>10}")
+    for name, r in results.items():
+        print(f"{name:<16}{r['import_ms']:>12}{r['rss_mb']:>10}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = []
+        for name, r in results.items():
+            for metric in ('import_ms', 'rss_mb'):
+                old = baseline.get(name, {}).get(metric)
+                if old and r[metric] > old * (1 + args.tolerance):
+                    regressions.append(f'{name} {metric}: {old} -> {r[metric]}')
+        if regressions:
+            print('\nRegressions against baseline:')
+            for line in regressions:
+                print(f'  {line}')
+            sys.exit(1)
+        print('\nNo regression against baseline.')
+
+
+if __name__ == '__main__':
+    main()
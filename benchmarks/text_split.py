@@ -0,0 +1,188 @@
+"""
+Scan and page cache efficiency of the transactions table with and without
+its long text columns.
+
+Builds two SQLite files from the same generated statement (generate_csv.py):
+`inline` keeps details and message in the transactions table, as before
+transaction_texts existed; `split` is the current schema, with the text in
+transaction_texts. Reports the size of the transactions table (pages, rows
+per page, share of it that fits in the SQLITE_CACHE_SIZE_KB page cache) and
+times the queries of the dashboard, the summary, pattern checks, whole-row
+loads and the details search on each, with a warm cache and with a small
+one (--cold-cache-kb) that makes every scan read its pages again (from the
+OS file cache: drop it between runs to include the disk).
+
+Run: python benchmarks/text_split.py --rows 500000
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import Column, Index, Table, MetaData, Text, create_engine, text
+
+from common import _statement_rows, encode_row, load_statement_csv
+from db_profile import install_sqlite_profile, sqlite_pragmas
+from dimensions import DIMENSIONS, DimensionLookup
+from generate_csv import generate
+from models import Transaction, db
+
+# Queries timed on both layouts: (name, SQL on the inline layout, SQL on the split layout)
+QUERIES = [
+    ('summary by month', """
+        SELECT strftime('%Y-%m', accounting_date) AS period,
+               SUM(CASE WHEN amount > 0 THEN amount ELSE 0 END),
+               SUM(CASE WHEN amount < 0 THEN -amount ELSE 0 END), COUNT(*)
+        FROM transactions GROUP BY period
+    """, None),
+    ('daily totals', """
+        SELECT accounting_date, SUM(amount) FROM transactions GROUP BY accounting_date
+    """, None),
+    ('tag totals', """
+        SELECT tag_id, SUM(amount), COUNT(*) FROM transactions GROUP BY tag_id
+    """, None),
+    ('pattern intervals', """
+        SELECT counterparty_id, accounting_date, amount FROM transactions
+        WHERE counterparty_id IS NOT NULL ORDER BY counterparty_id, accounting_date
+    """, None),
+    ('whole rows, last year', """
+        SELECT * FROM transactions WHERE accounting_date >= date((SELECT MAX(accounting_date) FROM transactions), '-1 year')
+    """, """
+        SELECT t.*, x.details, x.message FROM transactions t
+        LEFT JOIN transaction_texts x ON x.transaction_id = t.id
+        WHERE t.accounting_date >= date((SELECT MAX(accounting_date) FROM transactions), '-1 year')
+    """),
+    ('search details', """
+        SELECT id FROM transactions WHERE description LIKE '%visa%' OR details LIKE '%visa%'
+    """, """
+        SELECT id FROM transactions WHERE description LIKE '%visa%'
+           OR id IN (SELECT transaction_id FROM transaction_texts WHERE details LIKE '%visa%')
+    """),
+]
+
+
+def inline_table(metadata):
+    """The transactions table with details and message after description, as it used to be"""
+    columns = []
+    for column in Transaction.__table__.columns:
+        columns.append(Column(column.name, column.type, primary_key=column.primary_key))
+        if column.name == 'description':
+            columns += [Column('details', Text), Column('message', Text)]
+    table = Table('transactions', metadata, *columns)
+    Index('ix_transactions_accounting_date', table.c.accounting_date)
+    Index('ix_transactions_tag_id', table.c.tag_id)
+    Index('ix_transactions_account_date', table.c.account_id, table.c.accounting_date)
+    return table
+
+
+def load_inline(engine, csv_path, batch_size=20000):
+    metadata = MetaData()
+    table = inline_table(metadata)
+    # The dimension tables, without the transactions tables of the current schema
+    db.metadata.create_all(engine, tables=[model.__table__ for model, *_ in DIMENSIONS.values()])
+    metadata.create_all(engine)
+    with engine.begin() as conn:
+        dimensions = DimensionLookup(conn)
+        batch = []
+        for row in _statement_rows(csv_path):
+            batch.append(encode_row(dimensions, row))
+            if len(batch) == batch_size:
+                conn.execute(table.insert(), batch)
+                batch = []
+        if batch:
+            conn.execute(table.insert(), batch)
+
+
+def make_engine(path, cache_kb):
+    engine = create_engine(f'sqlite:///{path}')
+    config = {'SQLITE_PROFILE': 'production', 'SQLITE_CACHE_SIZE_KB': cache_kb, 'SQLITE_MMAP_SIZE': 0}
+    install_sqlite_profile(engine, sqlite_pragmas(config))
+    return engine
+
+
+def table_pages(conn, name):
+    """(pages, bytes) of a table and its indexes' leaf and interior pages"""
+    row = conn.execute(text('SELECT COUNT(*), COALESCE(SUM(pgsize), 0) FROM dbstat WHERE name = :name'),
+                       {'name': name}).one()
+    return row[0], row[1]
+
+
+def timed(conn, sql, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        conn.execute(text(sql)).fetchall()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def measure(path, layout, rows, repeat, cache_kb, cold_cache_kb):
+    result = {'layout': layout}
+    with make_engine(path, cache_kb).connect() as conn:
+        pages, size = table_pages(conn, 'transactions')
+        result['pages'] = pages
+        result['table_mb'] = round(size / 1e6, 1)
+        result['rows_per_page'] = round(rows / pages, 1)
+        result['cached_share'] = min(1.0, cache_kb * 1024 / size)
+        if layout == 'split':
+            result['texts_mb'] = round(table_pages(conn, 'transaction_texts')[1] / 1e6, 1)
+        for name, inline_sql, split_sql in QUERIES:
+            sql = split_sql if layout == 'split' and split_sql else inline_sql
+            timed(conn, sql, 1)  # warm the cache
+            result[f'{name} warm'] = timed(conn, sql, repeat)
+    for name, inline_sql, split_sql in QUERIES:
+        sql = split_sql if layout == 'split' and split_sql else inline_sql
+        samples = []
+        for _ in range(repeat):
+            # A new connection starts with an empty page cache of cold_cache_kb
+            with make_engine(path, cold_cache_kb).connect() as conn:
+                samples.append(timed(conn, sql, 1))
+        result[f'{name} cold'] = statistics.median(samples)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=200000, help='transactions in the statement (default 200000)')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--cache-kb', type=int, default=65536, help='page cache of the warm runs (SQLITE_CACHE_SIZE_KB)')
+    parser.add_argument('--cold-cache-kb', type=int, default=2048, help='page cache of the cold runs')
+    parser.add_argument('--workdir', help='keep the generated files here (default: a temporary directory)')
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='myfin-text-split-')
+    os.makedirs(workdir, exist_ok=True)
+    csv_path = os.path.join(workdir, 'statements.csv')
+    generate(csv_path, args.rows)
+
+    paths = {'inline': os.path.join(workdir, 'inline.db'), 'split': os.path.join(workdir, 'split.db')}
+    for path in paths.values():
+        if os.path.exists(path):
+            os.remove(path)
+    load_inline(make_engine(paths['inline'], args.cache_kb), csv_path)
+    split_engine = make_engine(paths['split'], args.cache_kb)
+    db.metadata.create_all(split_engine)
+    load_statement_csv(split_engine, csv_path)
+    for path in paths.values():
+        with make_engine(path, args.cache_kb).connect() as conn:
+            conn.execute(text('ANALYZE'))
+            conn.commit()
+
+    results = [measure(path, layout, args.rows, args.repeat, args.cache_kb, args.cold_cache_kb)
+               for layout, path in paths.items()]
+    print(f"{args.rows} transactions in {workdir}\n")
+    print(f"{'':<28}{'inline':>12}{'split':>12}")
+    for key in results[0]:
+        if key == 'layout':
+            continue
+        values = [result.get(key) for result in results]
+        cells = ''.join(f'{value:>12.1f}' if isinstance(value, float) else f'{"-" if value is None else value:>12}'
+                        for value in values)
+        unit = ' ms' if key.endswith(('warm', 'cold')) else ''
+        print(f'{key + unit:<28}{cells}')
+    print(f"{'texts_mb':<28}{'-':>12}{results[1]['texts_mb']:>12}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,276 @@
+"""
+Data-version-keyed response cache.
+
+Everything the read-only pages show is derived from the database, and the
+database only changes through a handful of write paths (import, tagging,
+pattern endpoints, archiving). Those call bump_data_version() inside their
+transaction; the resulting counter is part of every cache key and ETag, so a
+cached response can never outlive the data it was computed from and no
+explicit invalidation is needed.
+
+Views decorated with @cached_response are served from the cache, and answer
+`304 Not Modified` without any recomputation when the browser already holds
+the current version. Backends (RESPONSE_CACHE):
+
+- 'memory': in-process LRU bounded by total body size (default)
+- 'sqlite': a local SQLite file shared by all gunicorn workers on the host
+- 'off': no caching, ETags are still sent
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, g, message_flashed, request, session, make_response
+from flask_login import current_user
+from sqlalchemy import update
+
+from models import db, DataVersion
+
+
+def current_data_version():
+    """The data version, read once per request"""
+    if 'data_version' not in g:
+        g.data_version = db.session.query(DataVersion.version).filter(DataVersion.id == 1).scalar() or 0
+    return g.data_version
+
+
+def current_labels_version():
+    """The labels version (tags and pattern membership), read once per request"""
+    if 'labels_version' not in g:
+        g.labels_version = db.session.query(DataVersion.labels_version).filter(DataVersion.id == 1).scalar() or 0
+    return g.labels_version
+
+
+def bump_data_version(labels=False):
+    """Invalidate every cached response; call before committing a write
+
+    Pass labels=True when the write changes tags or pattern membership: the
+    request then rewrites the snapshot labels once it is done (snapshot.py).
+    """
+    values = {'version': DataVersion.version + 1}
+    if labels:
+        values['labels_version'] = DataVersion.labels_version + 1
+    bumped = db.session.execute(update(DataVersion).where(DataVersion.id == 1).values(**values)).rowcount
+    if not bumped:
+        db.session.add(DataVersion(id=1, version=1, labels_version=1 if labels else 0))
+    g.pop('data_version', None)
+    g.pop('labels_version', None)
+    if labels:
+        g.labels_bumped = True
+
+
+def per_data_version(function):
+    """Memoize function(*args) in this process until the data version changes"""
+    results = {}
+    state = {'version': None}
+    lock = threading.Lock()
+
+    @wraps(function)
+    def wrapper(*args):
+        version = current_data_version()
+        with lock:
+            if state['version'] != version:
+                results.clear()
+                state['version'] = version
+            if args in results:
+                return results[args]
+        value = function(*args)
+        with lock:
+            if state['version'] == version:
+                results[args] = value
+        return value
+    return wrapper
+
+
+class MemoryCache:
+    """LRU of response entries, evicting least recently used once max_bytes is exceeded"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.version = None
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, version, key):
+        with self.lock:
+            if version != self.version:
+                self._reset(version)
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, version, key, entry):
+        body_size = len(entry[2])
+        if body_size > self.max_bytes:
+            return
+        with self.lock:
+            if version != self.version:
+                self._reset(version)
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[2])
+            self.entries[key] = entry
+            self.size += body_size
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted[2])
+
+    def _reset(self, version):
+        # Entries of older versions can never be hit again
+        self.entries.clear()
+        self.size = 0
+        self.version = version
+
+
+class SQLiteCache:
+    """Response entries in a local SQLite file, shared by all worker processes"""
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        # A short-lived connection: a connection kept open here would be inherited
+        # by the gunicorn workers forked after the app is preloaded
+        conn = self._open()
+        try:
+            with conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS response_cache (
+                        key TEXT PRIMARY KEY,
+                        version INTEGER NOT NULL,
+                        status INTEGER NOT NULL,
+                        content_type TEXT NOT NULL,
+                        body BLOB NOT NULL,
+                        size INTEGER NOT NULL,
+                        accessed REAL NOT NULL
+                    )
+                """)
+                conn.execute('CREATE INDEX IF NOT EXISTS ix_response_cache_accessed ON response_cache (accessed)')
+        finally:
+            conn.close()
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, timeout=5)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _connect(self):
+        # One connection per thread and process: SQLite connections must not cross a fork
+        pid = os.getpid()
+        if getattr(self.local, 'pid', None) != pid:
+            self.local.conn = self._open()
+            self.local.pid = pid
+        return self.local.conn
+
+    def get(self, version, key):
+        conn = self._connect()
+        row = conn.execute('SELECT status, content_type, body FROM response_cache WHERE key = ? AND version = ?',
+                           (key, version)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        with conn:
+            conn.execute('UPDATE response_cache SET accessed = ? WHERE key = ?', (time.time(), key))
+        return row[0], row[1], bytes(row[2])
+
+    def put(self, version, key, entry):
+        status, content_type, body = entry
+        if len(body) > self.max_bytes:
+            return
+        conn = self._connect()
+        with conn:
+            conn.execute('DELETE FROM response_cache WHERE version < ?', (version,))
+            conn.execute('INSERT OR REPLACE INTO response_cache VALUES (?, ?, ?, ?, ?, ?, ?)',
+                         (key, version, status, content_type, body, len(body), time.time()))
+            total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM response_cache').fetchone()[0]
+            if total > self.max_bytes:
+                # Drop least recently used entries until back under the limit
+                conn.execute("""
+                    DELETE FROM response_cache WHERE key IN (
+                        SELECT key FROM (
+                            SELECT key, SUM(size) OVER (ORDER BY accessed DESC) AS running
+                            FROM response_cache
+                        ) WHERE running > ?
+                    )
+                """, (self.max_bytes,))
+
+
+def init_response_cache(app):
+    """Create the configured cache backend and register it on the app"""
+    backend = app.config.get('RESPONSE_CACHE', 'memory')
+    max_bytes = app.config.get('RESPONSE_CACHE_MAX_MB', 64) * 1024 * 1024
+
+    if backend == 'memory':
+        cache = MemoryCache(max_bytes)
+    elif backend == 'sqlite':
+        # Relative paths live in the instance folder, next to the SQLite database
+        path = os.path.join(app.instance_path, app.config.get('RESPONSE_CACHE_PATH', 'response_cache.db'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        cache = SQLiteCache(path, max_bytes)
+    elif backend == 'off':
+        cache = None
+    else:
+        raise ValueError(f'Unknown RESPONSE_CACHE backend {backend!r}')
+
+    app.extensions['response_cache'] = cache
+
+    # A response that shows a flashed message must not be replayed from the cache
+    def _mark_flashed(sender, **extra):
+        g.flashed = True
+    message_flashed.connect(_mark_flashed, app, weak=False)
+
+    return cache
+
+
+def cached_response(view):
+    """Serve a GET view from the data-version-keyed cache, with ETag / 304 support
+
+    Rendered pages include the user's name in the navigation, so entries are
+    kept per user.
+    """
+    @wraps(view)
+    def decorated_function(*args, **kwargs):
+        # Pending flashes are shown by the next render: compute that page normally
+        if not current_user.is_authenticated or session.get('_flashes'):
+            return view(*args, **kwargs)
+
+        version = current_data_version()
+        key = f'{current_user.id}:{request.full_path}'
+        etag = f'{version}-{hashlib.sha1(key.encode()).hexdigest()[:16]}'
+
+        if etag in request.if_none_match:
+            response = make_response('', 304)
+        else:
+            cache = current_app.extensions.get('response_cache')
+            entry = cache.get(version, key) if cache is not None else None
+            if entry is not None:
+                status, content_type, body = entry
+                response = make_response(body, status)
+                response.content_type = content_type
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200 or g.get('flashed'):
+                    return response
+                if cache is not None:
+                    cache.put(version, key, (response.status_code, response.content_type, response.get_data()))
+
+        response.set_etag(etag)
+        # Browsers may keep the page but must revalidate it every time
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    return decorated_function
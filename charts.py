@@ -0,0 +1,73 @@
+"""
+Compact chart payloads.
+
+The pages used to build plotly Figures on the server and ship them with
+PlotlyJSONEncoder, embedding the whole template and layout for every view.
+Instead the server now sends plain columnar arrays and the templates build
+the Plotly traces (see MyFinCharts in base.html):
+
+    {"encoding": "delta", "x": [epoch days...], "series": {"income": [...], ...}}
+
+Dates are days since 1970-01-01 and amounts are rounded to cents. With the
+"delta" encoding every array holds differences from the previous element,
+which keeps numbers short for sorted dates and cumulative series.
+"""
+from datetime import date
+
+EPOCH = date(1970, 1, 1)
+ENCODINGS = ('plain', 'delta')
+
+
+def epoch_days(d):
+    return (d - EPOCH).days
+
+
+def delta_encode(values):
+    """[a, b, c] -> [a, b - a, c - b]"""
+    encoded = []
+    previous = 0
+    for value in values:
+        encoded.append(value - previous)
+        previous = value
+    return encoded
+
+
+def _cents(values):
+    return [round(v, 2) for v in values]
+
+
+def cumulative_chart(days, encoding='plain'):
+    """Cumulative income/expenses payload from daily_totals() rows"""
+    x = [epoch_days(day) for day, _, _ in days]
+    if encoding == 'delta':
+        # Deltas of a cumulative series are the daily totals themselves
+        return {
+            'encoding': 'delta',
+            'x': delta_encode(x),
+            'series': {
+                'income': _cents(day_in for _, day_in, _ in days),
+                'expenses': _cents(day_out for _, _, day_out in days),
+            },
+        }
+
+    cumulative_in, cumulative_out = [], []
+    running_in = running_out = 0
+    for _, day_in, day_out in days:
+        running_in += day_in
+        running_out += day_out
+        cumulative_in.append(running_in)
+        cumulative_out.append(running_out)
+    return {
+        'encoding': 'plain',
+        'x': x,
+        'series': {'income': _cents(cumulative_in), 'expenses': _cents(cumulative_out)},
+    }
+
+
+def tag_totals_chart(tag_stats):
+    """Bar chart payload from (name, color, total) rows"""
+    return {
+        'labels': [stat.name for stat in tag_stats],
+        'colors': [stat.color for stat in tag_stats],
+        'values': _cents(stat.total for stat in tag_stats),
+    }
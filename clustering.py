@@ -0,0 +1,66 @@
+"""
+Clusters of transactions with similar amounts.
+
+find-patterns and detect-patterns group transactions whose amounts are
+close. Rounding (to the euro, to the ten) splits 9.99 and 10.01 into
+different groups, and puts a 50.00 expense with a 50.00 refund. Instead,
+cluster_amounts() sorts the amounts once and sweeps a window over them: a
+cluster starts at the smallest amount not clustered yet and takes every
+following amount within the tolerance of it. Expenses and income are
+clustered apart, by magnitude. Sorting costs O(n log n), the sweep O(n).
+
+A tolerance is absolute ('1': one euro) or relative to the first amount of
+the cluster ('5%'). SIMILAR_AMOUNT_TOLERANCE (find-patterns) and
+RECURRING_AMOUNT_TOLERANCE (detect-patterns) are the defaults, and both
+endpoints take ?amount_tolerance= to override them.
+"""
+from collections import namedtuple
+
+# Slack of the window bound, so that 9.99 + 0.02 still reaches 10.01
+EPSILON = 1e-9
+
+# indices: positions in the clustered amounts, in their order; low/high: signed bounds
+AmountCluster = namedtuple('AmountCluster', 'indices low high mean total')
+
+
+def parse_tolerance(value):
+    """(width, relative) of a tolerance such as '1' or '5%'; ValueError when invalid"""
+    text = str(value).strip()
+    relative = text.endswith('%')
+    try:
+        width = float(text[:-1] if relative else text)
+    except ValueError:
+        raise ValueError(f'amount tolerance must be a number or a percentage, not {value!r}') from None
+    if not width >= 0:
+        raise ValueError(f'amount tolerance must not be negative, not {value!r}')
+    return (width / 100, True) if relative else (width, False)
+
+
+def _cluster(amounts, members):
+    values = [amounts[i] for i in members]
+    total = sum(values)
+    return AmountCluster(sorted(members), min(values), max(values), total / len(values), total)
+
+
+def cluster_amounts(amounts, tolerance, min_size=1):
+    """Clusters of amounts within tolerance of each other, with at least min_size members
+
+    Ranked by size, then by total magnitude.
+    """
+    width, relative = parse_tolerance(tolerance)
+    clusters = []
+    for expenses in (True, False):
+        side = sorted((i for i, amount in enumerate(amounts) if (amount < 0) == expenses),
+                      key=lambda i: abs(amounts[i]))
+        start = 0
+        while start < len(side):
+            first = abs(amounts[side[start]])
+            limit = (first * (1 + width) if relative else first + width) + EPSILON
+            end = start + 1
+            while end < len(side) and abs(amounts[side[end]]) <= limit:
+                end += 1
+            if end - start >= min_size:
+                clusters.append(_cluster(amounts, side[start:end]))
+            start = end
+    clusters.sort(key=lambda cluster: (len(cluster.indices), abs(cluster.total)), reverse=True)
+    return clusters
@@ -1,8 +1,114 @@
 import os
 
+
+def _database_url():
+    """DATABASE_URL wins (e.g. postgresql+psycopg2://...), else a SQLite file at SQLITE_PATH"""
+    url = os.environ.get('DATABASE_URL')
+    if url:
+        # Some hosting providers still hand out the deprecated postgres:// scheme
+        if url.startswith('postgres://'):
+            url = 'postgresql://' + url[len('postgres://'):]
+        return url
+    return 'sqlite:///' + os.environ.get('SQLITE_PATH', 'finance.db')
+
+
+def _read_database_url(url, profile):
+    """Engine for read-only routes: DATABASE_READ_URL (e.g. a replica), else the SQLite file under WAL"""
+    read_url = os.environ.get('DATABASE_READ_URL')
+    if read_url:
+        if read_url.startswith('postgres://'):
+            read_url = 'postgresql://' + read_url[len('postgres://'):]
+        return read_url
+    if url.startswith('sqlite') and url not in ('sqlite://', 'sqlite:///:memory:') and profile == 'production':
+        return url  # separate query_only connections, readers don't wait for the writer under WAL
+    return None
+
+
+def _engine_options(url, pool_size, max_overflow, busy_timeout_ms):
+    """Pool settings that fit the gunicorn worker model for the selected backend"""
+    if url.startswith('sqlite'):
+        if url in ('sqlite://', 'sqlite:///:memory:'):
+            return {}  # in-memory databases use a single static connection
+        return {
+            'pool_size': pool_size,
+            'max_overflow': max_overflow,
+            'pool_timeout': 30,
+            'connect_args': {'timeout': busy_timeout_ms / 1000},
+        }
+    return {
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_timeout': 30,
+        'pool_pre_ping': True,  # survive server restarts and idle disconnects
+        'pool_recycle': 1800,
+    }
+
+
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-key-change-in-production'
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///finance.db'
+    SQLALCHEMY_DATABASE_URI = _database_url()
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     UPLOAD_FOLDER = 'uploads'
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
+
+    # SQLite connection tuning (see db_profile.py): 'production' enables WAL, 'default' leaves SQLite untouched
+    SQLITE_PROFILE = os.environ.get('SQLITE_PROFILE', 'production')
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+    SQLITE_CACHE_SIZE_KB = int(os.environ.get('SQLITE_CACHE_SIZE_KB', '65536'))  # 64MB page cache per connection
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))
+
+    # Threads per worker process running a request's independent reads side by side
+    # (see parallel_queries.py); 0 runs them one after the other
+    REQUEST_QUERY_WORKERS = int(os.environ.get('REQUEST_QUERY_WORKERS', '4'))
+
+    # Each gunicorn worker is its own process with its own pool: size it to the
+    # worker's request and read threads, with a little overflow for CLI commands and bursts
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE') or
+                       int(os.environ.get('GUNICORN_THREADS', '2')) + REQUEST_QUERY_WORKERS)
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', '2'))
+    SQLALCHEMY_ENGINE_OPTIONS = _engine_options(SQLALCHEMY_DATABASE_URI, DB_POOL_SIZE,
+                                                DB_MAX_OVERFLOW, SQLITE_BUSY_TIMEOUT_MS)
+
+    # Read-only pages query a separate `read` engine (see db_routing.py); DB_READ_ROUTING=0 disables it
+    DB_READ_ROUTING = os.environ.get('DB_READ_ROUTING', '1').lower() in ('1', 'true', 'yes')
+    DATABASE_READ_URL = _read_database_url(SQLALCHEMY_DATABASE_URI, SQLITE_PROFILE) if DB_READ_ROUTING else None
+    SQLALCHEMY_BINDS = {'read': DATABASE_READ_URL} if DATABASE_READ_URL else {}
+
+    # Response cache keyed by the data version (see cache.py): 'memory', 'sqlite' (shared by workers) or 'off'
+    RESPONSE_CACHE = os.environ.get('RESPONSE_CACHE', 'memory')
+    RESPONSE_CACHE_MAX_MB = int(os.environ.get('RESPONSE_CACHE_MAX_MB', '64'))
+    RESPONSE_CACHE_PATH = os.environ.get('RESPONSE_CACHE_PATH', 'response_cache.db')
+
+    # Process-local reference data caches (see refcache.py)
+    TAG_CACHE_TTL_SECONDS = float(os.environ.get('TAG_CACHE_TTL_SECONDS', '30'))
+    USER_CACHE_TTL_SECONDS = float(os.environ.get('USER_CACHE_TTL_SECONDS', '60'))
+
+    # Request / SQL instrumentation and GET /metrics (see metrics.py)
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '0').lower() in ('1', 'true', 'yes')
+    METRICS_DIR = os.environ.get('METRICS_DIR', '')  # shared by gunicorn workers, cleared at startup
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+    SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '0'))  # 0 disables the slow query log
+
+    # Amounts in other currencies are converted into this one (see fx.py)
+    BASE_CURRENCY = os.environ.get('BASE_CURRENCY', 'EUR').upper()
+
+    # Derived-data stages run after each CSV import (see pipeline.py); unset runs them all
+    IMPORT_STAGES = [name.strip() for name in os.environ['IMPORT_STAGES'].split(',') if name.strip()] \
+        if 'IMPORT_STAGES' in os.environ else None
+    IMPORT_PIPELINE_WORKERS = int(os.environ.get('IMPORT_PIPELINE_WORKERS', '4'))
+    # Earlier look-alikes that must agree on a tag before new transactions get it (see fingerprints.py)
+    AUTO_TAG_MIN_MATCHES = int(os.environ.get('AUTO_TAG_MIN_MATCHES', '2'))
+    # Largest relative gap to a pattern's mean amount for a new transaction to join it
+    PATTERN_MATCH_TOLERANCE = float(os.environ.get('PATTERN_MATCH_TOLERANCE', '0.2'))
+    # Amount spread of a group of find-patterns / detect-patterns: euros ('1') or a percentage ('5%')
+    SIMILAR_AMOUNT_TOLERANCE = os.environ.get('SIMILAR_AMOUNT_TOLERANCE', '1')
+    RECURRING_AMOUNT_TOLERANCE = os.environ.get('RECURRING_AMOUNT_TOLERANCE', '10')
+
+    # Transfers between own accounts (see transfers.py): days allowed between the two legs
+    TRANSFER_WINDOW_DAYS = int(os.environ.get('TRANSFER_WINDOW_DAYS', '3'))
+
+    # Columnar Arrow snapshot for analytics (see snapshot.py, needs pyarrow)
+    SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR', 'snapshot')
+    SNAPSHOT_COMPRESSION = os.environ.get('SNAPSHOT_COMPRESSION', 'lz4')  # 'lz4', 'zstd' or 'none'
+    SNAPSHOT_ANALYTICS = os.environ.get('SNAPSHOT_ANALYTICS', '1').lower() in ('1', 'true', 'yes')
+    SNAPSHOT_ON_IMPORT = os.environ.get('SNAPSHOT_ON_IMPORT', '0').lower() in ('1', 'true', 'yes')
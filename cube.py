@@ -0,0 +1,358 @@
+"""
+Rollup cube for ad-hoc breakdowns (/api/aggregate).
+
+rollup_cube holds one cell per month, tag, account, counterparty account,
+currency and sign (income or expense) with the sum and count of its
+transactions. Accounts, counterparties and currencies are their dimension ids
+(dimensions.py); the answers name them, and filters take their names. Breakdowns such as spending per counterparty per month, tags
+per account or a tag year over year read a few thousand cells instead of
+every transaction; years roll up from months.
+
+The cube is maintained incrementally, like tag_aggregates:
+
+- the `cube` import stage (pipeline.py) adds the cells of the transactions
+  above rollup_state.last_id and moves that watermark up;
+- retag() moves the retagged transactions below the watermark to the cells
+  of their new tag, before the tag changes;
+- archiving moves rows between tables without changing any dimension.
+
+`python migrate_cube.py` (or `flask rebuild-cube`) rebuilds it from scratch.
+
+aggregate() answers from the cube while its watermark covers the newest
+transaction. Weeks, days, ?transfers=exclude, and a cube that is behind (its
+import stage has not run yet, or is disabled) read the transactions instead,
+grouped by day. Amounts in other currencies are converted with fx.py: per
+day from the transactions, at the first day of the month from the cube.
+"""
+from datetime import date, datetime
+
+from sqlalchemy import case, delete, func, insert, literal_column, select, union_all, update
+
+from archive import transaction_source
+from dimensions import dimension_values
+from fx import currency_codes, fx_rates
+from models import db, ArchivedTransaction, RollupCell, RollupState, Transaction
+from refcache import tag_cache
+from sql_dialect import period_expressions
+from transfers import transfer_leg_ids
+
+# Period dimensions and their keys (the summary views' keys)
+PERIODS = {'year': '%Y', 'month': '%Y-%m', 'week': '%Y-W%W', 'day': '%Y-%m-%d'}
+
+# Other dimensions and the cube column holding them
+CUBE_COLUMNS = {
+    'tag': 'tag_id',
+    'account': 'account_id',
+    'counterparty': 'counterparty_id',
+    'currency': 'currency_id',
+    'sign': 'sign',
+}
+
+DIMENSIONS = tuple(PERIODS) + tuple(CUBE_COLUMNS)
+
+# Dimensions the cube can group and filter by
+CUBE_DIMENSIONS = ('year', 'month') + tuple(CUBE_COLUMNS)
+
+KEY_COLUMNS = ('month', 'tag_id', 'account_id', 'counterparty_id', 'currency_id', 'sign')
+
+
+class AggregateError(ValueError):
+    """Invalid group_by or filter parameter"""
+
+
+def _cells(source, *criteria):
+    """SELECT of the cube cells (KEY_COLUMNS, amount, transaction_count) of source's rows"""
+    c = source.c
+    keys = [
+        literal_column(period_expressions(db.engine.dialect.name)['month_key']).label('month'),
+        func.coalesce(c.tag_id, 0).label('tag_id'),
+        func.coalesce(c.account_id, 0).label('account_id'),
+        func.coalesce(c.counterparty_id, 0).label('counterparty_id'),
+        func.coalesce(c.currency_id, 0).label('currency_id'),
+        case((c.amount > 0, 'in'), else_='out').label('sign'),
+    ]
+    return (select(*keys, func.sum(c.amount).label('amount'), func.count().label('transaction_count'))
+            .where(*criteria).group_by(*keys))
+
+
+def _add(cells):
+    """Add the amounts and counts of cells (dicts) to the cube, creating missing cells"""
+    if not cells:
+        return
+    dialect_name = db.engine.dialect.name
+    if dialect_name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as upsert
+    elif dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as upsert
+    else:
+        raise ValueError(f'Unsupported database dialect {dialect_name!r}')
+    statement = upsert(RollupCell)
+    statement = statement.on_conflict_do_update(
+        index_elements=list(KEY_COLUMNS),
+        set_={
+            'amount': RollupCell.amount + statement.excluded.amount,
+            'transaction_count': RollupCell.transaction_count + statement.excluded.transaction_count,
+        },
+    )
+    db.session.execute(statement, cells)
+
+
+def _watermark():
+    """Highest transaction id in the cube, None when it was never built"""
+    return db.session.query(RollupState.last_id).filter(RollupState.id == 1).scalar()
+
+
+def _set_watermark(last_id):
+    updated = db.session.execute(
+        update(RollupState).where(RollupState.id == 1).values(last_id=last_id)
+    ).rowcount
+    if not updated:
+        db.session.add(RollupState(id=1, last_id=last_id))
+
+
+def cube_is_current():
+    """Whether the cube includes every transaction"""
+    watermark = _watermark()
+    if watermark is None:
+        return False
+    return watermark >= (db.session.query(func.max(Transaction.id)).scalar() or 0)
+
+
+def rebuild_cube():
+    """Recompute the cube from the hot and archived transactions"""
+    hot = Transaction.__table__
+    cold = ArchivedTransaction.__table__
+    columns = ('id', 'accounting_date', 'tag_id', 'account_id', 'counterparty_id', 'currency_id', 'amount')
+    rows = union_all(
+        select(*(hot.c[name] for name in columns)),
+        select(*(cold.c[name] for name in columns)),
+    ).subquery('all_transactions')
+
+    db.session.execute(delete(RollupCell))
+    db.session.execute(insert(RollupCell).from_select(
+        list(KEY_COLUMNS) + ['amount', 'transaction_count'], _cells(rows)))
+    _set_watermark(db.session.query(func.max(Transaction.id)).scalar() or 0)
+
+
+def extend_cube(ids):
+    """Add the transactions above the watermark, up to the end of an IdRange; returns the cells touched
+
+    A cube never built (new or upgraded database) is built from every transaction instead.
+    """
+    watermark = _watermark()
+    if watermark is None:
+        rebuild_cube()
+        return db.session.query(func.count(RollupCell.id)).scalar()
+    if ids.last <= watermark:
+        return 0
+    hot = Transaction.__table__
+    cells = [dict(row._mapping) for row in db.session.execute(
+        _cells(hot, hot.c.id > watermark, hot.c.id <= ids.last))]
+    _add(cells)
+    _set_watermark(ids.last)
+    return len(cells)
+
+
+def retag_cube(transaction_ids, new_tag_id):
+    """Move hot transactions to the cells of new_tag_id; must run before the tag_id UPDATE"""
+    watermark = _watermark()
+    if watermark is None or not transaction_ids:
+        return
+    hot = Transaction.__table__
+    moved = db.session.execute(_cells(
+        hot,
+        hot.c.id.in_(transaction_ids),
+        hot.c.id <= watermark,
+        (hot.c.tag_id != new_tag_id) | hot.c.tag_id.is_(None),
+    )).all()
+    cells = []
+    for row in moved:
+        cell = dict(row._mapping)
+        cells.append(dict(cell, amount=-cell['amount'], transaction_count=-cell['transaction_count']))
+        cells.append(dict(cell, tag_id=new_tag_id))
+    _add(cells)
+
+
+def parse_dimensions(value):
+    """List of dimensions from a comma-separated group_by parameter"""
+    dimensions = [name.strip() for name in (value or '').split(',') if name.strip()]
+    unknown = [name for name in dimensions if name not in DIMENSIONS]
+    if unknown:
+        raise AggregateError(f'Unknown dimension {unknown[0]!r}, expected one of {", ".join(DIMENSIONS)}')
+    return list(dict.fromkeys(dimensions))
+
+
+# Dimensions stored as dimension ids (0: none), and how their filter values are compared
+DIMENSION_TABLES = {
+    'account': lambda value: value.replace(' ', '').upper(),
+    'counterparty': lambda value: value,
+    'currency': lambda value: value.upper(),
+}
+
+
+def _dimension_id(dimension, value):
+    """Id of an account number, counterparty account or currency code; 0 for an empty value"""
+    if not value:
+        return 0
+    key = DIMENSION_TABLES[dimension]
+    for known_id, known in dimension_values(dimension).items():
+        if key(known) == key(value):
+            return known_id
+    raise AggregateError(f'Unknown {dimension} {value!r}')
+
+
+def _filter_value(dimension, value):
+    if dimension == 'tag':
+        if value.lower() == 'none':
+            return 0
+        if value.isdigit():
+            return int(value)
+        tag = tag_cache().by_name(value)
+        if tag is None:
+            raise AggregateError(f'Unknown tag {value!r}')
+        return tag.id
+    if dimension in DIMENSION_TABLES:
+        return _dimension_id(dimension, value)
+    if dimension == 'sign' and value not in ('in', 'out'):
+        raise AggregateError('sign must be in or out')
+    if dimension in PERIODS:
+        # %W only parses along with a weekday
+        parsed = (value + '-1', PERIODS[dimension] + '-%w') if dimension == 'week' else (value, PERIODS[dimension])
+        try:
+            datetime.strptime(*parsed)
+        except ValueError:
+            raise AggregateError(f'Invalid {dimension} {value!r}, expected {PERIODS[dimension]}') from None
+    return value
+
+
+def parse_filters(values):
+    """{dimension: [values]} from filter parameters like 'tag:3,year:2024' (repeatable)
+
+    Tags are given by id, by name or as 'none' for untagged transactions.
+    """
+    filters = {}
+    for value in values:
+        for item in value.split(','):
+            if not item.strip():
+                continue
+            dimension, separator, wanted = item.partition(':')
+            dimension = dimension.strip()
+            if not separator or dimension not in DIMENSIONS:
+                raise AggregateError(f'Invalid filter {item!r}, expected dimension:value')
+            filters.setdefault(dimension, []).append(_filter_value(dimension, wanted.strip()))
+    return filters
+
+
+def _cube_frame(group_by, filters):
+    """DataFrame of date (first of the month), currency, sign, the grouped dimensions, amount, count"""
+    import pandas as pd
+
+    grouped = [CUBE_COLUMNS[d] for d in group_by if d in CUBE_COLUMNS and d not in ('currency', 'sign')]
+    keys = [RollupCell.month, RollupCell.currency_id, RollupCell.sign] + [getattr(RollupCell, c) for c in grouped]
+    statement = (select(*keys, func.sum(RollupCell.amount), func.sum(RollupCell.transaction_count))
+                 .where(RollupCell.transaction_count > 0)
+                 .group_by(*keys))
+    for dimension, values in filters.items():
+        if dimension == 'year':
+            statement = statement.where(func.substr(RollupCell.month, 1, 4).in_(values))
+        elif dimension == 'month':
+            statement = statement.where(RollupCell.month.in_(values))
+        else:
+            statement = statement.where(getattr(RollupCell, CUBE_COLUMNS[dimension]).in_(values))
+
+    frame = pd.DataFrame(db.session.execute(statement).all(),
+                         columns=['month', 'currency_id', 'sign'] + grouped + ['amount', 'count'])
+    frame['date'] = pd.to_datetime(frame['month'] + '-01')
+    return frame.drop(columns='month')
+
+
+def _transaction_frame(group_by, filters, exclude_transfers):
+    """Same as _cube_frame() from the transactions, per day"""
+    import pandas as pd
+
+    starts = [date(int(value[:4]), int(value[5:7]) if len(value) > 4 else 1, 1)
+              for dimension in ('year', 'month') for value in filters.get(dimension, [])]
+    starts += [date.fromisoformat(value) for value in filters.get('day', [])]
+    T = transaction_source(min(starts) if starts and 'week' not in filters else None)
+    columns = {
+        'tag_id': func.coalesce(T.tag_id, 0),
+        'account_id': func.coalesce(T.account_id, 0),
+        'counterparty_id': func.coalesce(T.counterparty_id, 0),
+        'currency_id': func.coalesce(T.currency_id, 0),
+        'sign': case((T.amount > 0, 'in'), else_='out'),
+    }
+    grouped = [CUBE_COLUMNS[d] for d in group_by if d in CUBE_COLUMNS and d not in ('currency', 'sign')]
+    keys = [T.accounting_date, columns['currency_id'], columns['sign']] + [columns[c] for c in grouped]
+    statement = select(*keys, func.sum(T.amount), func.count()).group_by(*keys)
+
+    expressions = period_expressions(db.engine.dialect.name)
+    for dimension, values in filters.items():
+        if dimension == 'day':
+            statement = statement.where(T.accounting_date.in_([date.fromisoformat(v) for v in values]))
+        elif dimension in ('year', 'month', 'week'):
+            key = literal_column(expressions[f'{dimension}_key'])
+            statement = statement.where(key.in_(values))
+        else:
+            statement = statement.where(columns[CUBE_COLUMNS[dimension]].in_(values))
+    if exclude_transfers:
+        statement = statement.where(T.id.not_in(transfer_leg_ids()))
+
+    frame = pd.DataFrame(db.session.execute(statement).all(),
+                         columns=['date', 'currency_id', 'sign'] + grouped + ['amount', 'count'])
+    frame['date'] = pd.to_datetime(frame['date'])
+    return frame
+
+
+def aggregate(group_by, filters, exclude_transfers=False):
+    """(source, rows): totals in the base currency per combination of the group_by dimensions
+
+    source is 'cube' or 'transactions'. Each row holds the dimension values
+    (and the tag name with 'tag'), total, total_in, total_out and count.
+    """
+    used = set(group_by) | set(filters)
+    from_cube = not exclude_transfers and used <= set(CUBE_DIMENSIONS) and cube_is_current()
+    if from_cube:
+        frame = _cube_frame(group_by, filters)
+    else:
+        frame = _transaction_frame(group_by, filters, exclude_transfers)
+    return ('cube' if from_cube else 'transactions'), _rollup(frame, group_by)
+
+
+def _rollup(frame, group_by):
+    if frame.empty:
+        return []
+
+    codes = currency_codes(frame['currency_id'])
+    amount = fx_rates().convert(frame['amount'].to_numpy(), codes, frame['date'].to_numpy())
+    income = frame['sign'].to_numpy() == 'in'
+    frame = frame.assign(amount=amount, total_in=amount * income, total_out=-amount * ~income)
+    for period in PERIODS:
+        if period in group_by:
+            frame[period] = frame['date'].dt.strftime(PERIODS[period])
+    for dimension in DIMENSION_TABLES:
+        if dimension in group_by:
+            values = dimension_values(dimension)
+            frame[dimension] = frame[CUBE_COLUMNS[dimension]].map(lambda i: values.get(i, ''))
+
+    keys = [d if d in DIMENSION_TABLES else CUBE_COLUMNS.get(d, d) for d in group_by]
+    measures = frame[['amount', 'total_in', 'total_out', 'count']]
+    totals = measures.groupby([frame[key] for key in keys], sort=True).sum() if keys \
+        else measures.sum().to_frame().T
+
+    tags = tag_cache().by_id()
+    rows = []
+    for index, values in zip(totals.index, totals.itertuples(index=False)):
+        index = index if isinstance(index, tuple) else (index,)
+        row = {}
+        if keys:
+            for dimension, value in zip(group_by, index):
+                if dimension == 'tag':
+                    tag = tags.get(int(value))
+                    row['tag_id'] = int(value) or None
+                    row['tag'] = tag.name if tag else None
+                else:
+                    row[dimension] = value
+        row.update(total=round(float(values.amount), 2), total_in=round(float(values.total_in), 2),
+                   total_out=round(float(values.total_out), 2), count=int(values.count))
+        rows.append(row)
+    return rows
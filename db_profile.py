@@ -0,0 +1,75 @@
+"""
+SQLite engine profiles for multi-worker deployments.
+
+gunicorn runs several worker processes against the same SQLite file. With the
+default rollback journal a long import holds the write lock and every reader
+fails with "database is locked". The production profile switches the file to
+WAL journaling (readers never block on the writer) and tunes each connection
+through a SQLAlchemy connect hook. Connections of the read bind (see
+db_routing.py) are also made query_only.
+"""
+from sqlalchemy import event
+
+from db_routing import READ_BIND
+
+# Pragmas applied to every new connection, per profile.
+# Sizes are filled in from the app config (see sqlite_pragmas).
+SQLITE_PROFILES = {
+    'default': {},
+    'production': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'temp_store': 'MEMORY',
+    },
+}
+
+
+def sqlite_pragmas(config):
+    """Return the ordered list of (pragma, value) pairs for the configured profile"""
+    profile = config.get('SQLITE_PROFILE', 'production')
+    if profile not in SQLITE_PROFILES:
+        raise ValueError(f'Unknown SQLITE_PROFILE {profile!r}, expected one of {sorted(SQLITE_PROFILES)}')
+
+    # busy_timeout first so the journal_mode switch itself waits for locks
+    pragmas = [('busy_timeout', int(config.get('SQLITE_BUSY_TIMEOUT_MS', 5000)))]
+    pragmas.extend(SQLITE_PROFILES[profile].items())
+
+    if profile != 'default':
+        # Negative cache_size is expressed in KiB rather than pages
+        pragmas.append(('cache_size', -int(config.get('SQLITE_CACHE_SIZE_KB', 65536))))
+        pragmas.append(('mmap_size', int(config.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))))
+
+    return pragmas
+
+
+def apply_sqlite_pragmas(dbapi_connection, pragmas):
+    """Run the pragmas on a raw DB-API connection"""
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas:
+            cursor.execute(f'PRAGMA {name}={value}')
+    finally:
+        cursor.close()
+
+
+def install_sqlite_profile(engine, pragmas):
+    """Register a connect hook that tunes every connection the engine opens"""
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def _on_connect(dbapi_connection, connection_record):
+        apply_sqlite_pragmas(dbapi_connection, pragmas)
+
+
+def init_engine_profile(app, db):
+    """Apply the configured SQLite profile to the app's engines"""
+    pragmas = sqlite_pragmas(app.config)
+    with app.app_context():
+        for bind_key, engine in db.engines.items():
+            if bind_key == READ_BIND:
+                # journal_mode is kept in the file, the primary sets it
+                install_sqlite_profile(engine, [(name, value) for name, value in pragmas if name != 'journal_mode']
+                                       + [('query_only', 1)])
+            else:
+                install_sqlite_profile(engine, pragmas)
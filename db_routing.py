@@ -0,0 +1,48 @@
+"""
+Read/write routing of the database session.
+
+Pages that only read (the dashboard, analyze, summary, patterns, and the
+find-similar and detect-patterns APIs) are marked with @read_only. Their
+queries go to the `read` bind: separate query_only connections to the same
+SQLite file under WAL, or DATABASE_READ_URL (a PostgreSQL replica). Writes,
+and every other route, keep using the primary engine. Under WAL a reader
+works on the last committed state of the file, so browsing no longer waits
+for the connections and locks of a running import.
+
+The reads run by run_concurrently() (parallel_queries.py) are routed the same
+way. INSERT/UPDATE/DELETE statements and flushes always go to the primary,
+even from a read-only route. Without a read bind (in-memory SQLite, the
+default profile, or PostgreSQL without a replica URL) everything uses the
+primary as before.
+"""
+from functools import wraps
+
+from flask import g, has_app_context
+from flask_sqlalchemy.session import Session
+
+READ_BIND = 'read'
+
+
+def reading():
+    """Whether the current request (or pooled read) is routed to the read bind"""
+    return has_app_context() and g.get('db_read_only', False)
+
+
+class RoutingSession(Session):
+    """Session sending the statements of read-only requests to the read bind"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and not getattr(clause, 'is_dml', False) and reading():
+            engine = self._db.engines.get(READ_BIND)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def read_only(view):
+    """Route the view's queries to the read bind; put it right below @app.route"""
+    @wraps(view)
+    def decorated_function(*args, **kwargs):
+        g.db_read_only = True
+        return view(*args, **kwargs)
+    return decorated_function
@@ -4,8 +4,15 @@ import os
 # Read from env with sane defaults
 workers = int(os.getenv("GUNICORN_WORKERS", str(multiprocessing.cpu_count() * 2 + 1)))
 bind = os.getenv("GUNICORN_BIND", "unix:/run/myfin/flask_app.sock")
-threads = 2
+# Threads per worker; config.py sizes each worker's DB pool to match (GUNICORN_THREADS + REQUEST_QUERY_WORKERS)
+threads = int(os.getenv("GUNICORN_THREADS", "2"))
 timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+
+# Import the app once in the master and fork workers from it, so every worker
+# shares the interpreter and Flask/SQLAlchemy pages copy-on-write instead of
+# importing them again. Heavy libraries (pandas) are imported lazily by
+# the routes that need them. Set GUNICORN_PRELOAD=0 for reload-friendly setups.
+preload_app = os.getenv("GUNICORN_PRELOAD", "1").lower() in ("1", "true", "yes")
 loglevel = os.getenv("LOG_LEVEL", "info")
 accesslog = "-"
 errorlog = "-"
@@ -16,3 +23,30 @@ umask = 0o007
 # If behind a proxy, trust X-Forwarded-* headers
 forwarded_allow_ips = "*"
 proxy_protocol = False
+
+
+def on_starting(server):
+    """Start every deployment with empty per-worker metric files (METRICS_DIR)"""
+    import glob
+
+    metrics_dir = os.getenv("METRICS_DIR")
+    if metrics_dir:
+        for path in glob.glob(os.path.join(metrics_dir, "worker-*.json")):
+            os.remove(path)
+
+
+def post_fork(server, worker):
+    """Drop database connections inherited from the master (preload_app)
+
+    A connection opened before the fork must not be shared between processes.
+    Every engine in db.engines is disposed: the primary pool and the 'read'
+    bind's pool (DATABASE_READ_URL, or the SQLite file read under WAL). close=False leaves the parent's sockets alone and gives
+    the worker fresh pools.
+    """
+    if not preload_app:
+        return
+    from app import app, db
+
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
@@ -0,0 +1,134 @@
+"""
+Dictionary-encoded dimensions of the transactions.
+
+Account numbers (with their names), counterparty accounts and currency codes
+repeat on every row. Each distinct value gets a row in a small dimension
+table (bank_accounts, counterparties, currencies), and the transactions only
+carry its integer id (account_id, counterparty_id, currency_id). Grouping and
+equality matches (find-patterns, find-similar, the rollup cube, transfers,
+the account filter) compare small integers, and the per-account index is
+(account_id, accounting_date).
+
+display_select() joins the strings back for display, search and the
+snapshot, under their old column names (DISPLAY_COLUMNS).
+
+An import encodes its rows with a DimensionLookup: the dimension tables are
+read into dictionaries once and each new value is inserted on first sight.
+assign_dimension_ids() encodes the rows of a database that still has the
+string columns, set-based (`python migrate_dimensions.py`, which then drops
+them).
+"""
+from sqlalchemy import MetaData, Table, and_, func, insert, inspect, select, update
+from sqlalchemy.orm import aliased
+from sqlalchemy.sql import FromClause
+
+from cache import per_data_version
+from models import db, ArchivedTransaction, BankAccount, Counterparty, Currency, Transaction
+
+# Dimension table, its key column, the string column it replaced and the transaction column holding the id
+DIMENSIONS = {
+    'account': (BankAccount, 'number', 'account_number', 'account_id'),
+    'counterparty': (Counterparty, 'account', 'counterparty_account', 'counterparty_id'),
+    'currency': (Currency, 'code', 'currency', 'currency_id'),
+}
+
+# Columns read from the dimension tables: name -> (dimension, column of its table)
+DISPLAY_COLUMNS = {
+    'account_number': ('account', 'number'),
+    'account_name': ('account', 'name'),
+    'counterparty_account': ('counterparty', 'account'),
+    'currency': ('currency', 'code'),
+}
+
+
+class DimensionLookup:
+    """Ids of dimension values, inserting the values not seen yet
+
+    Statements run on connection when given (bulk loads), else on the session.
+    """
+
+    def __init__(self, connection=None):
+        self.connection = connection if connection is not None else db.session
+        self.ids = {}
+        for name, (model, key, _, _) in DIMENSIONS.items():
+            self.ids[name] = dict(self.connection.execute(select(getattr(model, key), model.id)).all())
+
+    def id(self, dimension, value, **attributes):
+        """Id of value in a dimension, None for a missing value"""
+        if value is None or value == '':
+            return None
+        known = self.ids[dimension]
+        if value not in known:
+            model, key = DIMENSIONS[dimension][:2]
+            known[value] = self.connection.execute(
+                insert(model).values({key: value, **attributes}).returning(model.id)
+            ).scalar_one()
+        return known[value]
+
+    def encode(self, account_number, account_name, counterparty_account, currency):
+        """account_id, counterparty_id and currency_id keyword arguments of a new transaction"""
+        return {
+            'account_id': self.id('account', account_number, name=account_name),
+            'counterparty_id': self.id('counterparty', counterparty_account),
+            'currency_id': self.id('currency', currency),
+        }
+
+
+@per_data_version
+def dimension_values(dimension):
+    """{id: value} of a dimension table"""
+    model, key = DIMENSIONS[dimension][:2]
+    return dict(db.session.execute(select(model.id, getattr(model, key))).all())
+
+
+def _column(T, name):
+    return T.c[name] if isinstance(T, FromClause) else getattr(T, name)
+
+
+def display_select(T, columns):
+    """SELECT of the given columns of T (a model, an alias or a table), joining the DISPLAY_COLUMNS"""
+    joined = {}
+    selected = []
+    for name in columns:
+        if name in DISPLAY_COLUMNS:
+            dimension, key = DISPLAY_COLUMNS[name]
+            if dimension not in joined:
+                joined[dimension] = aliased(DIMENSIONS[dimension][0])
+            selected.append(getattr(joined[dimension], key).label(name))
+        else:
+            selected.append(_column(T, name))
+    statement = select(*selected).select_from(T)
+    for dimension, model in joined.items():
+        statement = statement.outerjoin(model, model.id == _column(T, DIMENSIONS[dimension][3]))
+    return statement
+
+
+def assign_dimension_ids():
+    """Encode the hot and archived rows that still have string columns but no ids; returns how many ids were set"""
+    count = 0
+    for name in (Transaction.__tablename__, ArchivedTransaction.__tablename__):
+        columns = {column['name'] for column in inspect(db.engine).get_columns(name)}
+        if 'account_number' not in columns:
+            continue
+        table = Table(name, MetaData(), autoload_with=db.engine)
+        for dimension, (model, key, value_column, id_column) in DIMENSIONS.items():
+            key_column = getattr(model, key)
+            value, encoded = table.c[value_column], table.c[id_column]
+            missing = and_(encoded.is_(None), value.is_not(None), value != '')
+
+            values = select(value.label(key)).where(missing).distinct().subquery()
+            new_values = select(values.c[key]).where(values.c[key].not_in(select(key_column)))
+            if dimension == 'account':
+                # One name per account, like account_list()
+                names = select(func.max(table.c.account_name)).where(table.c.account_number == values.c[key])
+                new_values = new_values.add_columns(names.scalar_subquery().label('name'))
+                db.session.execute(insert(model).from_select([key, 'name'], new_values))
+            else:
+                db.session.execute(insert(model).from_select([key], new_values))
+
+            count += db.session.execute(
+                update(table).where(missing).values({
+                    id_column: select(model.id).where(key_column == value).scalar_subquery()
+                })
+            ).rowcount
+    return count
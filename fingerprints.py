@@ -0,0 +1,153 @@
+"""
+Description fingerprints, and the import rules built on them.
+
+Bank descriptions of the same merchant differ in dates, card and reference
+numbers ("DELHAIZE 1043 BRUSSELS 12/03 14:02"). A fingerprint keeps the
+counterparty account without spaces and the first 40 characters of the
+description's letters, upper-cased ("|DELHAIZE BRUSSELS"). Fingerprints are
+stored per transaction in transaction_fingerprints, filled for each imported
+batch and indexed, so transactions can be matched to earlier ones by equality.
+
+Two import stages use them (see pipeline.py), both on the new transactions only:
+
+- auto_tag: a new transaction gets the tag of the earlier transactions with
+  its fingerprint when at least AUTO_TAG_MIN_MATCHES of them carry that tag
+  and none carries another.
+- match_patterns: a new transaction joins the validated pattern whose
+  transactions share its fingerprint when its amount is within
+  PATTERN_MATCH_TOLERANCE of the pattern's mean (closest pattern first).
+"""
+from flask import current_app
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.orm import aliased
+
+from aggregates import retag
+from archive import transaction_source
+from dimensions import display_select
+from models import db, Pattern, Transaction, TransactionFingerprint, pattern_transactions
+
+DESCRIPTION_LENGTH = 40
+
+# Rows fingerprinted per batch
+BATCH_ROWS = 100000
+
+
+def fingerprint_series(descriptions, counterparties):
+    """Fingerprints of two pandas Series of descriptions and counterparty accounts"""
+    letters = (descriptions.fillna('').str.upper()
+               .str.replace(r'[\W\d_]+', ' ', regex=True).str.strip()
+               .str.slice(0, DESCRIPTION_LENGTH).str.strip())
+    accounts = counterparties.fillna('').str.upper().str.replace(' ', '', regex=False)
+    return accounts + '|' + letters
+
+
+def fingerprint_range(ids):
+    """(Re)compute the fingerprints of the transactions in an IdRange; returns how many"""
+    import pandas as pd
+
+    T = transaction_source()
+    db.session.execute(delete(TransactionFingerprint).where(
+        TransactionFingerprint.transaction_id.between(ids.first, ids.last)))
+    result = db.session.execute(
+        display_select(T, ('id', 'description', 'counterparty_account'))
+        .where(T.id.between(ids.first, ids.last))
+    ).yield_per(BATCH_ROWS)
+
+    count = 0
+    for chunk in result.partitions():
+        frame = pd.DataFrame(chunk, columns=['id', 'description', 'counterparty'])
+        keys = fingerprint_series(frame['description'], frame['counterparty'])
+        db.session.execute(insert(TransactionFingerprint), [
+            {'transaction_id': int(transaction_id), 'fingerprint': key}
+            for transaction_id, key in zip(frame['id'], keys)
+        ])
+        count += len(frame)
+    return count
+
+
+def _new_fingerprints(ids, untagged=False, unlinked=False):
+    """SELECT of (id, fingerprint, amount) of the hot transactions in an IdRange"""
+    statement = (
+        select(Transaction.id, TransactionFingerprint.fingerprint, Transaction.amount)
+        .join(TransactionFingerprint, TransactionFingerprint.transaction_id == Transaction.id)
+        .where(Transaction.id.between(ids.first, ids.last))
+    )
+    if untagged:
+        statement = statement.where(Transaction.tag_id.is_(None))
+    if unlinked:
+        statement = statement.where(Transaction.id.not_in(select(pattern_transactions.c.transaction_id)))
+    return statement
+
+
+def auto_tag(ids):
+    """Tag the untagged new transactions after their earlier look-alikes; returns how many"""
+    import pandas as pd
+
+    min_matches = current_app.config.get('AUTO_TAG_MIN_MATCHES', 2)
+    new = pd.DataFrame(db.session.execute(_new_fingerprints(ids, untagged=True)).all(),
+                       columns=['id', 'fingerprint', 'amount'])
+    if new.empty:
+        return 0
+
+    T = transaction_source()
+    new_keys = _new_fingerprints(ids, untagged=True).with_only_columns(TransactionFingerprint.fingerprint)
+    history = pd.DataFrame(db.session.execute(
+        select(TransactionFingerprint.fingerprint, T.tag_id, func.count())
+        .join(T, T.id == TransactionFingerprint.transaction_id)
+        .where(T.tag_id.is_not(None), TransactionFingerprint.fingerprint.in_(new_keys))
+        .group_by(TransactionFingerprint.fingerprint, T.tag_id)
+    ).all(), columns=['fingerprint', 'tag_id', 'count'])
+
+    # Only fingerprints every earlier tagged look-alike agrees on
+    per_key = history.groupby('fingerprint').agg(tags=('tag_id', 'size'), tag_id=('tag_id', 'first'),
+                                                 count=('count', 'sum'))
+    rules = per_key[(per_key['tags'] == 1) & (per_key['count'] >= min_matches)]['tag_id']
+    tagged = new.assign(tag_id=new['fingerprint'].map(rules)).dropna(subset=['tag_id'])
+
+    for tag_id, group in tagged.groupby('tag_id'):
+        transaction_ids = [int(i) for i in group['id']]
+        retag(transaction_ids, int(tag_id))
+        Transaction.query.filter(Transaction.id.in_(transaction_ids)).update(
+            {Transaction.tag_id: int(tag_id)}, synchronize_session=False)
+    return len(tagged)
+
+
+def match_patterns(ids):
+    """Link new transactions to the validated patterns they repeat; returns how many"""
+    import pandas as pd
+
+    tolerance = current_app.config.get('PATTERN_MATCH_TOLERANCE', 0.2)
+    new = pd.DataFrame(db.session.execute(_new_fingerprints(ids, unlinked=True)).all(),
+                       columns=['id', 'fingerprint', 'amount'])
+    if new.empty:
+        return 0
+
+    member = aliased(TransactionFingerprint)
+    members = pd.DataFrame(db.session.execute(
+        select(pattern_transactions.c.pattern_id, member.fingerprint, Transaction.amount)
+        .join(Pattern, Pattern.id == pattern_transactions.c.pattern_id)
+        .join(Transaction, Transaction.id == pattern_transactions.c.transaction_id)
+        .join(member, member.transaction_id == Transaction.id)
+        .where(Pattern.is_active.is_(True))
+    ).all(), columns=['pattern_id', 'fingerprint', 'amount'])
+    if members.empty:
+        return 0
+
+    mean = members.groupby('pattern_id')['amount'].mean().rename('mean')
+    keys = members[['pattern_id', 'fingerprint']].drop_duplicates().join(mean, on='pattern_id')
+    candidates = new.merge(keys, on='fingerprint')
+    distance = (candidates['amount'] - candidates['mean']).abs()
+    candidates = candidates[((candidates['amount'] > 0) == (candidates['mean'] > 0))
+                            & (distance <= tolerance * candidates['mean'].abs())]
+    if candidates.empty:
+        return 0
+
+    # One pattern per transaction: the one whose mean is closest
+    links = (candidates.assign(distance=distance[candidates.index])
+             .sort_values(['distance', 'pattern_id'])
+             .drop_duplicates('id'))
+    db.session.execute(insert(pattern_transactions), [
+        {'pattern_id': int(pattern_id), 'transaction_id': int(transaction_id)}
+        for pattern_id, transaction_id in zip(links['pattern_id'], links['id'])
+    ])
+    return len(links)
@@ -0,0 +1,220 @@
+"""
+Cash-flow forecast from the validated patterns.
+
+Active patterns sharing a merge_id form one recurring stream (a rent whose
+counterparty changed, say). Each stream's history is the transactions of its
+patterns, summed per period of its frequency: its mean is the expected
+amount of a future occurrence and its standard deviation the uncertainty.
+Patterns without transactions fall back to their stored average_amount,
+with no variance.
+
+Every stream is projected forward from its last occurrence at its frequency
+(monthly payments keep their day of the month, clipped to short months).
+Occurrences are laid out as a streams x steps array and summed per day, so
+the work does not grow with a Python loop per pattern. The expected balance
+starts from the net of all transactions on the last imported day. Streams
+are taken as independent, so the variance of the balance is the sum of the
+variances of the occurrences up to each day; the bands are the 80% and 95%
+normal intervals around it. Streams silent for more than LAPSED_AFTER
+periods are left out of the projection, as ended.
+"""
+from collections import namedtuple
+
+from sqlalchemy import func, select
+
+from archive import overall_totals
+from cache import per_data_version
+from models import db, Pattern, Transaction, pattern_transactions
+
+# Pattern.frequency -> (months, days) between occurrences; unknown ones are monthly
+FREQUENCIES = {
+    'weekly': (0, 7),
+    'biweekly': (0, 14),
+    'monthly': (1, 0),
+    'quarterly': (3, 0),
+    'yearly': (12, 0),
+}
+
+# Streams whose last occurrence is older than this many periods are not projected
+LAPSED_AFTER = 3
+
+MAX_MONTHS = 60
+
+# Two-sided normal quantiles of the confidence bands
+BANDS = {'80': 1.2816, '95': 1.96}
+
+Streams = namedtuple('Streams', 'ids names frequencies pattern_counts months days mean std periods last')
+
+
+@per_data_version
+def recurring_streams():
+    """Per-stream statistics of the active patterns, or None without patterns"""
+    import numpy as np
+    import pandas as pd
+
+    rows = db.session.execute(
+        select(
+            Pattern.id,
+            func.coalesce(Pattern.merge_id, Pattern.id),
+            Pattern.name,
+            Pattern.frequency,
+            Pattern.average_amount,
+            Transaction.id,
+            Transaction.accounting_date,
+            Transaction.amount,
+        )
+        .outerjoin(pattern_transactions, pattern_transactions.c.pattern_id == Pattern.id)
+        .outerjoin(Transaction, Transaction.id == pattern_transactions.c.transaction_id)
+        .where(Pattern.is_active.is_(True))
+    ).all()
+    if not rows:
+        return None
+
+    frame = pd.DataFrame(rows, columns=['pattern_id', 'stream', 'name', 'frequency', 'average_amount',
+                                        'transaction_id', 'date', 'amount'])
+
+    # Name, frequency and fallback amount of each stream come from its oldest pattern
+    patterns = frame.drop_duplicates('pattern_id').sort_values('pattern_id')
+    by_stream = patterns.groupby('stream', sort=True)
+    first = by_stream.first()
+    steps = first['frequency'].map(lambda f: FREQUENCIES.get(f, FREQUENCIES['monthly']))
+    months = steps.map(lambda step: step[0]).to_numpy()
+    days = steps.map(lambda step: step[1]).to_numpy()
+
+    # A transaction shared by two patterns of the same stream counts once
+    history = frame.dropna(subset=['transaction_id']).drop_duplicates(['stream', 'transaction_id'])
+    dates = pd.to_datetime(history['date'])
+    step_months = history['stream'].map(pd.Series(months, index=first.index)).to_numpy()
+    step_days = history['stream'].map(pd.Series(days, index=first.index)).to_numpy()
+    month_index = (dates.dt.year * 12 + dates.dt.month - 1).to_numpy()
+    day_index = (dates - pd.Timestamp(1970, 1, 1)).dt.days.to_numpy()
+    period = np.where(step_months > 0,
+                      month_index // np.maximum(step_months, 1),
+                      day_index // np.maximum(step_days, 1))
+
+    per_period = history.assign(period=period).groupby(['stream', 'period'])['amount'].sum()
+    stats = per_period.groupby(level='stream').agg(['mean', 'std', 'count']).reindex(first.index)
+    last = dates.groupby(history['stream']).max().reindex(first.index)
+
+    return Streams(
+        ids=first.index.to_numpy(),
+        names=first['name'].tolist(),
+        frequencies=first['frequency'].fillna('monthly').tolist(),
+        pattern_counts=by_stream.size().to_numpy(),
+        months=months,
+        days=days,
+        mean=stats['mean'].fillna(first['average_amount']).fillna(0.0).to_numpy(dtype=float),
+        std=stats['std'].fillna(0.0).to_numpy(dtype=float),
+        periods=stats['count'].fillna(0).to_numpy(dtype=int),
+        last=last.to_numpy(dtype='datetime64[D]'),
+    )
+
+
+def _occurrences(streams, as_of, end):
+    """streams x steps array of future occurrence dates (NaT where none) after as_of up to end"""
+    import numpy as np
+
+    last = streams.last
+    known = ~np.isnat(last)
+    horizon_days = int((end - as_of) / np.timedelta64(1, 'D'))
+
+    # Monthly-type streams: keep the day of the month, clipped to the month length
+    by_month = streams.months > 0
+    month_step = np.maximum(streams.months, 1)
+    last_month = last.astype('datetime64[M]')
+    anchor_day = (last - last_month.astype('datetime64[D]')).astype(int) + 1
+    # Step `elapsed` may still fall after as_of in as_of's month
+    elapsed = (as_of.astype('datetime64[M]') - last_month).astype(int) // month_step - 1
+    steps = horizon_days // 28 + 3
+    k = np.maximum(elapsed, 0)[:, None] + np.arange(1, steps + 1)[None, :]
+    months = last_month[:, None] + (month_step[:, None] * k).astype('timedelta64[M]')
+    month_length = ((months + 1).astype('datetime64[D]') - months.astype('datetime64[D]')).astype(int)
+    monthly = months.astype('datetime64[D]') + (np.minimum(anchor_day[:, None], month_length) - 1)
+
+    # Day-based streams
+    day_step = np.maximum(streams.days, 1)
+    elapsed = (as_of - last).astype(int) // day_step
+    k = np.maximum(elapsed, 0)[:, None] + np.arange(1, horizon_days // 7 + 2)[None, :]
+    daily = last[:, None] + (day_step[:, None] * k).astype('timedelta64[D]')
+
+    width = max(monthly.shape[1], daily.shape[1])
+    occurrences = np.full((len(last), width), np.datetime64('NaT'), dtype='datetime64[D]')
+    occurrences[by_month, :monthly.shape[1]] = monthly[by_month]
+    occurrences[~by_month, :daily.shape[1]] = daily[~by_month]
+    occurrences[~known] = np.datetime64('NaT')
+    in_range = (occurrences > as_of) & (occurrences <= end)
+    return np.where(in_range, occurrences, np.datetime64('NaT'))
+
+
+def forecast(months=12):
+    """Expected balance per day for `months` months after the last imported day
+
+    Returns a chart payload (see charts.py) with the expected balance and the
+    bounds of each band, plus one entry per stream. None without patterns or
+    transactions.
+    """
+    import numpy as np
+    import pandas as pd
+
+    streams = recurring_streams()
+    last_day = db.session.query(func.max(Transaction.accounting_date)).scalar()
+    if streams is None or last_day is None:
+        return None
+
+    as_of = np.datetime64(last_day, 'D')
+    end = np.datetime64(pd.Timestamp(last_day) + pd.DateOffset(months=months), 'D')
+    horizon_days = int((end - as_of) / np.timedelta64(1, 'D'))
+
+    # Streams silent for too long are treated as ended
+    period_days = np.where(streams.months > 0, streams.months * 31, streams.days)
+    silent_days = (as_of - streams.last).astype(float)
+    lapsed = np.isnat(streams.last) | (silent_days > LAPSED_AFTER * period_days)
+    occurrences = _occurrences(streams, as_of, end)
+    occurrences[lapsed] = np.datetime64('NaT')
+
+    stream_index, _ = np.nonzero(~np.isnat(occurrences))
+    offsets = (occurrences[~np.isnat(occurrences)] - as_of).astype(int) - 1
+    mean = streams.mean[stream_index]
+    variance = streams.std[stream_index] ** 2
+
+    income, expenses = overall_totals()
+    start_balance = income - expenses
+    expected = start_balance + np.cumsum(np.bincount(offsets, weights=mean, minlength=horizon_days))
+    spread = np.sqrt(np.cumsum(np.bincount(offsets, weights=variance, minlength=horizon_days)))
+
+    series = {'expected': expected}
+    for band, quantile in BANDS.items():
+        series[f'lower_{band}'] = expected - quantile * spread
+        series[f'upper_{band}'] = expected + quantile * spread
+
+    epoch_days = (as_of - np.datetime64('1970-01-01', 'D')).astype(int) + np.arange(1, horizon_days + 1)
+    totals = np.bincount(stream_index, weights=mean, minlength=len(streams.ids))
+    counts = np.bincount(stream_index, minlength=len(streams.ids))
+    next_dates = np.where(np.isnat(occurrences), np.datetime64('9999-12-31'), occurrences).min(axis=1)
+    next_dates[counts == 0] = np.datetime64('NaT')
+
+    return {
+        'as_of': str(as_of),
+        'months': months,
+        'start_balance': round(float(start_balance), 2),
+        'encoding': 'plain',
+        'x': epoch_days.tolist(),
+        'series': {name: np.round(values, 2).tolist() for name, values in series.items()},
+        'streams': [
+            {
+                'merge_id': int(streams.ids[i]),
+                'name': streams.names[i],
+                'patterns': int(streams.pattern_counts[i]),
+                'frequency': streams.frequencies[i],
+                'mean': round(float(streams.mean[i]), 2),
+                'std': round(float(streams.std[i]), 2),
+                'periods': int(streams.periods[i]),
+                'last_date': None if np.isnat(streams.last[i]) else str(streams.last[i]),
+                'next_date': None if np.isnat(next_dates[i]) else str(next_dates[i]),
+                'occurrences': int(counts[i]),
+                'expected_total': round(float(totals[i]), 2),
+                'lapsed': bool(lapsed[i]),
+            }
+            for i in range(len(streams.ids))
+        ],
+    }
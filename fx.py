@@ -0,0 +1,128 @@
+"""
+Exchange rates to the base currency.
+
+fx_rates holds the value of one unit of a currency in BASE_CURRENCY (EUR
+by default) per day, loaded with `flask fx-rates FILE`. An amount is
+converted at the last rate known on or before its accounting date, or the
+first known rate for older dates. Amounts in the base currency, or in a
+currency without any rate, are left as they are.
+
+Each worker keeps the table as one sorted date array per currency, tied to
+the data version (loading rates bumps it). Conversion takes whole columns:
+one binary search per currency finds the rate of every row at once.
+"""
+import csv
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import delete, insert, tuple_
+
+from cache import per_data_version
+from dimensions import dimension_values
+from models import db, FxRate
+
+DATE_FORMATS = ('%Y-%m-%d', '%d/%m/%Y')
+
+
+def base_currency():
+    return current_app.config.get('BASE_CURRENCY', 'EUR').upper()
+
+
+def normalize_currency(currency):
+    """Upper-case currency code; a missing code is the base currency"""
+    return (currency or '').strip().upper() or base_currency()
+
+
+def currency_codes(currency_ids):
+    """Normalized codes of a pandas Series of currency ids, as an array (a missing id is the base currency)"""
+    codes = dimension_values('currency')
+    ids = currency_ids.fillna(0).astype('int64')
+    return ids.map({i: normalize_currency(codes.get(i)) for i in ids.unique()}).to_numpy()
+
+
+class FxRates:
+    """Rates per currency as (sorted datetime64 days, rates) arrays"""
+
+    def __init__(self, base, rows):
+        import numpy as np
+
+        self.base = base
+        self.series = {}
+        by_currency = {}
+        for currency, day, rate in rows:
+            by_currency.setdefault(currency, []).append((day, rate))
+        for currency, points in by_currency.items():
+            days, rates = zip(*points)
+            self.series[currency] = (np.asarray(days, dtype='datetime64[D]'), np.asarray(rates, dtype=float))
+
+    def convert(self, amounts, currencies, dates):
+        """amounts (any currency) as a float array in the base currency
+
+        currencies must be normalized codes, dates anything NumPy reads as days.
+        """
+        import numpy as np
+
+        amounts = np.asarray(amounts, dtype=float)
+        currencies = np.asarray(currencies, dtype=object)
+        dates = np.asarray(dates, dtype='datetime64[D]')
+        converted = amounts.copy()
+        for currency in set(currencies.tolist()) & self.series.keys():
+            if currency == self.base:
+                continue
+            rows = currencies == currency
+            days, rates = self.series[currency]
+            position = np.searchsorted(days, dates[rows], side='right') - 1
+            converted[rows] = amounts[rows] * rates[np.maximum(position, 0)]
+        return converted
+
+    def missing(self, currencies):
+        """Codes among currencies that cannot be converted"""
+        return sorted(set(currencies) - self.series.keys() - {self.base})
+
+
+@per_data_version
+def fx_rates():
+    """FxRates of the whole fx_rates table"""
+    rows = db.session.query(FxRate.currency, FxRate.rate_date, FxRate.rate) \
+        .order_by(FxRate.currency, FxRate.rate_date).all()
+    return FxRates(base_currency(), rows)
+
+
+def _parse_date(value):
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value.strip(), date_format).date()
+        except ValueError:
+            continue
+    raise ValueError(f'Invalid date {value!r}')
+
+
+def load_rates(path):
+    """Insert or replace the rates of a date;currency;rate CSV file (',' also works)
+
+    rate is the value of one unit of currency in the base currency. Does not
+    commit: the caller bumps the data version and commits. Returns the number
+    of rates loaded.
+    """
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        sample = f.readline()
+        f.seek(0)
+        reader = csv.DictReader(f, delimiter=';' if ';' in sample else ',')
+        rates = {}
+        for line in reader:
+            row = {key.strip().lower(): (value or '').strip() for key, value in line.items() if key}
+            currency = normalize_currency(row.get('currency'))
+            day = _parse_date(row.get('date', ''))
+            rates[(currency, day)] = float(row.get('rate', '').replace(',', '.'))
+
+    if not rates:
+        return 0
+    keys = list(rates)
+    for start in range(0, len(keys), 500):
+        chunk = keys[start:start + 500]
+        db.session.execute(delete(FxRate).where(tuple_(FxRate.currency, FxRate.rate_date).in_(chunk)))
+    db.session.execute(insert(FxRate), [
+        {'currency': currency, 'rate_date': day, 'rate': rate}
+        for (currency, day), rate in rates.items()
+    ])
+    return len(rates)
@@ -5,96 +5,65 @@ Run this once to create the views: python init_views.py
 from app import app, db
 from sqlalchemy import text
 
+from sql_dialect import CALENDAR_COLUMNS, SUMMARY_COLUMNS, summary_select
+
+VIEW_NAMES = {
+    'day': 'daily_summary',
+    'week': 'weekly_summary',
+    'month': 'monthly_summary',
+    'year': 'yearly_summary',
+}
+
+
+def build_view_statements(dialect_name):
+    """Return (view_name, CREATE VIEW sql) pairs for the given dialect
+
+    Each view aggregates the hot transactions table and adds the frozen
+    aggregates of archived years (archived_summary), so summaries keep
+    covering all of history after `flask archive`.
+    """
+    frozen_columns = ', '.join(SUMMARY_COLUMNS)
+    combined_columns = ',\n                '.join(
+        ['period']
+        + [f'MIN({col}) AS {col}' for col in CALENDAR_COLUMNS]
+        + [f'SUM({col}) AS {col}' for col in ('total_in', 'total_out', 'balance', 'transaction_count',
+                                              'recurrent_in', 'recurrent_out', 'discretionary')]
+        + ['MIN(period_start) AS period_start', 'MAX(period_end) AS period_end']
+    )
+
+    statements = []
+    for granularity, view_name in VIEW_NAMES.items():
+        statements.append((view_name, f"""
+            CREATE VIEW {view_name} AS
+            SELECT
+                {combined_columns}
+            FROM (
+                {summary_select(dialect_name, granularity)}
+                UNION ALL
+                SELECT {frozen_columns} FROM archived_summary WHERE granularity = '{granularity}'
+            ) combined
+            GROUP BY period
+        """))
+    return statements
+
+
 def create_views():
     """Create database views for efficient summary queries"""
     with app.app_context():
+        # The views read archived_summary, make sure it exists
+        db.create_all()
+
         # Drop existing views if they exist
-        views_to_drop = [
-            'daily_summary',
-            'weekly_summary', 
-            'monthly_summary',
-            'yearly_summary'
-        ]
-        
-        for view in views_to_drop:
-            try:
-                db.session.execute(text(f'DROP VIEW IF EXISTS {view}'))
-            except:
-                pass
-        
-        # Daily Summary View
-        db.session.execute(text("""
-            CREATE VIEW daily_summary AS
-            SELECT 
-                strftime('%Y-%m-%d', accounting_date) as period,
-                strftime('%Y', accounting_date) as year,
-                strftime('%m', accounting_date) as month,
-                strftime('%d', accounting_date) as day,
-                strftime('%w', accounting_date) as day_of_week,
-                SUM(CASE WHEN amount > 0 THEN amount ELSE 0 END) as total_in,
-                SUM(CASE WHEN amount < 0 THEN ABS(amount) ELSE 0 END) as total_out,
-                SUM(amount) as balance,
-                COUNT(*) as transaction_count
-            FROM transactions
-            GROUP BY strftime('%Y-%m-%d', accounting_date)
-        """))
-        
-        # Weekly Summary View
-        db.session.execute(text("""
-            CREATE VIEW weekly_summary AS
-            SELECT 
-                strftime('%Y-W%W', accounting_date) as period,
-                strftime('%Y', accounting_date) as year,
-                strftime('%W', accounting_date) as week,
-                SUM(CASE WHEN amount > 0 THEN amount ELSE 0 END) as total_in,
-                SUM(CASE WHEN amount < 0 THEN ABS(amount) ELSE 0 END) as total_out,
-                SUM(amount) as balance,
-                COUNT(*) as transaction_count,
-                MIN(accounting_date) as period_start,
-                MAX(accounting_date) as period_end
-            FROM transactions
-            GROUP BY strftime('%Y-W%W', accounting_date)
-        """))
-        
-        # Monthly Summary View
-        db.session.execute(text("""
-            CREATE VIEW monthly_summary AS
-            SELECT 
-                strftime('%Y-%m', accounting_date) as period,
-                strftime('%Y', accounting_date) as year,
-                strftime('%m', accounting_date) as month,
-                SUM(CASE WHEN amount > 0 THEN amount ELSE 0 END) as total_in,
-                SUM(CASE WHEN amount < 0 THEN ABS(amount) ELSE 0 END) as total_out,
-                SUM(amount) as balance,
-                COUNT(*) as transaction_count,
-                MIN(accounting_date) as period_start,
-                MAX(accounting_date) as period_end
-            FROM transactions
-            GROUP BY strftime('%Y-%m', accounting_date)
-        """))
-        
-        # Yearly Summary View
-        db.session.execute(text("""
-            CREATE VIEW yearly_summary AS
-            SELECT 
-                strftime('%Y', accounting_date) as period,
-                strftime('%Y', accounting_date) as year,
-                SUM(CASE WHEN amount > 0 THEN amount ELSE 0 END) as total_in,
-                SUM(CASE WHEN amount < 0 THEN ABS(amount) ELSE 0 END) as total_out,
-                SUM(amount) as balance,
-                COUNT(*) as transaction_count,
-                MIN(accounting_date) as period_start,
-                MAX(accounting_date) as period_end
-            FROM transactions
-            GROUP BY strftime('%Y', accounting_date)
-        """))
-        
+        for view in VIEW_NAMES.values():
+            db.session.execute(text(f'DROP VIEW IF EXISTS {view}'))
+
+        for view_name, sql in build_view_statements(db.engine.dialect.name):
+            db.session.execute(text(sql))
+
         db.session.commit()
-        print("✅ Database views created successfully!")
-        print("   - daily_summary")
-        print("   - weekly_summary")
-        print("   - monthly_summary")
-        print("   - yearly_summary")
+        print(f"✅ Database views created successfully! ({db.engine.dialect.name})")
+        for view in VIEW_NAMES.values():
+            print(f"   - {view}")
 
 if __name__ == '__main__':
     create_views()
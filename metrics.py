@@ -0,0 +1,349 @@
+"""
+Request and SQL instrumentation, exposed in the Prometheus text format.
+
+Per endpoint, every request records its latency in a histogram together with
+the number of SQL statements it issued, their total time and the rows they
+fetched. The response cache hit and miss counters are reported alongside.
+GET /metrics returns everything in the Prometheus exposition format, to a
+scraper sending METRICS_TOKEN or to a logged-in admin.
+
+gunicorn workers are separate processes, each with its own counters. When
+METRICS_DIR is set, every worker periodically writes its counters to a JSON
+file in that directory and /metrics adds up the files of all workers, so it
+reports the same totals whichever worker answers the scrape. Without it the
+endpoint reports the answering process only (single worker, flask run).
+
+With SLOW_QUERY_MS set, statements slower than the threshold are logged
+along with the endpoint and the database's query plan for them.
+"""
+import glob
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+from flask import abort, current_app, g, has_app_context, request, Response
+from flask_login import current_user
+from sqlalchemy import event
+
+# Request latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HELP = {
+    'myfin_http_requests_total': ('counter', 'Requests handled, by endpoint, method and status'),
+    'myfin_http_request_duration_seconds': ('histogram', 'Request latency, by endpoint'),
+    'myfin_sql_statements_total': ('counter', 'SQL statements executed, by endpoint'),
+    'myfin_sql_duration_seconds_total': ('counter', 'Time spent executing SQL, by endpoint'),
+    'myfin_sql_rows_fetched_total': ('counter', 'Rows fetched from SQL results, by endpoint'),
+    'myfin_sql_slow_statements_total': ('counter', 'Statements slower than SLOW_QUERY_MS, by endpoint'),
+    'myfin_request_query_duration_seconds': ('histogram', 'Reads run side by side in a request, by endpoint and query'),
+    'myfin_import_stage_duration_seconds': ('histogram', 'Post-import pipeline stage duration, by stage'),
+    'myfin_response_cache_hits_total': ('counter', 'Response cache hits'),
+    'myfin_response_cache_misses_total': ('counter', 'Response cache misses'),
+    'myfin_response_cache_hit_ratio': ('gauge', 'Response cache hits / lookups'),
+}
+
+
+class Registry:
+    """Counters and histograms of one process, keyed by (name, labels)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = defaultdict(float)
+        self.histograms = {}
+        self.dirty = False
+
+    def inc(self, name, labels, value=1):
+        with self.lock:
+            self.counters[(name, labels)] += value
+            self.dirty = True
+
+    def observe(self, name, labels, value):
+        with self.lock:
+            histogram = self.histograms.get((name, labels))
+            if histogram is None:
+                histogram = self.histograms[(name, labels)] = [[0] * len(LATENCY_BUCKETS), 0.0, 0]
+            buckets, _, _ = histogram
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    buckets[i] += 1
+            histogram[1] += value
+            histogram[2] += 1
+            self.dirty = True
+
+    def snapshot(self):
+        """JSON-serializable copy of the registry"""
+        with self.lock:
+            self.dirty = False
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value in self.counters.items()],
+                'histograms': [[name, list(labels), buckets[:], total, count]
+                               for (name, labels), (buckets, total, count) in self.histograms.items()],
+            }
+
+
+def merge_snapshots(snapshots):
+    """Add up the snapshots of several processes into (counters, histograms)"""
+    counters = defaultdict(float)
+    histograms = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            counters[(name, tuple(map(tuple, labels)))] += value
+        for name, labels, buckets, total, count in snapshot['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            merged = histograms.setdefault(key, [[0] * len(LATENCY_BUCKETS), 0.0, 0])
+            merged[0] = [a + b for a, b in zip(merged[0], buckets)]
+            merged[1] += total
+            merged[2] += count
+    return counters, histograms
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+
+def render_prometheus(counters, histograms):
+    """Prometheus text exposition of merged counters and histograms"""
+    # {name: {labels: [sample lines]}}, so each histogram keeps its buckets in order
+    by_name = defaultdict(dict)
+    for (name, labels), value in counters.items():
+        by_name[name][labels] = [f'{name}{_format_labels(labels)} {value:g}']
+    for (name, labels), (buckets, total, count) in histograms.items():
+        # Bucket counts are already cumulative (value <= bound)
+        samples = [f'{name}_bucket{_format_labels(labels, [("le", f"{bound:g}")])} {bucket_count}'
+                   for bound, bucket_count in zip(LATENCY_BUCKETS, buckets)]
+        samples.append(f'{name}_bucket{_format_labels(labels, [("le", "+Inf")])} {count}')
+        samples.append(f'{name}_sum{_format_labels(labels)} {total:g}')
+        samples.append(f'{name}_count{_format_labels(labels)} {count}')
+        by_name[name][labels] = samples
+
+    lines = []
+    for name in sorted(by_name):
+        kind, help_text = HELP.get(name, ('untyped', name))
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels in sorted(by_name[name]):
+            lines.extend(by_name[name][labels])
+    return '\n'.join(lines) + '\n'
+
+
+class Metrics:
+    """The app's registry, plus the per-worker file it is flushed to (METRICS_DIR)"""
+
+    def __init__(self, directory=None, cache=None, flush_interval=1.0):
+        self.registry = Registry()
+        self.cache = cache
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.flusher_pid = None
+
+    def _path(self):
+        return os.path.join(self.directory, f'worker-{os.getpid()}.json')
+
+    def flush(self):
+        """Write this process's snapshot to the shared directory"""
+        snapshot = self.registry.snapshot()
+        snapshot['counters'].extend(self._cache_counters())
+        path = self._path()
+        with open(path + '.tmp', 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(path + '.tmp', path)
+
+    def ensure_flusher(self):
+        """Start the background flush thread of this process (after gunicorn forks)"""
+        if not self.directory or self.flusher_pid == os.getpid():
+            return
+        self.flusher_pid = os.getpid()
+
+        def run():
+            while True:
+                time.sleep(self.flush_interval)
+                if self.registry.dirty:
+                    self.flush()
+        threading.Thread(target=run, name='metrics-flush', daemon=True).start()
+
+    def _cache_counters(self):
+        cache = self.cache
+        if cache is None:
+            return []
+        return [['myfin_response_cache_hits_total', [], cache.hits],
+                ['myfin_response_cache_misses_total', [], cache.misses]]
+
+    def collect(self):
+        """Merged (counters, histograms) of every worker"""
+        if self.directory:
+            self.flush()
+            snapshots = []
+            for path in glob.glob(os.path.join(self.directory, 'worker-*.json')):
+                try:
+                    with open(path) as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    continue  # being replaced by its worker right now
+        else:
+            snapshot = self.registry.snapshot()
+            snapshot['counters'].extend(self._cache_counters())
+            snapshots = [snapshot]
+
+        counters, histograms = merge_snapshots(snapshots)
+        hits = counters.get(('myfin_response_cache_hits_total', ()), 0)
+        misses = counters.get(('myfin_response_cache_misses_total', ()), 0)
+        if hits + misses:
+            counters[('myfin_response_cache_hit_ratio', ())] = hits / (hits + misses)
+        return counters, histograms
+
+
+def _endpoint():
+    return request.endpoint or 'unmatched'
+
+
+class CountingCursor:
+    """DB-API cursor proxy counting the rows fetched through it"""
+
+    def __init__(self, cursor, on_rows):
+        self._cursor = cursor
+        self._on_rows = on_rows
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._on_rows(1)
+        return row
+
+    def fetchmany(self, *args):
+        rows = self._cursor.fetchmany(*args)
+        self._on_rows(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._on_rows(len(rows))
+        return rows
+
+    def __iter__(self):
+        for row in self._cursor:
+            self._on_rows(1)
+            yield row
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+def _request_stats():
+    """SQL counters of the current request, None outside of one"""
+    if not has_app_context():
+        return None
+    return g.get('sql_stats')
+
+
+def _add_rows(count):
+    stats = _request_stats()
+    if stats is not None:
+        stats['rows'] += count
+
+
+def explain(dbapi_connection, dialect_name, statement, parameters):
+    """Query plan of a statement as text lines, run on the raw connection (no events)"""
+    prefix = 'EXPLAIN QUERY PLAN ' if dialect_name == 'sqlite' else 'EXPLAIN '
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(prefix + statement, parameters)
+        return [' '.join(str(column) for column in row) for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+def install_sql_hooks(engine, slow_query_ms, logger):
+    """Time every statement and count fetched rows for the request running it"""
+    dialect = engine.dialect
+    base_context = dialect.execution_ctx_cls
+
+    class CountingExecutionContext(base_context):
+        def create_cursor(self):
+            return CountingCursor(super().create_cursor(), _add_rows)
+
+    dialect.execution_ctx_cls = CountingExecutionContext
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info['metrics_started'] = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info.pop('metrics_started')
+        stats = _request_stats()
+        if stats is None:
+            return
+        stats['statements'] += 1
+        stats['seconds'] += elapsed
+
+        if slow_query_ms and elapsed * 1000 >= slow_query_ms:
+            stats['slow'] += 1
+            plan = []
+            if not executemany and statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+                try:
+                    plan = explain(conn.connection.dbapi_connection, dialect.name, statement, parameters)
+                except Exception as e:  # the plan is best effort, never fail the request for it
+                    plan = [f'(no plan: {e})']
+            logger.warning('Slow query (%.1f ms) in %s: %s\n  params: %r\n  plan:\n    %s',
+                           elapsed * 1000, _endpoint(), statement, parameters, '\n    '.join(plan) or '-')
+
+
+def init_metrics(app, db):
+    """Instrument requests and SQL, and register GET /metrics, when METRICS_ENABLED"""
+    if not app.config.get('METRICS_ENABLED'):
+        return None
+
+    metrics = Metrics(directory=app.config.get('METRICS_DIR') or None,
+                      cache=app.extensions.get('response_cache'))
+    if metrics.directory:
+        os.makedirs(metrics.directory, exist_ok=True)
+    app.extensions['metrics'] = metrics
+    registry = metrics.registry
+
+    with app.app_context():
+        for engine in db.engines.values():
+            install_sql_hooks(engine, app.config.get('SLOW_QUERY_MS', 0), app.logger)
+
+    @app.before_request
+    def _start_request():
+        metrics.ensure_flusher()
+        g.request_started = time.perf_counter()
+        g.sql_stats = {'statements': 0, 'seconds': 0.0, 'rows': 0, 'slow': 0}
+
+    @app.after_request
+    def _record_request(response):
+        started = g.pop('request_started', None)
+        stats = g.pop('sql_stats', None)
+        if started is None or request.endpoint == 'metrics':
+            return response
+        endpoint = (('endpoint', _endpoint()),)
+        registry.inc('myfin_http_requests_total',
+                     endpoint + (('method', request.method), ('status', str(response.status_code))))
+        registry.observe('myfin_http_request_duration_seconds', endpoint, time.perf_counter() - started)
+        registry.inc('myfin_sql_statements_total', endpoint, stats['statements'])
+        registry.inc('myfin_sql_duration_seconds_total', endpoint, stats['seconds'])
+        registry.inc('myfin_sql_rows_fetched_total', endpoint, stats['rows'])
+        if stats['slow']:
+            registry.inc('myfin_sql_slow_statements_total', endpoint, stats['slow'])
+        return response
+
+    @app.route('/metrics', endpoint='metrics')
+    def metrics_endpoint():
+        """Prometheus scrape target, for `Authorization: Bearer <METRICS_TOKEN>` or a logged-in admin
+
+        Without METRICS_TOKEN only admins get it: the counters are never public.
+        """
+        token = current_app.config.get('METRICS_TOKEN')
+        scraper = bool(token) and request.headers.get('Authorization') == f'Bearer {token}'
+        if not scraper and not (current_user.is_authenticated and current_user.is_admin):
+            abort(403)
+        return Response(render_prometheus(*metrics.collect()),
+                        mimetype='text/plain; version=0.0.4')
+
+    return metrics
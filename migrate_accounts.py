@@ -0,0 +1,22 @@
+"""
+Database migration for per-account and multi-currency aggregates
+Run this once after upgrading: python migrate_accounts.py
+"""
+from app import app, db
+from models import Transaction, ArchivedTransaction
+
+def migrate():
+    """Create fx_rates and index transactions by (account_id, accounting_date)"""
+    with app.app_context():
+        # Create all tables (will only create new ones)
+        db.create_all()
+        print("✅ fx_rates table present")
+        
+        # Indexes added to existing tables are not created by create_all
+        for model in (Transaction, ArchivedTransaction):
+            for index in model.__table__.indexes:
+                index.create(db.engine, checkfirst=True)
+        print("✅ Account/date indexes present")
+
+if __name__ == '__main__':
+    migrate()
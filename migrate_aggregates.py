@@ -0,0 +1,26 @@
+"""
+Database migration for incrementally maintained tag aggregates
+Run this once (or any time to rebuild the totals): python migrate_aggregates.py
+"""
+from app import app, db
+from models import Transaction, ArchivedTransaction
+from aggregates import rebuild_tag_aggregates
+
+def migrate():
+    """Create tag_aggregates, index transactions.tag_id and backfill the totals"""
+    with app.app_context():
+        # Create all tables (will only create new ones)
+        db.create_all()
+        
+        # Indexes added to existing tables are not created by create_all
+        for model in (Transaction, ArchivedTransaction):
+            for index in model.__table__.indexes:
+                index.create(db.engine, checkfirst=True)
+        print("✅ Transaction indexes present")
+        
+        rebuild_tag_aggregates()
+        db.session.commit()
+        print("✅ Tag aggregates rebuilt")
+
+if __name__ == '__main__':
+    migrate()
@@ -0,0 +1,21 @@
+"""
+Database migration for the rollup cube behind /api/aggregate
+Run this once after upgrading: python migrate_cube.py
+"""
+from app import app, db
+from cube import rebuild_cube
+
+def migrate():
+    """Create rollup_cube and rollup_state and fill them from every transaction"""
+    with app.app_context():
+        # Create all tables (will only create new ones)
+        db.create_all()
+        print("✅ rollup_cube and rollup_state tables present")
+        
+        rebuild_cube()
+        db.session.commit()
+        count = db.session.execute(db.text('SELECT COUNT(*) FROM rollup_cube')).scalar()
+        print(f"✅ Rollup cube built: {count} cells")
+
+if __name__ == '__main__':
+    migrate()
@@ -0,0 +1,70 @@
+"""
+Database migration for the account, counterparty and currency dimension tables
+Run this once after upgrading: python migrate_dimensions.py
+"""
+from sqlalchemy import inspect, text
+
+from app import app, db
+from cube import rebuild_cube
+from dimensions import assign_dimension_ids
+from models import ArchivedTransaction, RollupCell, Transaction
+
+ID_COLUMNS = ('account_id', 'counterparty_id', 'currency_id')
+
+# Columns replaced by the ids, dropped once the rows are encoded
+STRING_COLUMNS = ('account_number', 'account_name', 'counterparty_account', 'currency')
+
+def migrate():
+    """Create the dimension tables, encode the existing rows and drop their string columns"""
+    with app.app_context():
+        # Create all tables (will only create new ones)
+        db.create_all()
+        print("✅ bank_accounts, counterparties and currencies tables present")
+        
+        # Columns added to existing tables are not created by create_all
+        for model in (Transaction, ArchivedTransaction):
+            table = model.__table__
+            existing = {column['name'] for column in inspect(db.engine).get_columns(table.name)}
+            with db.engine.begin() as conn:
+                for name in ID_COLUMNS:
+                    if name not in existing:
+                        conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {name} INTEGER'))
+                        print(f"✅ Added {table.name}.{name}")
+        
+        encoded = assign_dimension_ids()
+        db.session.commit()
+        print(f"✅ {encoded} dimension ids assigned")
+        
+        dropped = False
+        for model in (Transaction, ArchivedTransaction):
+            table = model.__table__
+            existing = {column['name'] for column in inspect(db.engine).get_columns(table.name)}
+            if 'account_number' in existing:
+                # The account/date index was on account_number: it is recreated on account_id below
+                db.session.execute(text(f'DROP INDEX IF EXISTS ix_{table.name}_account_date'))
+                for name in STRING_COLUMNS:
+                    if name in existing:
+                        db.session.execute(text(f'ALTER TABLE {table.name} DROP COLUMN {name}'))
+                db.session.commit()
+                dropped = True
+                print(f"✅ Dropped the string columns of {table.name}")
+            for index in table.indexes:
+                index.create(db.engine, checkfirst=True)
+        
+        cube_columns = {column['name'] for column in inspect(db.engine).get_columns(RollupCell.__tablename__)}
+        if 'account_id' not in cube_columns:
+            # Cells keyed by the strings: recreate the cube on the ids
+            RollupCell.__table__.drop(db.engine)
+            RollupCell.__table__.create(db.engine)
+            rebuild_cube()
+            db.session.commit()
+            print("✅ Rollup cube rebuilt on the dimension ids")
+        
+        if dropped and db.engine.dialect.name == 'sqlite':
+            # Give the freed pages back, so the tables are stored densely
+            with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+                conn.execute(text('VACUUM'))
+            print("✅ Database vacuumed")
+
+if __name__ == '__main__':
+    migrate()
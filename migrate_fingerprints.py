@@ -0,0 +1,24 @@
+"""
+Database migration for the post-import pipeline
+Run this once after upgrading: python migrate_fingerprints.py
+"""
+from sqlalchemy import func
+
+from app import app, db
+from models import Transaction
+from pipeline import IdRange, run_pipeline
+
+def migrate():
+    """Create transaction_fingerprints and fingerprint every transaction imported so far"""
+    with app.app_context():
+        # Create all tables (will only create new ones)
+        db.create_all()
+        print("✅ transaction_fingerprints table present")
+        
+        # The newest transaction always stays hot, its id is the highest of both tables
+        last_id = db.session.query(func.max(Transaction.id)).scalar() or 0
+        run, = run_pipeline(IdRange(1, last_id), names=['fingerprints'])
+        print(f"✅ {run.result or 0} transactions fingerprinted in {run.seconds:.1f}s ({run.status})")
+
+if __name__ == '__main__':
+    migrate()
@@ -3,7 +3,7 @@ Database migration to add Pattern model tables
 Run this once to create the pattern tables: python migrate_patterns.py
 """
 from app import app, db
-from sqlalchemy import text
+from sqlalchemy import inspect, text
 
 def migrate():
     """Create pattern tables and add merge_id field"""
@@ -13,9 +13,8 @@ def migrate():
         
         # Add merge_id column if it doesn't exist (for existing tables)
         try:
-            # Check if merge_id column exists
-            result = db.session.execute(text("PRAGMA table_info(patterns)"))
-            columns = [row[1] for row in result]
+            # Check if merge_id column exists (inspector works on SQLite and PostgreSQL)
+            columns = [col['name'] for col in inspect(db.engine).get_columns('patterns')]
             
             if 'merge_id' not in columns:
                 # Add the column
@@ -0,0 +1,28 @@
+"""
+Database migration for the recurrent / discretionary split of the summaries
+Run this once after upgrading: python migrate_recurrent.py
+"""
+from sqlalchemy import inspect, text
+
+from app import app, db
+from init_views import create_views
+
+SPLIT_COLUMNS = ('recurrent_in', 'recurrent_out', 'discretionary')
+
+def migrate():
+    """Add the split columns to archived_summary and recreate the summary views"""
+    with app.app_context():
+        existing = {column['name'] for column in inspect(db.engine).get_columns('archived_summary')}
+        with db.engine.begin() as conn:
+            for name in SPLIT_COLUMNS:
+                if name not in existing:
+                    conn.execute(text(f'ALTER TABLE archived_summary ADD COLUMN {name} FLOAT NOT NULL DEFAULT 0'))
+                    print(f"✅ Added archived_summary.{name}")
+            if 'discretionary' not in existing:
+                # Archived transactions never belong to a pattern: all their expenses are discretionary
+                conn.execute(text('UPDATE archived_summary SET discretionary = total_out'))
+    
+    create_views()
+
+if __name__ == '__main__':
+    migrate()
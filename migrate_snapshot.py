@@ -0,0 +1,20 @@
+"""
+Database migration for the labels version of the analytics snapshot
+Run this once after upgrading: python migrate_snapshot.py
+"""
+from sqlalchemy import inspect, text
+
+from app import app, db
+
+def migrate():
+    """Add data_version.labels_version"""
+    with app.app_context():
+        db.create_all()
+        existing = {column['name'] for column in inspect(db.engine).get_columns('data_version')}
+        if 'labels_version' not in existing:
+            with db.engine.begin() as conn:
+                conn.execute(text('ALTER TABLE data_version ADD COLUMN labels_version INTEGER NOT NULL DEFAULT 0'))
+            print("✅ Added data_version.labels_version")
+
+if __name__ == '__main__':
+    migrate()
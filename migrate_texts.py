@@ -0,0 +1,42 @@
+"""
+Database migration moving details and message out of the transaction tables
+Run this once after upgrading: python migrate_texts.py
+"""
+from sqlalchemy import inspect, text
+
+from app import app, db
+
+TABLES = ('transactions', 'transactions_archive')
+
+def migrate():
+    """Create transaction_texts, move the long text into it and drop the old columns"""
+    with app.app_context():
+        # Create all tables (will only create new ones)
+        db.create_all()
+        print("✅ transaction_texts table present")
+        
+        moved = False
+        for table in TABLES:
+            columns = {column['name'] for column in inspect(db.engine).get_columns(table)}
+            if 'details' not in columns:
+                continue
+            count = db.session.execute(text(f"""
+                INSERT INTO transaction_texts (transaction_id, details, message)
+                SELECT id, details, message FROM {table}
+                WHERE (details IS NOT NULL OR message IS NOT NULL)
+                  AND id NOT IN (SELECT transaction_id FROM transaction_texts)
+            """)).rowcount
+            db.session.execute(text(f'ALTER TABLE {table} DROP COLUMN details'))
+            db.session.execute(text(f'ALTER TABLE {table} DROP COLUMN message'))
+            db.session.commit()
+            moved = True
+            print(f"✅ Moved the text of {count} rows out of {table}")
+        
+        if moved and db.engine.dialect.name == 'sqlite':
+            # Give the freed pages back, so the tables are stored densely
+            with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+                conn.execute(text('VACUUM'))
+            print("✅ Database vacuumed")
+
+if __name__ == '__main__':
+    migrate()
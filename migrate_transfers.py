@@ -0,0 +1,22 @@
+"""
+Database migration for transfers between own accounts
+Run this once after upgrading: python migrate_transfers.py
+"""
+from app import app, db
+from cache import bump_data_version
+from transfers import detect_transfers
+
+def migrate():
+    """Create transfer_pairs and pair the transfers already imported"""
+    with app.app_context():
+        # Create all tables (will only create new ones)
+        db.create_all()
+        print("✅ transfer_pairs table present")
+        
+        paired = detect_transfers()
+        bump_data_version()
+        db.session.commit()
+        print(f"✅ {paired} transfers paired")
+
+if __name__ == '__main__':
+    migrate()
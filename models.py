@@ -1,9 +1,12 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
+from sqlalchemy.orm import declared_attr
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 
-db = SQLAlchemy()
+from db_routing import RoutingSession
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
@@ -24,23 +27,73 @@ class User(UserMixin, db.Model):
         return f'<User {self.username}>'
 
 
-class Transaction(db.Model):
-    __tablename__ = 'transactions'
+class BankAccount(db.Model):
+    """Dimension table of the imported accounts (see dimensions.py)"""
+    __tablename__ = 'bank_accounts'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    number = db.Column(db.String(50), unique=True, nullable=False)
+    name = db.Column(db.String(200))
+    
+    def __repr__(self):
+        return f'<BankAccount {self.number}>'
+
+
+class Counterparty(db.Model):
+    """Dimension table of the counterparty accounts"""
+    __tablename__ = 'counterparties'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    account = db.Column(db.String(50), unique=True, nullable=False)
+    
+    def __repr__(self):
+        return f'<Counterparty {self.account}>'
+
+
+class Currency(db.Model):
+    """Dimension table of the currency codes"""
+    __tablename__ = 'currencies'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    code = db.Column(db.String(10), unique=True, nullable=False)
+    
+    def __repr__(self):
+        return f'<Currency {self.code}>'
+
+
+class TransactionColumns:
+    """Columns shared by the hot transactions table and its archive partition"""
     
     id = db.Column(db.Integer, primary_key=True)
-    account_number = db.Column(db.String(50), nullable=False)
-    account_name = db.Column(db.String(200))
-    counterparty_account = db.Column(db.String(50))
     transaction_number = db.Column(db.String(50))
     accounting_date = db.Column(db.Date, nullable=False, index=True)
     value_date = db.Column(db.Date)
     amount = db.Column(db.Float, nullable=False)
-    currency = db.Column(db.String(10), default='EUR')
     description = db.Column(db.Text)
+    tag_id = db.Column(db.Integer, db.ForeignKey('tags.id'), nullable=True, index=True)
+    imported_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # The account, counterparty account and currency, as keys of their dimension tables (see dimensions.py)
+    account_id = db.Column(db.Integer, db.ForeignKey('bank_accounts.id'), nullable=False)
+    counterparty_id = db.Column(db.Integer, db.ForeignKey('counterparties.id'), index=True)
+    currency_id = db.Column(db.Integer, db.ForeignKey('currencies.id'))
+    
+    @declared_attr.directive
+    def __table_args__(cls):
+        # Per-account dashboards and summaries scan one account's date range
+        return (db.Index(f'ix_{cls.__tablename__}_account_date', 'account_id', 'accounting_date'),)
+
+
+class TransactionText(db.Model):
+    """Long free text of a hot or archived transaction, kept out of the scanned tables"""
+    __tablename__ = 'transaction_texts'
+    
+    transaction_id = db.Column(db.Integer, primary_key=True)  # no FK: rows may be archived
     details = db.Column(db.Text)
     message = db.Column(db.Text)
-    tag_id = db.Column(db.Integer, db.ForeignKey('tags.id'), nullable=True)
-    imported_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class Transaction(TransactionColumns, db.Model):
+    __tablename__ = 'transactions'
     
     # Relationship
     tag = db.relationship('Tag', back_populates='transactions')
@@ -54,7 +107,42 @@ class Transaction(db.Model):
         return self.amount < 0
     
     def __repr__(self):
-        return f'<Transaction {self.id}: {self.amount} {self.currency} on {self.accounting_date}>'
+        return f'<Transaction {self.id}: {self.amount} on {self.accounting_date}>'
+
+
+class ArchivedTransaction(TransactionColumns, db.Model):
+    """Transactions of closed years, moved out of the hot table by `flask archive`"""
+    __tablename__ = 'transactions_archive'
+    
+    def __repr__(self):
+        return f'<ArchivedTransaction {self.id}: {self.amount} on {self.accounting_date}>'
+
+
+class ArchivedSummary(db.Model):
+    """Per-period aggregates of archived transactions, frozen at archive time"""
+    __tablename__ = 'archived_summary'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    granularity = db.Column(db.String(10), nullable=False, index=True)  # 'day', 'week', 'month', 'year'
+    period = db.Column(db.String(10), nullable=False)
+    year = db.Column(db.String(4))
+    month = db.Column(db.String(2))
+    week = db.Column(db.String(2))
+    day = db.Column(db.String(2))
+    day_of_week = db.Column(db.String(1))
+    total_in = db.Column(db.Float, nullable=False, default=0)
+    total_out = db.Column(db.Float, nullable=False, default=0)
+    balance = db.Column(db.Float, nullable=False, default=0)
+    transaction_count = db.Column(db.Integer, nullable=False, default=0)
+    # Archived rows never belong to a pattern: recurrent sums stay 0, discretionary = total_out
+    recurrent_in = db.Column(db.Float, nullable=False, default=0)
+    recurrent_out = db.Column(db.Float, nullable=False, default=0)
+    discretionary = db.Column(db.Float, nullable=False, default=0)
+    period_start = db.Column(db.Date)
+    period_end = db.Column(db.Date)
+    
+    def __repr__(self):
+        return f'<ArchivedSummary {self.granularity} {self.period}>'
 
 
 class Tag(db.Model):
@@ -72,6 +160,20 @@ class Tag(db.Model):
         return f'<Tag {self.name}>'
 
 
+class TagAggregate(db.Model):
+    """Running totals per tag, adjusted by deltas whenever transactions are (re)tagged"""
+    __tablename__ = 'tag_aggregates'
+    
+    tag_id = db.Column(db.Integer, db.ForeignKey('tags.id'), primary_key=True)
+    total_amount = db.Column(db.Float, nullable=False, default=0)
+    transaction_count = db.Column(db.Integer, nullable=False, default=0)
+    total_in = db.Column(db.Float, nullable=False, default=0)
+    total_out = db.Column(db.Float, nullable=False, default=0)  # positive
+    
+    def __repr__(self):
+        return f'<TagAggregate {self.tag_id}: {self.total_amount} over {self.transaction_count}>'
+
+
 # Association table for pattern-transaction many-to-many relationship
 pattern_transactions = db.Table('pattern_transactions',
     db.Column('pattern_id', db.Integer, db.ForeignKey('patterns.id'), primary_key=True),
@@ -106,3 +208,93 @@ class Pattern(db.Model):
     
     def __repr__(self):
         return f'<Pattern {self.name}: {self.pattern_type}>'
+
+
+class TransferPair(db.Model):
+    """An outgoing and an incoming transaction that move money between own accounts"""
+    __tablename__ = 'transfer_pairs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    # No foreign keys: either leg may live in transactions or transactions_archive
+    out_transaction_id = db.Column(db.Integer, nullable=False, unique=True)
+    in_transaction_id = db.Column(db.Integer, nullable=False, unique=True)
+    amount = db.Column(db.Float, nullable=False)  # positive
+    out_date = db.Column(db.Date, nullable=False, index=True)
+    in_date = db.Column(db.Date, nullable=False, index=True)
+    is_active = db.Column(db.Boolean, default=True, nullable=False)  # False once rejected by a user
+    detected_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<TransferPair {self.out_transaction_id} -> {self.in_transaction_id}: {self.amount}>'
+
+
+class RollupCell(db.Model):
+    """Sums of the transactions of one month sharing a tag, account, counterparty, currency and sign"""
+    __tablename__ = 'rollup_cube'
+    __table_args__ = (
+        db.UniqueConstraint('month', 'tag_id', 'account_id', 'counterparty_id', 'currency_id', 'sign',
+                            name='uq_rollup_cube_cell'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    month = db.Column(db.String(7), nullable=False)  # 'YYYY-MM'
+    tag_id = db.Column(db.Integer, nullable=False, default=0)  # 0 = untagged
+    account_id = db.Column(db.Integer, nullable=False)
+    counterparty_id = db.Column(db.Integer, nullable=False, default=0)  # 0 = none
+    currency_id = db.Column(db.Integer, nullable=False, default=0)  # 0 = none
+    sign = db.Column(db.String(3), nullable=False)  # 'in' or 'out'
+    amount = db.Column(db.Float, nullable=False, default=0)
+    transaction_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<RollupCell {self.month} {self.tag_id} {self.account_id} {self.sign}: {self.amount}>'
+
+
+class RollupState(db.Model):
+    """Single row: the highest transaction id the rollup cube includes"""
+    __tablename__ = 'rollup_state'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    last_id = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<RollupState {self.last_id}>'
+
+
+class TransactionFingerprint(db.Model):
+    """Normalized counterparty and description of a transaction (see fingerprints.py)"""
+    __tablename__ = 'transaction_fingerprints'
+    
+    # No foreign key: the transaction may live in transactions or transactions_archive
+    transaction_id = db.Column(db.Integer, primary_key=True)
+    fingerprint = db.Column(db.String(120), nullable=False, index=True)
+    
+    def __repr__(self):
+        return f'<TransactionFingerprint {self.transaction_id}: {self.fingerprint}>'
+
+
+class FxRate(db.Model):
+    """Value of one unit of a currency in the base currency (BASE_CURRENCY) on a day"""
+    __tablename__ = 'fx_rates'
+    __table_args__ = (db.UniqueConstraint('currency', 'rate_date'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    currency = db.Column(db.String(10), nullable=False)
+    rate_date = db.Column(db.Date, nullable=False)
+    rate = db.Column(db.Float, nullable=False)
+    
+    def __repr__(self):
+        return f'<FxRate {self.currency} {self.rate_date}: {self.rate}>'
+
+
+class DataVersion(db.Model):
+    """Single-row counter bumped by every write, keys the response cache"""
+    __tablename__ = 'data_version'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    # Bumped only by writes that change tags or pattern membership (the snapshot labels)
+    labels_version = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<DataVersion {self.version}>'
@@ -0,0 +1,134 @@
+"""
+Tagging and pattern edits shared by the single-action endpoints and /api/batch.
+
+Each operation checks its input before touching anything, so a failing
+operation leaves the session as it found it. None of them commits: the
+caller bumps the data version and commits once, which lets /api/batch run
+a whole list of operations in a single transaction.
+"""
+from aggregates import retag
+from models import db, Pattern, Tag, Transaction
+from refcache import mark_tags_changed, tag_cache
+
+# Upper bound on the operations of one /api/batch request
+MAX_BATCH_OPERATIONS = 1000
+
+
+class OperationError(Exception):
+    """An operation that cannot be applied, with the HTTP status it maps to"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def get_or_create_tag(tag_name):
+    """The tag named tag_name (anything with an id), created when missing"""
+    tag = tag_cache().by_name(tag_name)
+    if tag:
+        return tag
+
+    # Possibly created by another worker since the cache was loaded
+    tag = Tag.query.filter_by(name=tag_name).first()
+    if not tag:
+        tag = Tag(name=tag_name)
+        db.session.add(tag)
+        db.session.flush()
+        mark_tags_changed()
+    return tag
+
+
+def tag_one(transaction_id, tag_name):
+    """Tag a single transaction"""
+    if not transaction_id or not tag_name:
+        raise OperationError('Missing data')
+
+    transaction = db.session.get(Transaction, transaction_id)
+    if not transaction:
+        raise OperationError('Transaction not found', 404)
+
+    tag = get_or_create_tag(tag_name)
+    retag([transaction.id], tag.id)
+    transaction.tag_id = tag.id
+    return {'tag_id': tag.id}
+
+
+def tag_many(transaction_ids, tag_name):
+    """Tag a list of transactions"""
+    if not transaction_ids or not tag_name:
+        raise OperationError('Missing data')
+    if not isinstance(transaction_ids, list):
+        raise OperationError('transaction_ids must be a list')
+
+    tag = get_or_create_tag(tag_name)
+    # Tag totals first, they read the current tags
+    retag(transaction_ids, tag.id)
+    Transaction.query.filter(Transaction.id.in_(transaction_ids)).update(
+        {Transaction.tag_id: tag.id},
+        synchronize_session=False
+    )
+    return {'count': len(transaction_ids)}
+
+
+def set_merge_id(pattern_id, merge_id):
+    """Group a pattern with the other patterns sharing merge_id"""
+    if merge_id is None:
+        raise OperationError('merge_id is required')
+    try:
+        merge_id = int(merge_id)
+    except (TypeError, ValueError):
+        raise OperationError('Invalid merge_id format')
+
+    pattern = db.session.get(Pattern, pattern_id)
+    if not pattern:
+        raise OperationError('Pattern not found', 404)
+
+    pattern.merge_id = merge_id
+    return {'message': 'Merge ID updated'}
+
+
+def deactivate_pattern(pattern_id):
+    """Delete a validated pattern (kept, marked inactive)"""
+    pattern = db.session.get(Pattern, pattern_id)
+    if not pattern:
+        raise OperationError('Pattern not found', 404)
+
+    pattern.is_active = False
+    return {'message': 'Pattern deleted'}
+
+
+# Batch operation name -> (function, JSON fields passed as its arguments)
+BATCH_OPERATIONS = {
+    'tag': (tag_one, ('transaction_id', 'tag_name')),
+    'bulk_tag': (tag_many, ('transaction_ids', 'tag_name')),
+    'merge': (set_merge_id, ('pattern_id', 'merge_id')),
+    'delete': (deactivate_pattern, ('pattern_id',)),
+}
+
+
+def run_batch(operations, atomic=False):
+    """Apply operations in order; returns (per-operation results, number applied)
+
+    A failing operation is reported in its result and skipped, unless atomic
+    is set: then nothing after it runs and the caller must roll back.
+    """
+    results = []
+    applied = 0
+    for operation in operations:
+        if not isinstance(operation, dict):
+            operation = {}
+        name = operation.get('op')
+        try:
+            if name not in BATCH_OPERATIONS:
+                raise OperationError(f'Unknown operation {name!r}')
+            function, fields = BATCH_OPERATIONS[name]
+            result = function(*(operation.get(field) for field in fields))
+        except OperationError as e:
+            results.append({'op': name, 'success': False, 'message': e.message, 'status': e.status})
+            if atomic:
+                break
+            continue
+        results.append(dict(result, op=name, success=True))
+        applied += 1
+    return results, applied
@@ -0,0 +1,128 @@
+"""
+Independent read queries of one request, run side by side.
+
+A page such as the summary needs its period totals, its tag totals and its
+anomaly marks; none of them depends on the others, yet run one after the
+other their latencies add up. run_concurrently() takes those reads as named
+callables: the request thread runs the first one itself while the others run
+on a pool of REQUEST_QUERY_WORKERS threads shared by every request of the
+worker process, so a page costs about as much as its slowest read.
+
+Each pooled read runs in its own app context, hence its own database session
+and connection (SQLite serves concurrent readers under WAL). It only sees the
+app: read what it needs from the request beforehand and pass it as arguments.
+It shares the request's data version, so every read answers for the same
+data, and its SQL statements count towards the request's metrics. It goes to
+the read bind when there is one (see db_routing.py).
+
+Every call is timed: the request's reads are logged at debug level, sent in
+a Server-Timing header with the slowest one (the critical path) marked, and
+recorded in the myfin_request_query_duration_seconds histogram when metrics
+are enabled. REQUEST_QUERY_WORKERS=0 runs the reads one after the other in
+the request's own session.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app, g, has_request_context, request
+
+
+def _timed(function):
+    started = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - started
+
+
+def _run_pooled(app, data_version, function):
+    """Run function in its own app context; returns (result, seconds, sql stats)"""
+    with app.app_context():
+        g.in_query_pool = True
+        g.db_read_only = True  # reads only: routed to the read bind (db_routing.py)
+        if data_version is not None:
+            g.data_version = data_version
+        g.sql_stats = {'statements': 0, 'seconds': 0.0, 'rows': 0, 'slow': 0}
+        result, seconds = _timed(function)
+        return result, seconds, g.sql_stats
+
+
+def run_concurrently(**reads):
+    """Run independent reads (callables without arguments); returns their results by name
+
+    An exception in any read is raised once all of them have finished.
+    """
+    pool = current_app.extensions.get('query_pool')
+    names = list(reads)
+    if pool is None or len(names) < 2 or g.get('in_query_pool'):
+        # Sequential, in this session
+        started = time.perf_counter()
+        timed = {name: _timed(reads[name]) for name in names}
+        _record(timed, time.perf_counter() - started)
+        return {name: result for name, (result, _) in timed.items()}
+
+    app = current_app._get_current_object()
+    started = time.perf_counter()
+    futures = {name: pool.submit(_run_pooled, app, g.get('data_version'), reads[name]) for name in names[1:]}
+    timed = {}
+    error = None
+    try:
+        timed[names[0]] = _timed(reads[names[0]])
+    except Exception as e:
+        error = e
+    stats = g.get('sql_stats')
+    for name, future in futures.items():
+        try:
+            result, seconds, pooled_stats = future.result()
+        except Exception as e:
+            error = error or e
+            continue
+        timed[name] = (result, seconds)
+        if stats is not None:
+            for key, value in pooled_stats.items():
+                stats[key] += value
+    if error is not None:
+        raise error
+    _record(timed, time.perf_counter() - started)
+    return {name: timed[name][0] for name in names}
+
+
+def _record(timed, wall):
+    if not timed:
+        return
+    seconds = {name: elapsed for name, (_, elapsed) in timed.items()}
+    critical = max(seconds, key=seconds.get)
+    endpoint = request.endpoint if has_request_context() and request.endpoint else 'cli'
+    current_app.logger.debug('%s: %d reads in %.1f ms (%.1f ms one after the other), critical path %s %.1f ms',
+                             endpoint, len(seconds), wall * 1000, sum(seconds.values()) * 1000,
+                             critical, seconds[critical] * 1000)
+    if has_request_context():
+        g.setdefault('query_timings', []).append((seconds, critical, wall))
+
+    metrics = current_app.extensions.get('metrics')
+    if metrics is not None:
+        for name, elapsed in seconds.items():
+            metrics.registry.observe('myfin_request_query_duration_seconds',
+                                     (('endpoint', endpoint), ('query', name)), elapsed)
+
+
+def _server_timing(response):
+    """Server-Timing entries of the reads run by the request"""
+    timings = g.pop('query_timings', None)
+    if not timings:
+        return response
+    entries = []
+    for seconds, critical, wall in timings:
+        for name, elapsed in seconds.items():
+            description = ';desc="critical path"' if name == critical else ''
+            entries.append(f'{name};dur={elapsed * 1000:.1f}{description}')
+        entries.append(f'reads;dur={wall * 1000:.1f}')
+    response.headers.add('Server-Timing', ', '.join(entries))
+    return response
+
+
+def init_query_pool(app):
+    """Create the shared pool of REQUEST_QUERY_WORKERS threads (none when 0)"""
+    workers = app.config.get('REQUEST_QUERY_WORKERS', 4)
+    if workers:
+        app.extensions['query_pool'] = ThreadPoolExecutor(max_workers=workers,
+                                                          thread_name_prefix='request-query')
+    app.after_request(_server_timing)
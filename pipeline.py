@@ -0,0 +1,200 @@
+"""
+Post-import pipeline of derived-data stages.
+
+A CSV import commits its new transactions, then hands their id range to
+run_pipeline(). Stages are registered with @stage and name the stages they
+depend on; a stage starts as soon as all of its dependencies have finished,
+so independent stages run side by side on a pool of IMPORT_PIPELINE_WORKERS
+threads. On SQLite they run one after the other: every stage holds a write
+transaction, and SQLite takes one writer at a time, so a stage waiting on
+another past busy_timeout would fail with "database is locked". Each stage
+runs in its own app context, hence its own database session, and only looks
+at the transactions in the id range. A stage that writes is committed on its
+own, with a data version bump when it changed something. A failing stage is
+rolled back and logged, and the stages that depend on it are skipped; the
+import itself is already committed. Once the stages that change tags or
+pattern membership have committed, the snapshot labels are rewritten
+(snapshot.refresh_labels).
+
+Every run is timed per stage: the times are logged, returned to the caller
+and recorded in the myfin_import_stage_duration_seconds histogram when
+metrics are enabled. IMPORT_STAGES selects the stages that run after an
+import; `flask import-pipeline` runs any of them over any id range.
+
+Built-in stages, in dependency order:
+
+- fingerprints: description fingerprints of the new transactions
+- transfers: pairs new transfers between own accounts (transfers.py)
+- auto_tag: tags new transactions like their earlier look-alikes (after fingerprints)
+- patterns: links new transactions to validated patterns (after fingerprints)
+- cube: adds the new transactions to the rollup cube (cube.py), with their tags
+  (after auto_tag); builds the whole cube when it was never built
+- snapshot: appends the batch to the analytics snapshot when SNAPSHOT_ON_IMPORT
+  is set (after all of the above, whose tags and pattern links it stores)
+"""
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from flask import current_app
+
+from cache import bump_data_version
+from cube import extend_cube
+from fingerprints import auto_tag, fingerprint_range, match_patterns
+from models import db
+from snapshot import SnapshotUnavailable, refresh_labels, write_snapshot
+from transfers import detect_transfers
+
+IdRange = namedtuple('IdRange', 'first last')
+
+Stage = namedtuple('Stage', 'name function after writes labels message')
+
+StageRun = namedtuple('StageRun', 'name status seconds result')
+
+# Stages by name, in registration order (dependencies always come first)
+STAGES = {}
+
+
+def stage(name, after=(), writes=True, labels=False, message=None):
+    """Register function(ids) as a stage running after the stages in `after`
+
+    The function returns a count of what it changed (0 for nothing). When
+    writes is set, a non-zero count bumps the data version, and the labels
+    version too when labels is set (the stage changes tags or pattern
+    membership). message is
+    formatted with the count for the import's flash message.
+    """
+    def register(function):
+        unknown = [dependency for dependency in after if dependency not in STAGES]
+        if unknown:
+            raise ValueError(f'Stage {name!r} depends on unknown stages {unknown}')
+        STAGES[name] = Stage(name, function, tuple(after), writes, labels, message)
+        return function
+    return register
+
+
+def enabled_stages():
+    """Names of the stages run after an import (IMPORT_STAGES)"""
+    configured = current_app.config.get('IMPORT_STAGES')
+    if configured is None:
+        return list(STAGES)
+    return [name for name in configured if name in STAGES]
+
+
+def _run_stage(app, definition, ids):
+    """Run one stage in its own app context and session"""
+    with app.app_context():
+        started = time.perf_counter()
+        try:
+            result = definition.function(ids)
+            if definition.writes and result:
+                bump_data_version(labels=definition.labels)
+            db.session.commit()
+            status = 'ok'
+        except Exception:
+            db.session.rollback()
+            app.logger.exception('Import stage %s failed', definition.name)
+            result = None
+            status = 'failed'
+        return StageRun(definition.name, status, time.perf_counter() - started, result)
+
+
+def _record(app, run):
+    app.logger.info('Import stage %s: %s in %.3fs (%s)', run.name, run.status, run.seconds, run.result)
+    metrics = app.extensions.get('metrics')
+    if metrics is not None:
+        metrics.registry.observe('myfin_import_stage_duration_seconds', (('stage', run.name),), run.seconds)
+
+
+def run_pipeline(ids, names=None, workers=None):
+    """Run the stages (default: the enabled ones) over an IdRange; returns their StageRuns
+
+    Dependencies that are not among the stages run count as satisfied. On
+    SQLite the stages run one at a time, in dependency order.
+    """
+    app = current_app._get_current_object()
+    names = set(names if names is not None else enabled_stages())
+    selected = [definition for definition in STAGES.values() if definition.name in names]
+    if not selected:
+        return []
+    if db.engine.dialect.name == 'sqlite':
+        workers = 1  # a single writer: no stage waits on another's write lock
+    else:
+        workers = workers or app.config.get('IMPORT_PIPELINE_WORKERS', 4)
+    chosen = {definition.name for definition in selected}
+
+    runs = {}
+    pending = list(selected)
+    running = {}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='import-stage') as pool:
+        while pending or running:
+            for definition in list(pending):
+                dependencies = [name for name in definition.after if name in chosen]
+                if any(name in runs and runs[name].status != 'ok' for name in dependencies):
+                    runs[definition.name] = StageRun(definition.name, 'skipped', 0.0, None)
+                    pending.remove(definition)
+                elif all(name in runs for name in dependencies):
+                    running[pool.submit(_run_stage, app, definition, ids)] = definition.name
+                    pending.remove(definition)
+            if not running:
+                continue  # only skips were decided, schedule again
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                del running[future]
+                run = future.result()
+                runs[run.name] = run
+                _record(app, run)
+    if any(STAGES[run.name].labels and run.status == 'ok' and run.result for run in runs.values()):
+        refresh_labels()
+    return [runs[definition.name] for definition in selected]
+
+
+def summarize(runs):
+    """Sentence about what the stages changed, for the import's flash message"""
+    messages = []
+    for run in runs:
+        message = STAGES[run.name].message
+        if run.status == 'ok' and run.result and message:
+            messages.append(message.format(run.result))
+    failed = [run.name for run in runs if run.status == 'failed']
+    if failed:
+        messages.append(f'Failed to update: {", ".join(failed)}.')
+    return ' '.join(messages)
+
+
+# Nothing cached depends on the fingerprints: no data version bump
+@stage('fingerprints', writes=False)
+def fingerprint_stage(ids):
+    return fingerprint_range(ids)
+
+
+@stage('transfers', message='Paired {} transfers between your accounts.')
+def transfer_stage(ids):
+    return detect_transfers(ids=ids)
+
+
+@stage('auto_tag', after=('fingerprints',), labels=True, message='Tagged {} transactions like earlier ones.')
+def auto_tag_stage(ids):
+    return auto_tag(ids)
+
+
+@stage('patterns', after=('fingerprints',), labels=True, message='Linked {} transactions to validated patterns.')
+def pattern_stage(ids):
+    return match_patterns(ids)
+
+
+# Adds rows the data version already covers: no bump
+@stage('cube', after=('auto_tag',), writes=False)
+def cube_stage(ids):
+    return extend_cube(ids)
+
+
+@stage('snapshot', after=('transfers', 'auto_tag', 'patterns'), writes=False)
+def snapshot_stage(ids):
+    if not current_app.config.get('SNAPSHOT_ON_IMPORT'):
+        return 0
+    try:
+        return write_snapshot()['appended']
+    except SnapshotUnavailable as e:
+        current_app.logger.warning('Snapshot not updated after import: %s', e)
+        return 0
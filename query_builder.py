@@ -0,0 +1,146 @@
+"""
+Shared transaction filters and column-only row queries.
+
+The analyze page and the search APIs filter transactions by the same
+type / search / date / transfers parameters. TransactionFilter parses them once from the
+request and compiles them into WHERE criteria on the right source (the hot
+table, or hot + archive when the range reaches archived years).
+
+row_select() then picks just the columns an endpoint needs and joins the tag
+name, and the account, counterparty and currency strings (dimensions.py), in
+the same statement. Endpoints get plain rows back instead of
+Transaction instances: no identity-map bookkeeping and no lazy tag SELECT per
+row, so every endpoint runs a fixed number of queries however many rows it
+returns.
+"""
+from datetime import datetime
+
+from flask_sqlalchemy.pagination import SelectPagination
+from sqlalchemy import func, or_, select
+
+from archive import transaction_source
+from dimensions import display_select
+from models import db, BankAccount, Counterparty, Tag, TransactionText
+from transfers import exclude_requested, transfer_leg_ids
+
+# Columns of the analyze table
+LIST_COLUMNS = ('id', 'accounting_date', 'description', 'counterparty_account', 'amount', 'tag_id')
+
+# Columns behind the JSON transaction lists (see row_to_json)
+JSON_COLUMNS = ('id', 'accounting_date', 'amount', 'description', 'counterparty_account')
+
+# Columns users may sort the analyze table by
+SORT_COLUMNS = ('accounting_date', 'amount', 'description', 'counterparty_account')
+
+
+def parse_date(value):
+    """Parse a YYYY-MM-DD query parameter, None when empty or invalid"""
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+
+def row_select(T, columns, with_tag=True):
+    """SELECT of the given columns of T, plus the tag name as `tag_name`"""
+    statement = display_select(T, columns)
+    if with_tag:
+        statement = statement.add_columns(Tag.name.label('tag_name')).outerjoin(Tag, Tag.id == T.tag_id)
+    return statement
+
+
+def row_to_json(row):
+    """JSON form of a row selected with JSON_COLUMNS"""
+    return {
+        'id': row.id,
+        'date': row.accounting_date.strftime('%Y-%m-%d'),
+        'amount': row.amount,
+        'description': row.description,
+        'tag': row.tag_name
+    }
+
+
+class TransactionFilter:
+    """The type / search / date filters of the analyze page, compiled once"""
+
+    def __init__(self, transaction_type='all', search_text='', start_date='', end_date='', exclude_transfers=False):
+        self.transaction_type = transaction_type
+        self.search_text = search_text
+        self.exclude_transfers = exclude_transfers
+        self.start_date = start_date
+        self.end_date = end_date
+        self.start_dt = parse_date(start_date)
+        self.end_dt = parse_date(end_date)
+
+        # Archived years are only read when the date range reaches them
+        self.source = transaction_source(self.start_dt)
+        self.criteria = self._compile()
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(
+            transaction_type=args.get('type', 'all'),  # 'in', 'out', 'all'
+            search_text=args.get('search', ''),
+            start_date=args.get('start_date', ''),
+            end_date=args.get('end_date', ''),
+            exclude_transfers=exclude_requested(args),
+        )
+
+    @property
+    def active(self):
+        """Whether any filter restricts the rows"""
+        return bool(self.criteria)
+
+    def _compile(self):
+        T = self.source
+        criteria = []
+
+        if self.transaction_type == 'in':
+            criteria.append(T.amount > 0)
+        elif self.transaction_type == 'out':
+            criteria.append(T.amount < 0)
+
+        if self.search_text:
+            pattern = f'%{self.search_text}%'
+            criteria.append(or_(
+                T.description.ilike(pattern),
+                T.id.in_(select(TransactionText.transaction_id).where(TransactionText.details.ilike(pattern))),
+                T.account_id.in_(select(BankAccount.id).where(BankAccount.name.ilike(pattern))),
+                T.counterparty_id.in_(select(Counterparty.id).where(Counterparty.account.ilike(pattern)))
+            ))
+
+        if self.start_dt:
+            criteria.append(T.accounting_date >= self.start_dt)
+
+        if self.end_dt:
+            criteria.append(T.accounting_date <= self.end_dt)
+
+        if self.exclude_transfers:
+            criteria.append(T.id.not_in(transfer_leg_ids()))
+
+        return criteria
+
+    def rows(self, columns, with_tag=True):
+        """Filtered SELECT of the given columns (see row_select)"""
+        return row_select(self.source, columns, with_tag).where(*self.criteria)
+
+    def tag_totals(self):
+        """(name, color, total) per tag over the filtered rows"""
+        T = self.source
+        return db.session.execute(
+            select(Tag.name, Tag.color, func.sum(T.amount).label('total'))
+            .join(Tag, Tag.id == T.tag_id)
+            .where(*self.criteria)
+            .group_by(Tag.id, Tag.name, Tag.color)
+            .order_by(Tag.id)
+        ).all()
+
+
+class RowPagination(SelectPagination):
+    """db.paginate() for multi-column selects: items are rows, not scalars"""
+
+    def _query_items(self):
+        statement = self._query_args['select'].limit(self.per_page).offset(self._query_offset)
+        return db.session.execute(statement).all()
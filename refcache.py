@@ -0,0 +1,150 @@
+"""
+Process-local caches of reference data: tags and logged-in users.
+
+Tags are few and change rarely, yet every tagging call looked one up by
+name and the analyze page reloaded all of them for its dropdowns. Each
+worker keeps a snapshot of the tags table, tied to the data version it was
+loaded at. Every tag creation happens in a write that bumps the data version,
+so a request that already knows the current version (all cached views read
+it) reloads the snapshot exactly when another worker may have added a tag.
+Other requests trust the snapshot for up to TAG_CACHE_TTL_SECONDS and then
+re-check the version. Tags created by an uncommitted transaction bypass the
+cache until it commits or rolls back.
+
+Flask-Login loaded the user row on every authenticated request. load_user
+now returns a small snapshot (id, username, is_admin) kept for
+USER_CACHE_TTL_SECONDS. Users only change through the CLI, and the TTL
+bounds how long a change takes to reach the workers.
+"""
+import threading
+import time
+from collections import namedtuple
+
+from flask import current_app, g, has_app_context
+from flask_login import UserMixin
+from sqlalchemy import event
+
+from cache import current_data_version
+from models import db, Tag, User
+
+TagRef = namedtuple('TagRef', 'id name color')
+
+
+class SessionUser(UserMixin):
+    """What requests need of the logged-in user, detached from any session"""
+
+    def __init__(self, id, username, is_admin):
+        self.id = id
+        self.username = username
+        self.is_admin = is_admin
+
+
+class TagCache:
+    """Snapshot of the tags table, by name and by id"""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.snapshot = None  # (version, checked_at, ordered, by_name, by_id)
+
+    def invalidate(self):
+        with self.lock:
+            self.snapshot = None
+
+    def _load(self):
+        tags = [TagRef(*row) for row in db.session.query(Tag.id, Tag.name, Tag.color).order_by(Tag.name)]
+        return tags, {t.name: t for t in tags}, {t.id: t for t in tags}
+
+    def _current(self):
+        """(ordered, by_name, by_id), reloaded when the data version moved"""
+        if db.session.info.get('tags_changed'):
+            # This transaction created tags that may still be rolled back
+            return self._load()
+
+        now = time.monotonic()
+        snapshot = self.snapshot
+        if snapshot is not None:
+            version, checked_at, *tables = snapshot
+            known = g.get('data_version') if has_app_context() else None
+            if known is None and now - checked_at < self.ttl:
+                return tables
+            current = known if known is not None else current_data_version()
+            if current == version:
+                self.snapshot = (version, now, *tables)
+                return tables
+
+        version = current_data_version()
+        tables = self._load()
+        with self.lock:
+            self.snapshot = (version, now, *tables)
+        return tables
+
+    def all(self):
+        """Every tag, ordered by name"""
+        return self._current()[0]
+
+    def by_name(self, name):
+        return self._current()[1].get(name)
+
+    def by_id(self):
+        return self._current()[2]
+
+
+class UserCache:
+    """SessionUser per user id, each kept for ttl seconds"""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    def get(self, user_id):
+        now = time.monotonic()
+        entry = self.entries.get(user_id)
+        if entry is not None and now - entry[0] < self.ttl:
+            return entry[1]
+
+        user = db.session.get(User, user_id)
+        snapshot = SessionUser(user.id, user.username, user.is_admin) if user else None
+        with self.lock:
+            if snapshot is None:
+                self.entries.pop(user_id, None)
+            else:
+                self.entries[user_id] = (now, snapshot)
+        return snapshot
+
+    def invalidate(self, user_id=None):
+        with self.lock:
+            if user_id is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(user_id, None)
+
+
+def tag_cache():
+    return current_app.extensions['tag_cache']
+
+
+def user_cache():
+    return current_app.extensions['user_cache']
+
+
+def mark_tags_changed():
+    """Record that the current transaction created tags (see TagCache)"""
+    db.session.info['tags_changed'] = True
+
+
+def init_reference_caches(app):
+    """Create the tag and user caches and keep the tag cache in step with commits"""
+    tags = TagCache(app.config.get('TAG_CACHE_TTL_SECONDS', 30))
+    users = UserCache(app.config.get('USER_CACHE_TTL_SECONDS', 60))
+    app.extensions['tag_cache'] = tags
+    app.extensions['user_cache'] = users
+
+    def _end_transaction(session):
+        if session.info.pop('tags_changed', None):
+            tags.invalidate()
+
+    event.listen(db.session, 'after_commit', _end_transaction)
+    event.listen(db.session, 'after_rollback', _end_transaction)
+    return tags, users
@@ -0,0 +1,376 @@
+"""
+Columnar snapshot of the transactions for analytics.
+
+`flask snapshot` (or POST /api/snapshot) writes every transaction, hot and
+archived, to Arrow IPC files in SNAPSHOT_DIR:
+
+- facts-<generation>-<first id>-<last id>.arrow: the columns of the
+  transactions table, which never change once imported. Each snapshot only
+  appends the transactions imported since the previous one as a new segment.
+- labels-<generation>-<labels version>-<last id>.arrow: tag, pattern
+  membership and archived flag of every transaction, in the same order.
+  Tagging and pattern edits touch old rows, so this small integer file is
+  rewritten each time.
+- manifest.json: the segments, the labels file, the last id and the labels
+  version they were written at, replaced atomically after the data files.
+
+Readers memory-map the files and only touch the pages of the columns they
+ask for. The pattern detection and anomaly endpoints read the snapshot
+instead of the database while its last id is the last transaction id (an
+import makes it stale until the next snapshot) and, when they need labels,
+while its labels version is current. Writes that change tags, pattern
+membership or the archive bump the labels version, and the write path
+rewrites the labels file once they are committed (refresh_labels(): after the
+request, the import pipeline or `flask archive`). Readers never write: until
+then they use the database. With SNAPSHOT_ON_IMPORT each CSV import appends
+its batch right away.
+
+pyarrow is an optional dependency: without it, snapshots cannot be written
+and every reader falls back to the database.
+"""
+import json
+import os
+import threading
+
+from flask import current_app, g, has_app_context
+from sqlalchemy import func, literal, select, union_all
+
+from cache import current_labels_version
+from dimensions import DIMENSIONS, DISPLAY_COLUMNS, display_select
+from models import db, ArchivedTransaction, Pattern, Tag, Transaction, TransactionText, pattern_transactions
+
+FACT_COLUMNS = ('id', 'account_number', 'account_name', 'counterparty_account', 'transaction_number',
+                'accounting_date', 'value_date', 'amount', 'currency', 'description', 'details', 'message')
+
+# Fact columns stored in transaction_texts rather than the transaction tables
+TEXT_COLUMNS = ('details', 'message')
+
+# Rows fetched from the database per record batch
+BATCH_ROWS = 100000
+
+COMPRESSIONS = ('lz4', 'zstd', 'none')
+
+
+class SnapshotUnavailable(RuntimeError):
+    """Snapshots are disabled or pyarrow is not installed"""
+
+
+def _pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.ipc  # noqa: F401
+    except ImportError:
+        raise SnapshotUnavailable('pyarrow is not installed (pip install pyarrow)')
+    return pa
+
+
+def _schemas(pa):
+    facts = pa.schema([
+        ('id', pa.int64()),
+        ('account_number', pa.string()),
+        ('account_name', pa.string()),
+        ('counterparty_account', pa.string()),
+        ('transaction_number', pa.string()),
+        ('accounting_date', pa.date32()),
+        ('value_date', pa.date32()),
+        ('amount', pa.float64()),
+        ('currency', pa.string()),
+        ('description', pa.string()),
+        ('details', pa.string()),
+        ('message', pa.string()),
+    ])
+    labels = pa.schema([
+        ('id', pa.int64()),
+        ('tag_id', pa.int32()),
+        ('tag', pa.dictionary(pa.int32(), pa.string())),
+        ('archived', pa.bool_()),
+        ('pattern_ids', pa.list_(pa.int32())),
+    ])
+    return facts, labels
+
+
+def snapshot_dir():
+    return current_app.config.get('SNAPSHOT_DIR') or ''
+
+
+def read_manifest(directory):
+    try:
+        with open(os.path.join(directory, 'manifest.json')) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def last_transaction_id():
+    """Highest id over the hot and archived transactions (ids are never reused)"""
+    return max(db.session.query(func.max(Transaction.id)).scalar() or 0,
+               db.session.query(func.max(ArchivedTransaction.id)).scalar() or 0)
+
+
+def _write_atomically(path, write):
+    temporary = f'{path}.{os.getpid()}.tmp'
+    write(temporary)
+    os.replace(temporary, path)
+
+
+def _write_ipc(pa, path, schema, batches, compression):
+    def write(temporary):
+        options = pa.ipc.IpcWriteOptions(compression=None if compression == 'none' else compression)
+        with pa.OSFile(temporary, 'wb') as sink, pa.ipc.new_file(sink, schema, options=options) as writer:
+            for batch in batches:
+                writer.write_batch(batch)
+    _write_atomically(path, write)
+
+
+def _fact_batches(pa, schema, after_id):
+    """Record batches of the hot and archived transactions with id > after_id, by id"""
+    hot = Transaction.__table__
+    cold = ArchivedTransaction.__table__
+    # The strings come from the dimension tables (dimensions.py), the text from transaction_texts
+    id_columns = {DIMENSIONS[DISPLAY_COLUMNS[name][0]][3] for name in FACT_COLUMNS if name in DISPLAY_COLUMNS}
+    row_columns = [name for name in FACT_COLUMNS if name not in TEXT_COLUMNS and name not in DISPLAY_COLUMNS]
+    row_columns += sorted(id_columns)
+    rows = union_all(
+        select(*(hot.c[name] for name in row_columns)).where(hot.c.id > after_id),
+        select(*(cold.c[name] for name in row_columns)).where(cold.c.id > after_id),
+    ).subquery()
+    texts = TransactionText.__table__
+    statement = display_select(rows, [name for name in FACT_COLUMNS if name not in TEXT_COLUMNS])
+    fact_columns = [texts.c[name] if name in TEXT_COLUMNS else statement.selected_columns[name]
+                    for name in FACT_COLUMNS]
+    result = db.session.execute(
+        statement.with_only_columns(*fact_columns, maintain_column_froms=False)
+        .outerjoin(texts, texts.c.transaction_id == rows.c.id).order_by(rows.c.id)
+    ).yield_per(BATCH_ROWS)
+    for chunk in result.partitions():
+        columns = list(zip(*chunk))
+        yield pa.record_batch([pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+                              schema=schema)
+
+
+def _label_table(pa, schema):
+    """Tag, archived flag and pattern ids of every transaction, ordered by id"""
+    import numpy as np
+
+    def labelled(table, archived):
+        return (
+            select(table.c.id, table.c.tag_id, Tag.name, literal(archived).label('archived'))
+            .outerjoin(Tag, Tag.id == table.c.tag_id)
+        )
+    rows = union_all(
+        labelled(Transaction.__table__, False),
+        labelled(ArchivedTransaction.__table__, True),
+    ).subquery()
+    ids, tag_ids, tags, archived = [], [], [], []
+    for chunk in db.session.execute(select(rows).order_by(rows.c.id)).yield_per(BATCH_ROWS).partitions():
+        for row in chunk:
+            ids.append(row[0])
+            tag_ids.append(row[1])
+            tags.append(row[2])
+            archived.append(bool(row[3]))
+    ids = np.asarray(ids, dtype=np.int64)
+
+    # Pattern ids as one list per transaction: offsets found by binary search on the sorted ids
+    memberships = db.session.execute(
+        select(pattern_transactions.c.transaction_id, pattern_transactions.c.pattern_id)
+        .join(Pattern, Pattern.id == pattern_transactions.c.pattern_id)
+        .where(Pattern.is_active.is_(True))
+        .order_by(pattern_transactions.c.transaction_id, pattern_transactions.c.pattern_id)
+    ).all()
+    member_ids = np.asarray([m[0] for m in memberships], dtype=np.int64)
+    pattern_ids = np.asarray([m[1] for m in memberships], dtype=np.int32)
+    offsets = np.searchsorted(member_ids, np.append(ids, np.iinfo(np.int64).max)).astype(np.int32)
+
+    return pa.table([
+        pa.array(ids, type=pa.int64()),
+        pa.array(tag_ids, type=pa.int32()),
+        pa.array(tags, type=pa.string()).dictionary_encode(),
+        pa.array(archived, type=pa.bool_()),
+        pa.ListArray.from_arrays(pa.array(offsets), pa.array(pattern_ids, type=pa.int32())),
+    ], schema=schema)
+
+
+def _lock(directory):
+    """Exclusive lock serializing writers across workers and the CLI"""
+    import fcntl
+
+    handle = open(os.path.join(directory, '.lock'), 'w')
+    fcntl.flock(handle, fcntl.LOCK_EX)
+    return handle
+
+
+def write_snapshot(directory=None, full=False, compression=None):
+    """Append new transactions and rewrite the labels; returns the new manifest
+
+    With full, or when the existing snapshot does not line up with the
+    database any more, every segment is rewritten. A snapshot that is already
+    current is returned as it is.
+    """
+    pa = _pyarrow()
+    directory = directory or snapshot_dir()
+    if not directory:
+        raise SnapshotUnavailable('SNAPSHOT_DIR is not set')
+    compression = compression or current_app.config.get('SNAPSHOT_COMPRESSION', 'lz4')
+    if compression not in COMPRESSIONS:
+        raise ValueError(f'compression must be one of {", ".join(COMPRESSIONS)}')
+    os.makedirs(directory, exist_ok=True)
+    facts_schema, labels_schema = _schemas(pa)
+
+    lock = _lock(directory)
+    try:
+        # Read first: anything committed later bumps the version and makes the snapshot stale
+        labels_version = current_labels_version()
+        manifest = None if full else read_manifest(directory)
+        if (manifest is not None and manifest.get('labels_version') == labels_version
+                and manifest['last_id'] == last_transaction_id()):
+            return dict(manifest, appended=0)
+        if manifest is None:
+            generation = (read_manifest(directory) or {}).get('generation', 0) + 1
+            manifest = {'generation': generation, 'last_id': 0, 'rows': 0, 'segments': []}
+
+        segments = list(manifest['segments'])
+        appended = 0
+        batches = list(_fact_batches(pa, facts_schema, manifest['last_id']))
+        if batches:
+            appended = sum(batch.num_rows for batch in batches)
+            first = batches[0].column(0)[0].as_py()
+            last = batches[-1].column(0)[-1].as_py()
+            name = f'facts-{manifest["generation"]}-{first}-{last}.arrow'
+            _write_ipc(pa, os.path.join(directory, name), facts_schema, batches, compression)
+            segments.append({'file': name, 'rows': appended, 'first_id': first, 'last_id': last})
+
+        labels = _label_table(pa, labels_schema)
+        rows = manifest['rows'] + appended
+        if labels.num_rows != rows:
+            # Rows left the database since the last snapshot: start a new generation
+            lock.close()
+            lock = None
+            return write_snapshot(directory, full=True, compression=compression)
+
+        last_id = segments[-1]['last_id'] if segments else 0
+        labels_name = f'labels-{manifest["generation"]}-{labels_version}-{last_id}.arrow'
+        _write_ipc(pa, os.path.join(directory, labels_name), labels_schema, labels.to_batches(), compression)
+
+        new_manifest = {
+            'generation': manifest['generation'],
+            'labels_version': labels_version,
+            'last_id': last_id,
+            'rows': rows,
+            'appended': appended,
+            'compression': compression,
+            'segments': segments,
+            'labels': labels_name,
+        }
+        _write_atomically(os.path.join(directory, 'manifest.json'),
+                          lambda path: _dump(new_manifest, path))
+
+        # Files of older generations and labels are no longer referenced
+        keep = {s['file'] for s in segments} | {labels_name}
+        for name in os.listdir(directory):
+            if name.endswith('.arrow') and name not in keep:
+                os.remove(os.path.join(directory, name))
+        return new_manifest
+    finally:
+        if lock is not None:
+            lock.close()
+
+
+def _dump(manifest, path):
+    with open(path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+
+class SnapshotReader:
+    """Memory-mapped tables of one manifest, kept open while it is current"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.key = None
+        self.tables = None
+
+    def tables_for(self, directory, manifest):
+        """(facts, labels) pyarrow tables of the manifest's files"""
+        key = (directory, manifest['generation'], manifest['labels'], manifest['last_id'])
+        with self.lock:
+            if self.key != key:
+                pa = _pyarrow()
+
+                def open_table(name):
+                    return pa.ipc.open_file(pa.memory_map(os.path.join(directory, name))).read_all()
+                facts = [open_table(segment['file']) for segment in manifest['segments']]
+                facts = pa.concat_tables(facts) if facts else _schemas(pa)[0].empty_table()
+                self.tables = (facts, open_table(manifest['labels']))
+                self.key = key
+            return self.tables
+
+
+_reader = SnapshotReader()
+
+
+def refresh_labels():
+    """Rewrite the labels of a snapshot that holds every transaction; returns its manifest or None
+
+    Called by the write path once a labels version bump is committed. A
+    snapshot missing imported transactions is left to `flask snapshot` or
+    SNAPSHOT_ON_IMPORT.
+    """
+    if not current_app.config.get('SNAPSHOT_ANALYTICS'):
+        return None
+    directory = snapshot_dir()
+    if not directory:
+        return None
+    manifest = read_manifest(directory)
+    if manifest is None or manifest['last_id'] != last_transaction_id():
+        return None
+    try:
+        return write_snapshot(directory)
+    except (SnapshotUnavailable, OSError) as e:
+        current_app.logger.warning('Snapshot labels not rewritten: %s', e)
+        return None
+
+
+def init_snapshot(app):
+    """Rewrite the snapshot labels after each request that committed a labels version bump"""
+    @app.after_request
+    def _refresh_labels(response):
+        if g.pop('labels_bumped', False) and response.status_code < 400:
+            refresh_labels()
+        return response
+
+
+def current_snapshot(labels=True):
+    """(facts, labels) when analytics may read the snapshot, else None
+
+    The snapshot must be enabled, readable with pyarrow and hold every
+    transaction, and with labels its labels version must be current.
+    """
+    if not has_app_context() or not current_app.config.get('SNAPSHOT_ANALYTICS'):
+        return None
+    directory = snapshot_dir()
+    if not directory:
+        return None
+    manifest = read_manifest(directory)
+    if manifest is None or manifest['last_id'] != last_transaction_id():
+        return None
+    if labels and manifest.get('labels_version') != current_labels_version():
+        return None
+    try:
+        return _reader.tables_for(directory, manifest)
+    except (SnapshotUnavailable, OSError) as e:
+        current_app.logger.warning('Snapshot unreadable, using the database: %s', e)
+        return None
+
+
+def snapshot_frame(fact_columns=(), label_columns=()):
+    """DataFrame of the requested fact and label columns from the current snapshot, or None
+
+    Dates come back as datetime.date objects, like the database rows.
+    """
+    tables = current_snapshot(labels=bool(label_columns))
+    if tables is None:
+        return None
+    facts, labels = tables
+    frame = facts.select(list(fact_columns)).to_pandas(date_as_object=True)
+    for name in label_columns:
+        frame[name] = labels.column(name).to_pandas()
+    return frame
@@ -0,0 +1,120 @@
+"""
+Dialect-specific SQL fragments for date bucketing.
+
+The summary views and period queries group transactions by day, week, month
+and year. SQLite only has strftime, PostgreSQL has date_trunc/to_char; both
+produce the same text labels so the rest of the app does not care which
+backend is in use.
+"""
+from sqlalchemy import Integer, text
+
+# Week numbers follow SQLite's %W: weeks start on Monday, days before the
+# first Monday of the year are week 00.
+_PG_WEEK = ("LPAD(CAST(FLOOR((EXTRACT(DOY FROM {col}) + 6 - "
+            "MOD(CAST(EXTRACT(DOW FROM {col}) AS INTEGER) + 6, 7)) / 7) AS INTEGER)::text, 2, '0')")
+
+PERIOD_EXPRESSIONS = {
+    'sqlite': {
+        'day_key': "strftime('%Y-%m-%d', {col})",
+        'week_key': "strftime('%Y-W%W', {col})",
+        'month_key': "strftime('%Y-%m', {col})",
+        'year_key': "strftime('%Y', {col})",
+        'year': "strftime('%Y', {col})",
+        'month': "strftime('%m', {col})",
+        'week': "strftime('%W', {col})",
+        'day': "strftime('%d', {col})",
+        'day_of_week': "strftime('%w', {col})",
+    },
+    'postgresql': {
+        'day_key': "to_char(date_trunc('day', {col}), 'YYYY-MM-DD')",
+        'week_key': "to_char({col}, 'YYYY') || '-W' || " + _PG_WEEK,
+        'month_key': "to_char(date_trunc('month', {col}), 'YYYY-MM')",
+        'year_key': "to_char(date_trunc('year', {col}), 'YYYY')",
+        'year': "to_char({col}, 'YYYY')",
+        'month': "to_char({col}, 'MM')",
+        'week': _PG_WEEK,
+        'day': "to_char({col}, 'DD')",
+        'day_of_week': "CAST(EXTRACT(DOW FROM {col}) AS INTEGER)::text",
+    },
+}
+
+
+def period_expressions(dialect_name, col='accounting_date'):
+    """Return the date bucketing expressions for a dialect, applied to col"""
+    if dialect_name not in PERIOD_EXPRESSIONS:
+        raise ValueError(f'Unsupported database dialect {dialect_name!r}')
+    return {name: expr.format(col=col) for name, expr in PERIOD_EXPRESSIONS[dialect_name].items()}
+
+
+# Expression each granularity groups by, and the calendar columns it reports
+GRANULARITY_KEYS = {
+    'day': 'day_key',
+    'week': 'week_key',
+    'month': 'month_key',
+    'year': 'year_key',
+}
+
+GRANULARITY_COLUMNS = {
+    'day': ['year', 'month', 'day', 'day_of_week'],
+    'week': ['year', 'week'],
+    'month': ['year', 'month'],
+    'year': ['year'],
+}
+
+CALENDAR_COLUMNS = ['year', 'month', 'week', 'day', 'day_of_week']
+
+# Column layout shared by summary_select, the summary views and archived_summary
+SUMMARY_COLUMNS = ['period'] + CALENDAR_COLUMNS + [
+    'total_in', 'total_out', 'balance', 'transaction_count',
+    'recurrent_in', 'recurrent_out', 'discretionary', 'period_start', 'period_end'
+]
+
+# Transactions of the active validated patterns, each once however many patterns
+# (merged or not) list it
+RECURRENT_IDS = """
+    SELECT DISTINCT pattern_transactions.transaction_id
+    FROM pattern_transactions JOIN patterns ON patterns.id = pattern_transactions.pattern_id
+    WHERE patterns.is_active
+"""
+
+
+def recurrent_ids():
+    """RECURRENT_IDS as a SELECT of transaction_id, for joins and IN clauses"""
+    return text(RECURRENT_IDS).columns(transaction_id=Integer)
+
+
+def summary_select(dialect_name, granularity, table='transactions', where=None):
+    """SELECT aggregating table per period, producing SUMMARY_COLUMNS
+
+    Pattern membership comes from a single join of RECURRENT_IDS, so the
+    recurrent columns follow validations and deletions of patterns.
+    """
+    p = period_expressions(dialect_name)
+    key = p[GRANULARITY_KEYS[granularity]]
+
+    columns = [f'{key} AS period']
+    for col in CALENDAR_COLUMNS:
+        if col in GRANULARITY_COLUMNS[granularity]:
+            columns.append(f'MIN({p[col]}) AS {col}')
+        else:
+            columns.append(f'NULL AS {col}')
+    columns += [
+        'SUM(CASE WHEN amount > 0 THEN amount ELSE 0 END) AS total_in',
+        'SUM(CASE WHEN amount < 0 THEN ABS(amount) ELSE 0 END) AS total_out',
+        'SUM(amount) AS balance',
+        'COUNT(*) AS transaction_count',
+        # Income and expenses of pattern transactions, and the other expenses
+        'SUM(CASE WHEN recurrent.transaction_id IS NOT NULL AND amount > 0 THEN amount ELSE 0 END) AS recurrent_in',
+        'SUM(CASE WHEN recurrent.transaction_id IS NOT NULL AND amount < 0 THEN ABS(amount) ELSE 0 END)'
+        ' AS recurrent_out',
+        'SUM(CASE WHEN recurrent.transaction_id IS NULL AND amount < 0 THEN ABS(amount) ELSE 0 END)'
+        ' AS discretionary',
+        'MIN(accounting_date) AS period_start',
+        'MAX(accounting_date) AS period_end',
+    ]
+
+    sql = (f"SELECT {', '.join(columns)} FROM {table}"
+           f" LEFT JOIN ({RECURRENT_IDS}) recurrent ON recurrent.transaction_id = {table}.id")
+    if where:
+        sql += f' WHERE {where}'
+    return sql + f' GROUP BY {key}'
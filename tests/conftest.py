@@ -0,0 +1,75 @@
+"""
+Shared fixtures: the app on a temporary SQLite database, without the
+response cache or the analytics snapshot, and a logged-in client.
+"""
+import os
+import sys
+import tempfile
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The configuration is read when app is imported
+os.environ['SQLITE_PATH'] = os.path.join(tempfile.mkdtemp(prefix='myfin-tests-'), 'test.db')
+os.environ.update(RESPONSE_CACHE='off', SNAPSHOT_ANALYTICS='0', SNAPSHOT_DIR='', METRICS_ENABLED='0')
+for name in ('DATABASE_URL', 'DATABASE_READ_URL'):
+    os.environ.pop(name, None)
+
+import pytest
+from sqlalchemy import insert
+
+from app import app as flask_app
+from cache import bump_data_version
+from dimensions import DimensionLookup
+from models import db, Tag, Transaction, User
+
+ACCOUNTS = ('BE00 1111 2222 3333', 'BE00 4444 5555 6666')
+DESCRIPTIONS = ('SUPERMARKET', 'BAKERY', 'FUEL STATION', 'SALARY ACME', 'RENT LANDLORD')
+
+
+@pytest.fixture
+def app():
+    """The app on an empty database"""
+    with flask_app.app_context():
+        db.drop_all()
+        db.create_all()
+        user = User(username='test', is_admin=True)
+        user.set_password('test')
+        db.session.add(user)
+        db.session.commit()
+    yield flask_app
+    with flask_app.app_context():
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    """Test client logged in as an admin"""
+    client = app.test_client()
+    client.post('/login', data={'username': 'test', 'password': 'test'})
+    return client
+
+
+def add_transactions(count, first_day=date(2024, 1, 1)):
+    """Insert count synthetic transactions (every third one tagged) and bump the data version"""
+    dimensions = DimensionLookup()
+    tags = [Tag(name=name) for name in ('Food', 'Home') if not Tag.query.filter_by(name=name).first()]
+    db.session.add_all(tags)
+    db.session.flush()
+    tag_ids = [tag.id for tag in Tag.query.order_by(Tag.id)]
+    start = Transaction.query.count()
+    rows = []
+    for i in range(start, start + count):
+        amount = 2500.0 if i % 10 == 0 else -round(5 + (i * 7) % 90 + 0.5, 2)
+        rows.append(dict(
+            transaction_number=str(i),
+            accounting_date=first_day + timedelta(days=i % 360),
+            value_date=first_day + timedelta(days=i % 360),
+            amount=amount,
+            description=DESCRIPTIONS[i % len(DESCRIPTIONS)],
+            tag_id=tag_ids[i % len(tag_ids)] if i % 3 == 0 else None,
+            **dimensions.encode(ACCOUNTS[i % 2], 'Main', f'BE99 {i % 4:04d}', 'EUR'),
+        ))
+    db.session.execute(insert(Transaction), rows)
+    bump_data_version()
+    db.session.commit()
@@ -0,0 +1,139 @@
+"""
+The summary views and the RETURNING inserts on each backend.
+
+SQLite runs on a temporary file. PostgreSQL runs when TEST_POSTGRES_URL
+points to a scratch database (its tables and views are dropped and
+recreated), and is skipped otherwise. Both must produce the period labels
+SQLite's strftime gives, which Python's strftime reproduces.
+"""
+import os
+from datetime import date
+
+import pytest
+from sqlalchemy import create_engine, insert, text
+
+from dimensions import DimensionLookup
+from init_views import VIEW_NAMES, build_view_statements
+from models import db, Pattern, Transaction, pattern_transactions
+
+FORMATS = {'day': '%Y-%m-%d', 'week': '%Y-W%W', 'month': '%Y-%m', 'year': '%Y'}
+
+# Year starts on each weekday (2023 on a Sunday, 2024 on a Monday, 2022 on a
+# Saturday), the last days of a year and a leap day
+DAYS = [date(2022, 1, 1), date(2022, 1, 3), date(2022, 12, 31), date(2023, 1, 1), date(2023, 1, 2),
+        date(2023, 1, 8), date(2023, 1, 9), date(2024, 1, 1), date(2024, 1, 7), date(2024, 2, 29),
+        date(2024, 12, 30), date(2024, 12, 31), date(2025, 1, 1), date(2026, 1, 4)]
+
+# transaction index -> patterns listing it: active in both, active in one, inactive only
+ACTIVE, ALSO_ACTIVE, INACTIVE = 0, 1, 2
+MEMBERSHIP = {0: (ACTIVE, ALSO_ACTIVE), 1: (ACTIVE,), 2: (INACTIVE,), 5: (ALSO_ACTIVE, INACTIVE)}
+
+
+def _drop_views(connection):
+    for view in VIEW_NAMES.values():
+        connection.execute(text(f'DROP VIEW IF EXISTS {view}'))
+
+
+@pytest.fixture(params=['sqlite', 'postgresql'])
+def engine(request, tmp_path):
+    """Engine on an empty database with the app's tables and summary views"""
+    if request.param == 'sqlite':
+        url = f"sqlite:///{tmp_path / 'views.db'}"
+    else:
+        url = os.environ.get('TEST_POSTGRES_URL')
+        if not url:
+            pytest.skip('TEST_POSTGRES_URL is not set')
+    engine = create_engine(url)
+    with engine.begin() as connection:
+        _drop_views(connection)
+        db.metadata.drop_all(connection)
+        db.metadata.create_all(connection)
+        for _, sql in build_view_statements(engine.dialect.name):
+            connection.execute(text(sql))
+    yield engine
+    with engine.begin() as connection:
+        _drop_views(connection)
+        db.metadata.drop_all(connection)
+    engine.dispose()
+
+
+def _amount(i):
+    return 1000.0 + i if i % 4 == 0 else -(10.25 + i)
+
+
+def _load(connection):
+    """Insert a transaction per day of DAYS and the patterns of MEMBERSHIP"""
+    account_id = DimensionLookup(connection).id('account', 'BE00 1111 2222 3333', name='Main')
+    ids = connection.execute(
+        insert(Transaction).returning(Transaction.id, sort_by_parameter_order=True),
+        [dict(accounting_date=day, amount=_amount(i), account_id=account_id) for i, day in enumerate(DAYS)],
+    ).scalars().all()
+    pattern_ids = connection.execute(
+        insert(Pattern).returning(Pattern.id, sort_by_parameter_order=True),
+        [dict(name='Rent', is_active=True), dict(name='Salary', is_active=True),
+         dict(name='Rejected', is_active=False)],
+    ).scalars().all()
+    connection.execute(insert(pattern_transactions), [
+        dict(pattern_id=pattern_ids[pattern], transaction_id=ids[i])
+        for i, patterns in MEMBERSHIP.items() for pattern in patterns
+    ])
+
+
+def _expected(granularity):
+    """{period: (total_in, total_out, count, recurrent_in, recurrent_out, discretionary)}"""
+    totals = {}
+    for i, day in enumerate(DAYS):
+        amount = _amount(i)
+        recurrent = any(pattern != INACTIVE for pattern in MEMBERSHIP.get(i, ()))
+        row = totals.setdefault(day.strftime(FORMATS[granularity]), [0, 0, 0, 0, 0, 0])
+        row[0] += max(amount, 0)
+        row[1] += max(-amount, 0)
+        row[2] += 1
+        row[3] += max(amount, 0) if recurrent else 0
+        row[4] += max(-amount, 0) if recurrent else 0
+        row[5] += 0 if recurrent else max(-amount, 0)
+    return {period: tuple(values) for period, values in totals.items()}
+
+
+@pytest.mark.parametrize('granularity', list(VIEW_NAMES))
+def test_summary_views(engine, granularity):
+    with engine.begin() as connection:
+        _load(connection)
+        rows = connection.execute(text(
+            f'SELECT period, total_in, total_out, transaction_count, recurrent_in, recurrent_out, discretionary'
+            f' FROM {VIEW_NAMES[granularity]} ORDER BY period'
+        )).all()
+    actual = {row[0]: tuple(row[1:]) for row in rows}
+    expected = _expected(granularity)
+    assert list(actual) == sorted(expected)
+    for period, values in expected.items():
+        assert actual[period] == pytest.approx(values), period
+
+
+def test_week_columns(engine):
+    """The week view's week column is the %W of its label, as on SQLite"""
+    with engine.begin() as connection:
+        _load(connection)
+        rows = connection.execute(text('SELECT period, year, week FROM weekly_summary')).all()
+    assert {row[0]: (row[1], row[2]) for row in rows} == {
+        day.strftime('%Y-W%W'): (day.strftime('%Y'), day.strftime('%W')) for day in DAYS
+    }
+
+
+def test_dimension_ids_returned(engine):
+    """DimensionLookup reads the id of each new value from its INSERT ... RETURNING"""
+    with engine.begin() as connection:
+        lookup = DimensionLookup(connection)
+        first = lookup.id('currency', 'EUR')
+        second = lookup.id('currency', 'USD')
+        assert lookup.id('currency', 'EUR') == first
+        assert lookup.id('currency', '') is None
+        account = lookup.id('account', 'BE00 4444 5555 6666', name='Savings')
+        stored = dict(connection.execute(text('SELECT code, id FROM currencies')).all())
+        name = connection.execute(
+            text('SELECT name FROM bank_accounts WHERE id = :id'), {'id': account}).scalar_one()
+    assert first != second
+    assert stored == {'EUR': first, 'USD': second}
+    assert name == 'Savings'
+    with engine.connect() as connection:
+        assert DimensionLookup(connection).ids['currency'] == stored
@@ -0,0 +1,61 @@
+"""
+The transaction list endpoints run a fixed number of SQL statements however
+many rows they return (query_builder.py): no lazy tag SELECT per row.
+"""
+import threading
+
+import pytest
+from sqlalchemy import event
+
+from conftest import add_transactions
+from models import db
+
+ENDPOINTS = (
+    '/analyze?search=a',
+    '/api/find-patterns?search=a',
+    '/api/get-search-results?search=a',
+)
+
+
+class StatementCounter:
+    """Counts the statements run on the engine, from any thread"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def _count(self, *args):
+        with self.lock:
+            self.count += 1
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._count)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._count)
+
+
+def statements(app, client, url):
+    """Statements run by a GET of url, after a warm-up request has filled the caches"""
+    assert client.get(url).status_code == 200
+    with app.app_context():
+        engine = db.engine
+    with StatementCounter(engine) as counter:
+        response = client.get(url)
+    assert response.status_code == 200
+    return counter.count
+
+
+@pytest.mark.parametrize('url', ENDPOINTS)
+def test_statement_count_does_not_grow_with_rows(app, client, url):
+    with app.app_context():
+        add_transactions(20)
+    small = statements(app, client, url)
+
+    with app.app_context():
+        add_transactions(400)
+    large = statements(app, client, url)
+
+    assert small == large
@@ -0,0 +1,262 @@
+"""
+Transfers between own accounts.
+
+Money moved from one of our accounts to another is imported twice: as an
+expense on the sending account and as income on the receiving one, which
+inflated every income and expense total. detect_transfers() pairs each
+outgoing leg with its mirror: an incoming transaction of the same amount (to
+the cent) on the account the outgoing leg names as its counterparty, booked
+within TRANSFER_WINDOW_DAYS. The incoming leg's own counterparty is not
+checked: banks often leave it empty or write it differently. Own accounts are
+the imported accounts (bank_accounts); a counterparty is one of them when
+its account number matches, compared without spaces or case.
+
+Only transactions not paired yet are candidates. Outgoing and incoming legs
+are joined on (receiving account id, cents) with a sorted nearest-date join
+(pandas merge_asof). When two outgoing legs pick the same incoming one, the
+closer pair wins and the other retries against the legs left, so regular
+transfers of one amount pair up in date order.
+
+Pairs are stored in transfer_pairs with their amount and both dates. The
+aggregates take transfers out (?transfers=exclude) by subtracting the pair
+totals of each day or period. That works for the frozen aggregates of
+archived years too, without touching the rows. A rejected pair stays in the
+table, inactive, so it is not detected again.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from flask import current_app, request
+from sqlalchemy import and_, case, func, insert, or_, select, union, union_all
+
+from archive import transaction_source
+from models import db, BankAccount, Counterparty, TransferPair
+from sql_dialect import recurrent_ids
+
+# Same keys as the summary views
+PERIOD_FORMATS = {'day': '%Y-%m-%d', 'week': '%Y-W%W', 'month': '%Y-%m', 'year': '%Y'}
+
+
+def exclude_requested(args=None):
+    """Whether the request asks for aggregates without transfers (?transfers=exclude)"""
+    return (args if args is not None else request.args).get('transfers') == 'exclude'
+
+
+def _account_key(column):
+    return func.replace(func.upper(column), ' ', '')
+
+
+def own_counterparties():
+    """{counterparty id: account id} of the counterparties that are imported accounts"""
+    return dict(db.session.execute(
+        select(Counterparty.id, BankAccount.id)
+        .join(BankAccount, _account_key(BankAccount.number) == _account_key(Counterparty.account))
+    ).all())
+
+
+def _candidates(own, dates=None):
+    """DataFrames (outgoing, incoming) of the unpaired candidate legs
+
+    Outgoing legs are expenses whose counterparty is another own account (own
+    maps it to its account id), incoming legs any income (every account is an
+    own account). dates optionally bounds their accounting dates as a (first,
+    last) pair.
+    """
+    import pandas as pd
+
+    T = transaction_source(dates[0] if dates else None)
+    paired = union(select(TransferPair.out_transaction_id), select(TransferPair.in_transaction_id))
+    statement = (
+        select(T.id, T.account_id, T.counterparty_id, T.accounting_date, T.amount)
+        .where(or_(and_(T.amount < 0, T.counterparty_id.in_(list(own))), T.amount > 0), T.id.not_in(paired))
+    )
+    if dates:
+        statement = statement.where(T.accounting_date.between(*dates))
+    rows = db.session.execute(statement).all()
+    frame = pd.DataFrame(rows, columns=['id', 'account', 'counterparty', 'date', 'amount'])
+    frame['date'] = pd.to_datetime(frame['date'])
+    frame['cents'] = (frame['amount'].abs() * 100).round().astype('int64')
+
+    outgoing = frame[frame['amount'] < 0]
+    outgoing = outgoing.assign(receiver=outgoing['counterparty'].map(own))
+    outgoing = outgoing[outgoing['account'] != outgoing['receiver']]
+    incoming = frame[(frame['amount'] > 0) & frame['cents'].isin(outgoing['cents'])]
+    # Both legs are keyed on the receiving account: the outgoing leg's counterparty,
+    # the incoming leg's own account (its counterparty may be empty or written differently)
+    return outgoing, incoming.assign(receiver=incoming['account'])
+
+
+def detect_transfers(window_days=None, ids=None):
+    """Pair the unpaired transfer legs and store the pairs; returns how many were found
+
+    With an IdRange, only legs dated within the window of its transactions'
+    dates are considered. Does not commit: the caller bumps the data version
+    and commits.
+    """
+    import pandas as pd
+
+    if window_days is None:
+        window_days = current_app.config.get('TRANSFER_WINDOW_DAYS', 3)
+    own = own_counterparties()
+    if not own:
+        return 0
+
+    dates = None
+    if ids is not None:
+        T = transaction_source()
+        first, last = db.session.execute(
+            select(func.min(T.accounting_date), func.max(T.accounting_date))
+            .where(T.id.between(ids.first, ids.last))
+        ).one()
+        if first is None:
+            return 0
+        dates = (first - timedelta(days=window_days), last + timedelta(days=window_days))
+
+    outgoing, incoming = _candidates(own, dates)
+    tolerance = pd.Timedelta(days=window_days)
+
+    matches = []
+    while not outgoing.empty and not incoming.empty:
+        left = outgoing[['id', 'receiver', 'cents', 'date']].sort_values('date')
+        right = (incoming[['id', 'receiver', 'cents', 'date']]
+                 .assign(in_date=incoming['date'])
+                 .rename(columns={'id': 'in_id'})
+                 .sort_values('date'))
+        nearest = pd.merge_asof(left, right, on='date', by=['receiver', 'cents'],
+                                tolerance=tolerance, direction='nearest').dropna(subset=['in_id'])
+        if nearest.empty:
+            break
+        # One outgoing leg per incoming leg: the closest in time, then the oldest id
+        nearest = (nearest.assign(gap=(nearest['in_date'] - nearest['date']).abs())
+                   .sort_values(['gap', 'id'])
+                   .drop_duplicates('in_id'))
+        matches.append(nearest)
+        outgoing = outgoing[~outgoing['id'].isin(nearest['id'])]
+        incoming = incoming[~incoming['id'].isin(nearest['in_id'])]
+
+    if not matches:
+        return 0
+    pairs = pd.concat(matches)
+    db.session.execute(insert(TransferPair), [
+        {
+            'out_transaction_id': int(out_id),
+            'in_transaction_id': int(in_id),
+            'amount': cents / 100,
+            'out_date': out_date.date(),
+            'in_date': in_date.date(),
+        }
+        for out_id, in_id, cents, out_date, in_date in zip(
+            pairs['id'], pairs['in_id'], pairs['cents'], pairs['date'], pairs['in_date'])
+    ])
+    return len(pairs)
+
+
+def _active():
+    return TransferPair.is_active.is_(True)
+
+
+def transfer_leg_ids():
+    """SELECT of the ids of both legs of every active pair"""
+    return union_all(
+        select(TransferPair.out_transaction_id).where(_active()),
+        select(TransferPair.in_transaction_id).where(_active()),
+    )
+
+
+def transfer_total():
+    """Amount moved between own accounts over all of history (once in, once out)"""
+    return db.session.query(func.sum(TransferPair.amount)).filter(_active()).scalar() or 0
+
+
+def transfer_day_totals():
+    """{date: (incoming, outgoing, legs)} of the active pairs"""
+    totals = defaultdict(lambda: [0, 0, 0])
+    for column, side in ((TransferPair.in_date, 0), (TransferPair.out_date, 1)):
+        for day, amount, legs in db.session.query(column, func.sum(TransferPair.amount), func.count()) \
+                .filter(_active()).group_by(column):
+            totals[day][side] += amount
+            totals[day][2] += legs
+    return {day: tuple(values) for day, values in totals.items()}
+
+
+def transfer_period_totals(granularity):
+    """{period key: (incoming, outgoing, legs)} with the summary views' period keys"""
+    totals = defaultdict(lambda: [0, 0, 0])
+    for day, values in transfer_day_totals().items():
+        period = totals[day.strftime(PERIOD_FORMATS[granularity])]
+        for i, value in enumerate(values):
+            period[i] += value
+    return {key: tuple(values) for key, values in totals.items()}
+
+
+def recurrent_transfer_period_totals(granularity):
+    """{period key: (incoming, outgoing)} of the legs of active pairs that belong to an active pattern"""
+    recurrent = recurrent_ids()
+    totals = defaultdict(lambda: [0, 0])
+    for leg, column, side in ((TransferPair.in_transaction_id, TransferPair.in_date, 0),
+                              (TransferPair.out_transaction_id, TransferPair.out_date, 1)):
+        for day, amount in db.session.query(column, func.sum(TransferPair.amount)) \
+                .filter(_active(), leg.in_(recurrent)).group_by(column):
+            totals[day.strftime(PERIOD_FORMATS[granularity])][side] += amount
+    return {key: tuple(values) for key, values in totals.items()}
+
+
+def transfer_tag_totals():
+    """{tag_id: (total, count, total_in, total_out)} of the tagged legs of active pairs"""
+    T = transaction_source()
+    legs = transfer_leg_ids().subquery()
+    amount = T.amount
+    rows = db.session.execute(
+        select(T.tag_id, func.sum(amount), func.count(),
+               func.sum(case((amount > 0, amount), else_=0)),
+               func.sum(case((amount < 0, -amount), else_=0)))
+        .join(legs, legs.c.out_transaction_id == T.id)
+        .where(T.tag_id.is_not(None))
+        .group_by(T.tag_id)
+    ).all()
+    return {row[0]: tuple(row[1:]) for row in rows}
+
+
+def without_transfers(days):
+    """daily_totals() rows minus the transfer legs of each day"""
+    moved = transfer_day_totals()
+    if not moved:
+        return days
+    result = []
+    for day, total_in, total_out in days:
+        moved_in, moved_out, _ = moved.get(day, (0, 0, 0))
+        result.append((day, total_in - moved_in, total_out - moved_out))
+    return result
+
+
+def list_transfers(limit=200):
+    """Active pairs with both legs, newest first"""
+    from sqlalchemy.orm import aliased
+
+    source = transaction_source()
+    out_leg = aliased(source)
+    in_leg = aliased(source)
+    out_account = aliased(BankAccount)
+    in_account = aliased(BankAccount)
+    rows = db.session.execute(
+        select(TransferPair.id, TransferPair.amount,
+               out_leg.accounting_date, out_account.number, out_leg.description,
+               in_leg.accounting_date, in_account.number, in_leg.description,
+               TransferPair.out_transaction_id, TransferPair.in_transaction_id)
+        .join(out_leg, out_leg.id == TransferPair.out_transaction_id)
+        .join(in_leg, in_leg.id == TransferPair.in_transaction_id)
+        .join(out_account, out_account.id == out_leg.account_id)
+        .join(in_account, in_account.id == in_leg.account_id)
+        .where(_active())
+        .order_by(TransferPair.out_date.desc(), TransferPair.id.desc())
+        .limit(limit)
+    ).all()
+    return [
+        {
+            'id': row[0],
+            'amount': row[1],
+            'out': {'id': row[8], 'date': row[2].isoformat(), 'account': row[3], 'description': row[4]},
+            'in': {'id': row[9], 'date': row[5].isoformat(), 'account': row[6], 'description': row[7]},
+        }
+        for row in rows
+    ]